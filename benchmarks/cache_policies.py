@@ -0,0 +1,188 @@
+"""
+    Compares the hit ratio of exact and approximate LRU session cache policies on an access trace.
+
+    A trace is a JSON lines file of `[time, session, key]` accesses of the
+    cached `part_layers` (times in seconds). By default, a trace is generated
+    from a seeded model of the load test's request mix - sessions which view
+    the six parts of (mostly popular) users' avatars and draw random DNAs, with
+    think times between operations - and can be saved with --record and
+    replayed later (or on another commit) with --trace.
+
+    Every policy replays the trace on the app's LRUSessionCache, one cache per
+    session, on a clock which follows the trace's times. The hit ratio and the
+    cache writes per access (the entries stored or refreshed, which cost a
+    cookie rewrite or an SQL UPDATE in the app) of every policy are compared with
+    exact LRU.
+
+    Example:
+        python benchmarks/cache_policies.py --record trace.jsonl --sizes 10 64
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server')
+sys.path.insert(0, SERVER_DIR)
+
+SEED = 0    # the seed of the generated trace and of the sampled evictions
+SESSIONS = 200  # the sessions of a generated trace
+OPERATIONS_PER_SESSION = 150    # the operations of each session of a generated trace
+MEAN_THINK_TIME = 4     # the mean seconds between the operations of a session
+USER_POPULARITY_SKEW = 1.1  # the zipf exponent of the users' popularity
+CACHE_SIZES = (10, 64)
+EXACT_LRU = 'exact'
+
+# operation name -> relative weight in the modeled mix, as in the load test
+OPERATION_WEIGHTS = {
+    'avatar': 4,    # the six part fetches of a user's avatar
+    'draw': 1,      # the six part fetches of a drawn DNA
+}
+# policy name -> the approximate LRU options of the cache
+POLICIES = {
+    EXACT_LRU: {},
+    'recency 5s': {'recency_interval': 5},
+    'recency 30s': {'recency_interval': 30},
+    'sampled 3': {'eviction_samples': 3},
+    'sampled 5': {'eviction_samples': 5},
+    'recency 5s, sampled 5': {'recency_interval': 5, 'eviction_samples': 5},
+    'recency 30s, sampled 5': {'recency_interval': 30, 'eviction_samples': 5},
+}
+
+
+class TraceClock:
+    """The current time of a replayed trace"""
+    def __init__(self):
+        self.time = 0.0
+
+
+def make_trace_cache(clock):
+    """Makes an LRUSessionCache type which runs on a trace clock and counts it's writes"""
+    from app.modules.user_cache import LRUSessionCache
+
+    class TraceCache(LRUSessionCache):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.writes = 0
+
+        def _now(self):
+            return clock.time
+
+        def _store(self, key, value):
+            self.writes += 1
+            super()._store(key, value)
+
+    return TraceCache
+
+
+def generate_trace(rng):
+    """Generates accesses of sessions following the modeled request mix
+
+    Returns:
+        list: the [time, session, key] accesses, ordered by time
+    """
+    from app.config import USER_COUNT
+    from app.config.avatar import Avatar
+
+    avatars = [Avatar.randomize(rng) for _ in range(USER_COUNT)]
+    popularity = [1 / (rank + 1) ** USER_POPULARITY_SKEW for rank in range(USER_COUNT)]
+    operations = list(OPERATION_WEIGHTS)
+    weights = [OPERATION_WEIGHTS[operation] for operation in operations]
+
+    trace = []
+    for session in range(SESSIONS):
+        now = rng.uniform(0, OPERATIONS_PER_SESSION * MEAN_THINK_TIME)
+        for _ in range(OPERATIONS_PER_SESSION):
+            now += rng.expovariate(1 / MEAN_THINK_TIME)
+            if rng.choices(operations, weights)[0] == 'avatar':
+                avatar = rng.choices(avatars, popularity)[0]
+            else:
+                avatar = Avatar.randomize(rng)
+            for part in avatar.body_parts:
+                trace.append([round(now, 3), session, part.to_bitstring() + type(part).__name__])
+    trace.sort(key=lambda access: access[0])
+    return trace
+
+
+def replay(trace, size, options):
+    """Replays a trace on per-session caches of a policy
+
+    Returns:
+        dict: the hit ratio and the writes per access of the policy
+    """
+    from flask import Flask, session
+
+    clock = TraceClock()
+    trace_cache = make_trace_cache(clock)
+    cache = trace_cache(max_size=size, **options)
+    misses = 0
+
+    def compute(key):
+        nonlocal misses
+        misses += 1
+        return key
+
+    cached = cache(compute)
+    session_caches = {}
+    random.seed(SEED)
+    app = Flask(__name__)
+    app.secret_key = b'trace'
+    with app.test_request_context():
+        for time, ssid, key in trace:
+            clock.time = time
+            session[cache.cache_name] = session_caches.setdefault(ssid, {})
+            cached(key)
+    return {
+        'hit_ratio': round(1 - misses / len(trace), 4),
+        'writes_per_access': round(cache.writes / len(trace), 4),
+    }
+
+
+def load_trace(path):
+    with open(path) as trace_file:
+        return [json.loads(line) for line in trace_file if line.strip()]
+
+
+def save_trace(trace, path):
+    with open(path, 'w') as trace_file:
+        for access in trace:
+            trace_file.write(json.dumps(access) + '\n')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trace', default=None, help='a recorded trace to replay (defaults to a generated trace)')
+    parser.add_argument('--record', default=None, help='path to save the replayed trace at')
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(CACHE_SIZES), help='the compared cache sizes')
+    parser.add_argument('--output', default=None, help='path of a JSON results file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.trace is not None:
+        trace = load_trace(args.trace)
+    else:
+        trace = generate_trace(random.Random(SEED))
+    if args.record is not None:
+        save_trace(trace, args.record)
+    print(f'Replaying {len(trace)} accesses of {len({access[1] for access in trace})} sessions')
+
+    results = {'accesses': len(trace), 'sizes': {}}
+    for size in args.sizes:
+        print(f'size {size}:')
+        results['sizes'][size] = {name: replay(trace, size, options) for name, options in POLICIES.items()}
+        exact = results['sizes'][size][EXACT_LRU]
+        for name, result in results['sizes'][size].items():
+            hit_change = 100 * (result['hit_ratio'] - exact['hit_ratio'])
+            print(f'\t{name}: hit ratio {result["hit_ratio"]:.4f} ({hit_change:+.2f} points), '
+                  f'{result["writes_per_access"]:.4f} writes per access')
+
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
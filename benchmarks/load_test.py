@@ -0,0 +1,303 @@
+"""
+    Reproducible load tests of the app in every difficulty (cache type).
+
+    For each difficulty, the app is served in a separate process (on fresh sqlite
+    databases, or a given database), and concurrent virtual users drive a
+    realistic mix of page views and API calls against it. Throughput, latency
+    percentiles and the database statements per request (scraped from the app's
+    /metrics endpoint) are written to a JSON results file, which can be compared
+    with the results of other commits using --compare.
+
+    Example:
+        python benchmarks/load_test.py --duration 20 --concurrency 8 --output results.json
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVE_SCRIPT = os.path.join(BENCHMARKS_DIR, 'serve_app.py')
+DIFFICULTIES = ['easy', 'medium', 'hard']
+BODY_PARTS = ['body', 'head', 'eyes', 'nose', 'ears', 'mouth']
+NUCLEOTIDES = 'CGAT'
+DNA_LENGTH = 19
+SEARCH_TERMS = ['a', 'e', 'an', 'li', 'ma', 'son']
+PERCENTILES = (50, 95, 99)
+STARTUP_TIMEOUT = 60    # seconds to wait for a served app to respond
+REQUEST_TIMEOUT = 30    # seconds before a single request fails
+
+# operation name -> relative weight in the request mix
+OPERATION_WEIGHTS = {
+    'explore': 2,
+    'profile': 2,
+    'avatar': 4,    # the six part fetches of an avatar
+    'search': 1,
+    'draw': 1,      # the six part fetches of a drawn DNA
+}
+_USER_LINK = re.compile(r'/user/(\d+)')
+_METRIC_LINE = re.compile(r'^(\w+)\{endpoint="([^"]+)"\} ([0-9.e+-]+)$')
+
+
+class VirtualUser:
+    """A client with a session of it's own, which performs operations of the mix
+
+    Attributes:
+        base_url (str): the url of the served app.
+        rng (random.Random): the source of the user's (reproducible) choices.
+        latencies (dict): maps operation names to the latencies of their requests.
+        errors (int): the number of failed requests.
+    """
+    def __init__(self, base_url, seed):
+        self.base_url = base_url
+        self.rng = random.Random(seed)
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.user_ids = []
+        self.latencies = {operation: [] for operation in OPERATION_WEIGHTS}
+        self.errors = 0
+
+    def _request(self, operation, path, data=None):
+        if data is not None:
+            data = urllib.parse.urlencode(data).encode('utf-8')
+        started = time.perf_counter()
+        try:
+            with self.opener.open(self.base_url + path, data=data, timeout=REQUEST_TIMEOUT) as response:
+                body = response.read().decode('utf-8')
+        except (urllib.error.URLError, OSError):
+            self.errors += 1
+            return None
+        self.latencies[operation].append(time.perf_counter() - started)
+        return body
+
+    def explore(self):
+        body = self._request('explore', '/explore')
+        if body is not None:
+            self.user_ids = sorted(set(_USER_LINK.findall(body)))
+
+    def profile(self):
+        if self.user_ids:
+            self._request('profile', f'/user/{self.rng.choice(self.user_ids)}')
+
+    def avatar(self):
+        if self.user_ids:
+            user_id = self.rng.choice(self.user_ids)
+            for part in BODY_PARTS:
+                self._request('avatar', '/api/part_from_user', {'id': user_id, 'part': part})
+
+    def search(self):
+        self._request('search', '/', {'search': self.rng.choice(SEARCH_TERMS), 'privacySelect': 'all'})
+
+    def draw(self):
+        dna = ''.join(self.rng.choice(NUCLEOTIDES) for _ in range(DNA_LENGTH))
+        for part in BODY_PARTS:
+            self._request('draw', '/api/part_from_dna', {'dna': dna, 'part': part})
+
+    def run(self, deadline):
+        """Performs random operations of the mix until the deadline"""
+        operations = list(OPERATION_WEIGHTS)
+        weights = [OPERATION_WEIGHTS[operation] for operation in operations]
+        self.explore()
+        while time.perf_counter() < deadline:
+            getattr(self, self.rng.choices(operations, weights)[0])()
+
+
+def percentile(values, percent):
+    """Computes a percentile (nearest rank) of a list of values, None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def latency_summary(latencies):
+    """Summarizes request latencies (in seconds) to their count and percentiles in milliseconds"""
+    summary = {'requests': len(latencies)}
+    for percent in PERCENTILES:
+        value = percentile(latencies, percent)
+        summary[f'p{percent}_ms'] = None if value is None else round(value * 1000, 3)
+    return summary
+
+
+def scrape_sql_statements(base_url):
+    """Reads the total SQL statements and requests of each endpoint from the app's metrics
+
+    Returns:
+        dict: maps endpoints to (statements, requests) totals
+    """
+    with urllib.request.urlopen(base_url + '/metrics', timeout=REQUEST_TIMEOUT) as response:
+        text = response.read().decode('utf-8')
+    totals = {}
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line)
+        if match is None:
+            continue
+        name, endpoint, value = match.groups()
+        statements, requests = totals.get(endpoint, (0.0, 0.0))
+        if name == 'http_request_sql_statements_sum':
+            statements = float(value)
+        elif name == 'http_request_sql_statements_count':
+            requests = float(value)
+        totals[endpoint] = (statements, requests)
+    return totals
+
+
+def statements_per_request(before, after):
+    """Computes the SQL statements per request of each endpoint between two scrapes"""
+    per_request = {}
+    for endpoint, (statements, requests) in after.items():
+        statements_before, requests_before = before.get(endpoint, (0.0, 0.0))
+        if requests > requests_before:
+            per_request[endpoint] = round((statements - statements_before) / (requests - requests_before), 3)
+    return per_request
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(base_url, process):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'The served app exited with code {process.returncode}')
+        try:
+            # the first request also initializes the databases
+            with urllib.request.urlopen(base_url + '/', timeout=REQUEST_TIMEOUT):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError('The served app did not start in time')
+
+
+def run_users(base_url, concurrency, duration, seed):
+    users = [VirtualUser(base_url, seed + i) for i in range(concurrency)]
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=user.run, args=(deadline,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return users
+
+
+def benchmark_difficulty(difficulty, args):
+    """Serves the app of a difficulty and measures it under load
+
+    Returns:
+        dict: the results of the difficulty
+    """
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    with tempfile.TemporaryDirectory() as instance_dir:
+        command = [sys.executable, SERVE_SCRIPT, '--difficulty', difficulty,
+                   '--port', str(port), '--instance-dir', instance_dir]
+        if args.database_uri is not None:
+            command += ['--database-uri', args.database_uri]
+        command += ['--session-backend', args.session_backend]
+        process = subprocess.Popen(command)
+        try:
+            wait_until_up(base_url, process)
+            run_users(base_url, args.concurrency, args.warmup, args.seed)
+            sql_before = scrape_sql_statements(base_url)
+            started = time.perf_counter()
+            users = run_users(base_url, args.concurrency, args.duration, args.seed)
+            elapsed = time.perf_counter() - started
+            sql_after = scrape_sql_statements(base_url)
+        finally:
+            process.terminate()
+            process.wait()
+
+    all_latencies = [latency for user in users for latencies in user.latencies.values() for latency in latencies]
+    results = latency_summary(all_latencies)
+    results['throughput_rps'] = round(len(all_latencies) / elapsed, 3)
+    results['errors'] = sum(user.errors for user in users)
+    results['operations'] = {
+        operation: latency_summary([latency for user in users for latency in user.latencies[operation]])
+        for operation in OPERATION_WEIGHTS
+    }
+    results['sql_statements_per_request'] = statements_per_request(sql_before, sql_after)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARKS_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Prints the change of the main measurements of each difficulty from a baseline"""
+    for difficulty, current in results['difficulties'].items():
+        previous = baseline.get('difficulties', {}).get(difficulty)
+        if previous is None:
+            continue
+        print(f'{difficulty}:')
+        for key in ['throughput_rps'] + [f'p{percent}_ms' for percent in PERCENTILES]:
+            if previous.get(key) and current.get(key) is not None:
+                change = 100 * (current[key] - previous[key]) / previous[key]
+                print(f'\t{key}: {previous[key]} -> {current[key]} ({change:+.1f}%)')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--difficulties', nargs='+', default=DIFFICULTIES, choices=DIFFICULTIES)
+    parser.add_argument('--concurrency', type=int, default=8, help='number of concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=20, help='measured seconds per difficulty')
+    parser.add_argument('--warmup', type=float, default=3, help='unmeasured seconds before measuring')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the virtual users\' choices')
+    parser.add_argument('--database-uri', default=None,
+                        help='users database uri, e.g. a local postgres (defaults to fresh sqlite databases)')
+    parser.add_argument('--session-backend', default='sql', choices=['sql', 'redis'],
+                        help='storage of session state (redis defaults to an in-process stand-in, see REDIS_URL)')
+    parser.add_argument('--output', default='benchmark_results.json', help='path of the JSON results file')
+    parser.add_argument('--compare', default=None, help='a previous results file to compare with')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'settings': {
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'seed': args.seed,
+            'database': 'sqlite' if args.database_uri is None else args.database_uri.split(':')[0],
+            'session_backend': args.session_backend,
+            'operation_weights': OPERATION_WEIGHTS,
+        },
+        'difficulties': {},
+    }
+    for difficulty in args.difficulties:
+        print(f'Benchmarking {difficulty}...')
+        results['difficulties'][difficulty] = benchmark_difficulty(difficulty, args)
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+    print(f'Results written to {args.output}')
+
+    if args.compare is not None:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+    Micro-benchmarks of the avatar codec and the session cache primitives.
+
+    Times the inner loops of the app in isolation - decoding and encoding
+    avatars and body parts, generating random users, converting parts to their
+    drawing dicts, and the `_store`, `__getitem__` and `_evict` methods of every
+    session cache at several cache sizes. All inputs are generated from a fixed
+    seed, so runs are comparable.
+
+    The minimal and median time per call of every benchmark are written to a
+    JSON results file. Passing a previous results file to --baseline compares
+    the minimal times (the least noisy) with it, and fails (with exit code 1)
+    when any benchmark is slower than the baseline by more than
+    --max-regression percent.
+
+    Example:
+        python benchmarks/micro_benchmarks.py --output after.json --baseline before.json --max-regression 15
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+import warnings
+
+from load_test import git_commit
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server')
+sys.path.insert(0, SERVER_DIR)
+
+SEED = 0    # the seed of all generated inputs
+INPUT_COUNT = 64    # the number of distinct inputs the codec benchmarks cycle through
+CACHE_SIZES = (10, 64, 1000)
+LOCAL_RECORDS_TTL = 60 * 60     # the local copy ttl of the SQL cache's local tier, longer than all rounds
+ROUNDS = 30     # the number of timed rounds of each benchmark
+MIN_ROUND_TIME = 0.02   # the minimal seconds of a round of calls without setup
+MAX_REGRESSION = 20     # the default slowdown percentage from the baseline which fails
+BENCHMARK_SSID = "00000000-0000-4000-8000-000000000000"     # the session of the cache benchmarks
+
+
+class Benchmark:
+    """A timed operation, with an optional untimed setup before every call
+
+    Attributes:
+        name (str): the name of the benchmark in the results.
+        operation (callable): the timed operation, called without arguments.
+        setup (callable, optional): called before every call of the operation,
+            outside of the timing. If None, rounds time batches of calls.
+    """
+    def __init__(self, name, operation, setup=None):
+        self.name = name
+        self.operation = operation
+        self.setup = setup
+
+    def _timed_call(self):
+        self.setup()
+        started = time.perf_counter()
+        self.operation()
+        return time.perf_counter() - started
+
+    def run(self, rounds):
+        """Times the operation
+
+        Args:
+            rounds (int): the number of timed rounds
+
+        Returns:
+            dict: the median and minimal time per call (in microseconds) over the rounds
+        """
+        if self.setup is None:
+            timer = timeit.Timer(self.operation)
+            number, _ = timer.autorange()
+            number = max(1, int(number * MIN_ROUND_TIME / 0.2))
+            per_call = [total / number for total in timer.repeat(rounds, number)]
+        else:
+            self._timed_call()  # warm up
+            per_call = [self._timed_call() for _ in range(rounds)]
+        return {
+            'median_us': round(statistics.median(per_call) * 1e6, 3),
+            'min_us': round(min(per_call) * 1e6, 3),
+            'rounds': rounds,
+        }
+
+
+def make_app(instance_dir):
+    """Creates an app of the hard difficulty (so SQL session caches can be created) on fresh databases"""
+    import app.config as app_config
+    app_config.INSTANCE_DIR = instance_dir
+    from app import create_app
+    return create_app(deploy_type='test', difficulty='hard')
+
+
+def codec_benchmarks(rng):
+    from app.config.avatar import Avatar
+    from app.models import UserFactory
+    from app.api import part_layers
+
+    avatars = [Avatar.randomize() for _ in range(INPUT_COUNT)]
+    dnas = itertools.cycle([avatar.to_dna() for avatar in avatars])
+    avatar_cycle = itertools.cycle(avatars)
+    parts = [part for avatar in avatars for part in avatar.body_parts]
+    rng.shuffle(parts)
+    bitstrings = itertools.cycle([(type(part), part.to_bitstring()) for part in parts])
+    part_cycle = itertools.cycle(parts)
+    user_factory = UserFactory(Avatar)
+    user_factory.faker.seed_instance(SEED)
+    # the uncached conversion, the caches are measured on their own
+    find_layers = part_layers.__wrapped__
+
+    def from_bitstring():
+        part_type, bitstring = next(bitstrings)
+        part_type.from_bitstring(bitstring)
+
+    return [
+        Benchmark('Avatar.from_dna', lambda: Avatar.from_dna(next(dnas))),
+        Benchmark('Avatar.to_dna', lambda: next(avatar_cycle).to_dna()),
+        Benchmark('BodyPart.from_bitstring', from_bitstring),
+        Benchmark('UserFactory.randomize', user_factory.randomize),
+        Benchmark('part_layers', lambda: find_layers(next(part_cycle))),
+    ]
+
+
+def cache_benchmarks(cache_type, size, tier=None, **cache_kwargs):
+    """Makes the benchmarks of the primitives of a session cache, filled to it's size
+
+    The name of the cache's tier (if given) is added to the benchmark names, and
+    cache_kwargs are passed to the cache.
+
+    Note:
+        Must run within a request context, the session caches use the request's session.
+    """
+    from app import db
+    from sqlalchemy.exc import SAWarning
+
+    cache = cache_type(max_size=size, **cache_kwargs)
+    cache(lambda: None)     # names the cache (and registers the SQL caches)
+    # every SQL cache declares a table model of the same class name
+    warnings.filterwarnings('ignore', 'This declarative base already contains', SAWarning)
+    db.create_all()
+    values = [json.dumps({'index': i, 'color': 'red'}) for i in range(size)]
+    new_keys = (str((f'new_{i}',)) for i in itertools.count())
+    for i, value in enumerate(values):
+        cache._store(str((i,)), value)
+    cache.set_modified()
+    middle_key = str((size // 2,))
+
+    def refill():
+        # keeps the cache full, so every eviction has the same candidates
+        db.session.commit()
+        if len(cache._cache) < size:
+            cache._store(next(new_keys), values[0])
+            cache.set_modified()
+
+    name = f'{cache_type.__name__}[{size}]' if tier is None else f'{cache_type.__name__}.{tier}[{size}]'
+    return [
+        Benchmark(f'{name}._store', lambda: cache._store(middle_key, values[size // 2])),
+        Benchmark(f'{name}.__getitem__', lambda: cache[middle_key]),
+        Benchmark(f'{name}._evict', cache._evict, setup=refill),
+    ]
+
+
+def run_benchmarks(args):
+    from flask import session
+    from app.modules.session_manager import SessionHandler
+    from app.modules.user_cache import LRUSessionCache, AesLRUSessionCache, SqlLRUSessionCache
+    from app import db
+
+    results = {}
+
+    def run(benchmark):
+        print(f'\t{benchmark.name}...', flush=True)
+        results[benchmark.name] = benchmark.run(args.rounds)
+
+    random.seed(SEED)
+    for benchmark in codec_benchmarks(random.Random(SEED)):
+        run(benchmark)
+
+    caches = [
+        (LRUSessionCache, None, {}),
+        (AesLRUSessionCache, None, {}),
+        # the SQL cache's tiers are measured apart - the database, and the worker's local copy of the records
+        (SqlLRUSessionCache, None, {'local_ttl': 0}),
+        (SqlLRUSessionCache, 'local', {'local_ttl': LOCAL_RECORDS_TTL}),
+    ]
+    for cache_type, tier, cache_kwargs in caches:
+        for size in args.sizes:
+            with args.app.test_request_context():
+                session[SessionHandler.SESSION_ID_FIELD] = BENCHMARK_SSID
+                for benchmark in cache_benchmarks(cache_type, size, tier, **cache_kwargs):
+                    run(benchmark)
+                # the last eviction of the SQL cache is uncommitted, and would lock sqlite for the next cache
+                db.session.commit()
+    return results
+
+
+def compare(results, baseline, max_regression):
+    """Prints the change of the minimal time of every benchmark from a baseline
+
+    Returns:
+        list: the names of the benchmarks which regressed by more than max_regression percent
+    """
+    regressions = []
+    for name, current in results['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None or not previous['min_us']:
+            continue
+        change = 100 * (current['min_us'] - previous['min_us']) / previous['min_us']
+        regressed = change > max_regression
+        if regressed:
+            regressions.append(name)
+        mark = '  REGRESSION' if regressed else ''
+        print(f'{name}: {previous["min_us"]}us -> {current["min_us"]}us ({change:+.1f}%){mark}')
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(CACHE_SIZES), help='the benchmarked cache sizes')
+    parser.add_argument('--rounds', type=int, default=ROUNDS, help='timed rounds of every benchmark')
+    parser.add_argument('--output', default='micro_benchmark_results.json', help='path of the JSON results file')
+    parser.add_argument('--baseline', default=None, help='a previous results file to compare with')
+    parser.add_argument('--max-regression', type=float, default=MAX_REGRESSION,
+                        help='the slowdown (in percent) from the baseline at which a benchmark fails')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as instance_dir:
+        args.app = make_app(instance_dir)
+        with args.app.app_context():
+            print('Running micro-benchmarks...')
+            benchmarks = run_benchmarks(args)
+
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'settings': {'seed': SEED, 'rounds': args.rounds, 'sizes': args.sizes},
+        'benchmarks': benchmarks,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+    print(f'Results written to {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.max_regression)
+        if regressions:
+            print(f'{len(regressions)} benchmarks regressed by more than {args.max_regression}%')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+    Serves the app of a single difficulty for the load tests.
+    Runs in a process of it's own, since an app's cache type is fixed per process.
+"""
+import argparse
+import logging
+import os
+import sys
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server')
+sys.path.insert(0, SERVER_DIR)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--difficulty', required=True, choices=['easy', 'medium', 'hard'])
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--instance-dir', required=True,
+                        help='directory of the sqlite databases, isolating the run from other runs')
+    parser.add_argument('--database-uri', default=None,
+                        help='uri of the users database (e.g. a local postgres). '
+                             'The session binds are databases next to it.')
+    parser.add_argument('--session-backend', default='sql', choices=['sql', 'redis'],
+                        help='storage of session state. redis uses REDIS_URL, '
+                             'which defaults to an in-process stand-in')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    import app.config as app_config
+    app_config.INSTANCE_DIR = args.instance_dir
+    if args.database_uri is not None:
+        app_config.TestDeployment.SQLALCHEMY_DATABASE_URI = args.database_uri
+
+    from app import create_app
+    from werkzeug.serving import make_server
+    app = create_app(deploy_type='test', difficulty=args.difficulty, session_backend=args.session_backend)
+    app.config['TESTING'] = False   # report errors as responses, like a deployment
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)   # don't log every request
+    server = make_server('127.0.0.1', args.port, app, threaded=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+    Measures the storage and lookup cost of session ids stored as strings and as binary ids.
+
+    Fills two tables shaped like the session tables (a session id primary key
+    and a counter) with the same random session ids - one with the former
+    36 character string column, the other with SessionIdType - and reports the
+    size of each table's primary key index and the latency of primary key lookups.
+
+    Runs on a temporary sqlite database by default, or on a given database (e.g.
+    a local PostgreSQL) in which the benchmark tables are created and dropped.
+
+    Example:
+        python benchmarks/session_id_storage.py --sessions 1000000 --database-uri postgresql://localhost/bench
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server')
+sys.path.insert(0, SERVER_DIR)
+
+from sqlalchemy import bindparam, create_engine, Column, Integer, MetaData, String, Table, select, text  # noqa: E402
+from app.modules.session_manager import SessionHandler, SessionIdType  # noqa: E402
+
+SEED = 0    # the seed of the generated session ids
+SESSIONS = 1000000  # the default number of stored sessions
+LOOKUPS = 10000     # the default number of timed lookups
+INSERT_BATCH_SIZE = 10000   # the number of rows inserted per statement
+
+VARIANTS = {
+    'string': lambda: String(SessionHandler.UUID_LEN),
+    'binary': SessionIdType,
+}
+
+
+def make_tables(metadata):
+    return {
+        name: Table(f'ssid_benchmark_{name}', metadata,
+                    Column('ssid', column_type(), primary_key=True),
+                    Column('detections', Integer, nullable=False))
+        for name, column_type in VARIANTS.items()
+    }
+
+
+def random_ssids(count):
+    rng = random.Random(SEED)
+    return [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(count)]
+
+
+def fill(engine, table, ssids):
+    with engine.begin() as connection:
+        for start in range(0, len(ssids), INSERT_BATCH_SIZE):
+            batch = ssids[start:start + INSERT_BATCH_SIZE]
+            connection.execute(table.insert(), [{'ssid': ssid, 'detections': 0} for ssid in batch])
+
+
+def index_size(engine, table):
+    """Returns the size in bytes of a table's primary key index, None if it can't be measured"""
+    with engine.connect() as connection:
+        if engine.dialect.name == 'postgresql':
+            return connection.execute(
+                text('SELECT pg_relation_size(indexrelid) FROM pg_index WHERE indrelid = CAST(:table AS regclass) AND indisprimary'),
+                {'table': table.name}
+            ).scalar()
+        if engine.dialect.name == 'sqlite':
+            # the primary key index of a rowid table is it's single automatic index
+            return connection.execute(
+                text("SELECT sum(pgsize) FROM dbstat WHERE name LIKE :index_name"),
+                {'index_name': f'sqlite_autoindex_{table.name}_%'}
+            ).scalar()
+    return None
+
+
+def lookup_latencies(engine, table, ssids, count):
+    rng = random.Random(SEED)
+    query = select(table.c.detections).where(table.c.ssid == bindparam('ssid'))
+    latencies = []
+    with engine.connect() as connection:
+        for ssid in rng.choices(ssids, k=count):
+            started = time.perf_counter()
+            connection.execute(query, {'ssid': ssid}).scalar_one()
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=SESSIONS, help='the number of stored sessions')
+    parser.add_argument('--lookups', type=int, default=LOOKUPS, help='the number of timed primary key lookups')
+    parser.add_argument('--database-uri', default=None, help='the benchmarked database (defaults to a temporary sqlite file)')
+    parser.add_argument('--output', default=None, help='path of a JSON results file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        database_uri = args.database_uri or f'sqlite:///{os.path.join(temp_dir, "ssid_benchmark.db")}'
+        engine = create_engine(database_uri)
+        metadata = MetaData()
+        tables = make_tables(metadata)
+        metadata.drop_all(engine)
+        metadata.create_all(engine)
+        ssids = random_ssids(args.sessions)
+
+        results = {'database': engine.dialect.name, 'sessions': args.sessions, 'variants': {}}
+        try:
+            for name, table in tables.items():
+                print(f'Filling the {name} table...', flush=True)
+                fill(engine, table, ssids)
+                latencies = lookup_latencies(engine, table, ssids, args.lookups)
+                results['variants'][name] = {
+                    'index_bytes': index_size(engine, table),
+                    'lookup_p50_us': round(statistics.median(latencies) * 1e6, 3),
+                    'lookup_mean_us': round(statistics.mean(latencies) * 1e6, 3),
+                }
+        finally:
+            metadata.drop_all(engine)
+            engine.dispose()
+
+    print(json.dumps(results, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
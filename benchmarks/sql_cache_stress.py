@@ -0,0 +1,162 @@
+"""
+    Stress test of concurrent identical misses of the SQL session cache.
+
+    Serves the hard difficulty app in one or more processes which share fresh
+    sqlite databases (and the session key generated in their instance dir),
+    starts a single session, and sends --requests identical part requests of
+    that session at once, spread over the processes - like the part requests
+    of an avatar, many times over.
+
+    Checks that every request succeeded, that the requests created no sessions
+    (the processes accept each other's cookies) and that a single cache record
+    was written, and prints the misses, hits and write conflicts counted by the
+    app. Within a process, concurrent identical misses should be computed once,
+    so at most one miss per process is expected. Exits with code 1 if a check fails.
+
+    Example:
+        python benchmarks/sql_cache_stress.py --requests 50 --processes 2
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from load_test import SERVE_SCRIPT, REQUEST_TIMEOUT, free_port, wait_until_up
+
+REQUESTS = 50   # the default number of concurrent identical requests
+STRESS_DNA = 'CGATCGATCGATCGATCGA'
+STRESS_PART = 'head'
+CACHE_DB_NAME = 'sql_sessions'  # the sqlite database of the SQL session caches, in the instance dir
+CACHE_TABLE = 'sql_session_cache_0'
+_CACHE_EVENT_LINE = re.compile(r'^session_cache_events_total\{[^}]*event="(\w+)"[^}]*\} ([0-9.e+-]+)$')
+_SESSIONS_CREATED_LINE = re.compile(r'^sessions_created_total\{[^}]*\} ([0-9.e+-]+)$')
+
+
+def start_session(base_url):
+    """Starts a session with the app, returns the session's cookie header"""
+    cookie_jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookie_jar))
+    with opener.open(base_url + '/', timeout=REQUEST_TIMEOUT) as response:
+        response.read()
+    return '; '.join(f'{cookie.name}={cookie.value}' for cookie in cookie_jar)
+
+
+def send_requests(base_urls, cookie, count):
+    """Sends identical part requests of a session at once, round robin over the served apps
+
+    Returns:
+        tuple: the number of requests which failed, and the maximal latency in seconds
+    """
+    data = urllib.parse.urlencode({'dna': STRESS_DNA, 'part': STRESS_PART}).encode('utf-8')
+    barrier = threading.Barrier(count)
+    failures = []
+    latencies = []
+
+    def send(base_url):
+        request = urllib.request.Request(base_url + '/api/part_from_dna', data=data, headers={'Cookie': cookie})
+        barrier.wait()
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                if json.loads(response.read())['status'] != 'success':
+                    failures.append(base_url)
+        except (OSError, ValueError):
+            failures.append(base_url)
+        latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=send, args=(base_urls[i % len(base_urls)],)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(failures), max(latencies)
+
+
+def scrape_cache_events(base_url, cookie):
+    """Reads the session cache event counts (and the created sessions, as 'session' events) of a served app"""
+    # scraped within the session, so scrapes don't create sessions
+    request = urllib.request.Request(base_url + '/metrics', headers={'Cookie': cookie})
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+        text = response.read().decode('utf-8')
+    events = {}
+    for line in text.splitlines():
+        match = _CACHE_EVENT_LINE.match(line)
+        if match is not None:
+            events[match.group(1)] = events.get(match.group(1), 0) + int(float(match.group(2)))
+        match = _SESSIONS_CREATED_LINE.match(line)
+        if match is not None:
+            events['session'] = events.get('session', 0) + int(float(match.group(1)))
+    return events
+
+
+def count_cache_records(instance_dir):
+    connection = sqlite3.connect(os.path.join(instance_dir, CACHE_DB_NAME))
+    try:
+        return connection.execute(f'SELECT count(*) FROM {CACHE_TABLE}').fetchone()[0]
+    finally:
+        connection.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=REQUESTS, help='the number of concurrent identical requests')
+    parser.add_argument('--processes', type=int, default=1, help='the number of processes serving the app')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as instance_dir:
+        # the processes share the session through the session key generated in the instance dir
+        environment = {name: value for name, value in os.environ.items() if name != 'SESSION_KEY_FILE'}
+
+        processes = []
+        base_urls = []
+        try:
+            # started one by one, so the first initializes the databases alone
+            for _ in range(args.processes):
+                port = free_port()
+                base_urls.append(f'http://127.0.0.1:{port}')
+                processes.append(subprocess.Popen(
+                    [sys.executable, SERVE_SCRIPT, '--difficulty', 'hard', '--port', str(port),
+                     '--instance-dir', instance_dir],
+                    env=environment
+                ))
+                wait_until_up(base_urls[-1], processes[-1])
+
+            cookie = start_session(base_urls[0])
+            sessions_before = sum(scrape_cache_events(base_url, cookie).get('session', 0) for base_url in base_urls)
+            failures, max_latency = send_requests(base_urls, cookie, args.requests)
+            events = {}
+            for base_url in base_urls:
+                for event, count in scrape_cache_events(base_url, cookie).items():
+                    events[event] = events.get(event, 0) + count
+            created_sessions = events.get('session', 0) - sessions_before
+            records = count_cache_records(instance_dir)
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+    print(f'{args.requests} concurrent identical requests over {args.processes} processes:')
+    print(f'\tfailed requests: {failures}')
+    print(f'\tsessions created: {created_sessions}')
+    print(f'\tcache records written: {records}')
+    print(f'\tmisses: {events.get("miss", 0)}, hits: {events.get("hit", 0)}, '
+          f'write conflicts: {events.get("conflict", 0)}')
+    print(f'\tslowest request: {max_latency * 1000:.1f}ms')
+    if failures or records != 1 or created_sessions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,9 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from jinja2 import select_autoescape
 from app.config import AppConfigFactory, USER_COUNT
+from app.modules.db_pool import PooledSQLAlchemy
 
-db = SQLAlchemy(session_options={"autoflush": False})
+db = PooledSQLAlchemy(session_options={"autoflush": False})
 config_factory = AppConfigFactory()
 
 
@@ -16,7 +17,10 @@ def create_app(**kwargs):
     Returns:
         Flask: the created flask application with the given configuration
     """
-    app = Flask(__name__)
+    # static files are served by the controllers, with long-lived caching
+    app = Flask(__name__, static_folder=None)
+    # flask only autoescapes templates with html extensions, the app's templates are .jinja files
+    app.jinja_env.autoescape = select_autoescape(['html', 'htm', 'xml', 'xhtml', 'svg', 'jinja'])
     # configuration for development
     app_config = config_factory.make(**kwargs)
     app.config.from_object(app_config)
@@ -27,6 +31,13 @@ def create_app(**kwargs):
         app.db = db
         app_config.init_app(app)
 
+        from app.modules.query_log import init_query_log
+        init_query_log(app)
+
+        if app.config.get('EXPOSE_METRICS'):
+            from app.modules.metrics import init_metrics
+            init_metrics(app)
+
         from app.api import api
         from app.controllers import controllers
         app.register_blueprint(api)
@@ -36,8 +47,10 @@ def create_app(**kwargs):
     # upon the first request.
     @app.before_first_request
     def initialize_databases():
-        from app.models import UserFactory, User
+        from app.models import UserFactory, User, UserGeneration, USER_CACHE, public_avatar_index
         db.create_all()  # create all db tables
+        from app.migrations import migrate
+        migrate()   # update tables created by older versions
         existing_user_count = User.query.count()
 
         # if user db isn't filled
@@ -50,6 +63,11 @@ def create_app(**kwargs):
             for _ in range(USER_COUNT):
                 db.session.add(user_factory.randomize())
 
+            UserGeneration.bump()
             db.session.commit()
 
+        # warm the worker's user cache and similar avatar index
+        USER_CACHE.warm_all()
+        public_avatar_index()
+
     return app
@@ -4,12 +4,14 @@
     ajax from the user for updating pages.
     Primarily uses a json format.
 """
-from app.models import SessionUsers, Villain, User
-from flask import jsonify, request, Blueprint, render_template, current_app
+from app.models import SessionUsers, Villain, USER_CACHE, public_avatar_index
+from flask import jsonify, request, Blueprint, current_app, make_response
 from app.config.avatar import Avatar
+from app.modules.sprite_atlas import load_atlas
+from app.controllers import STATIC_ASSETS, FRAGMENT_CACHE
 from functools import wraps
-from sqlalchemy.sql.expression import func
 import asyncio
+import hashlib
 import json
 import os.path
 
@@ -21,8 +23,21 @@ URL_PART_TEMPLATE = "/img/avatar/{}/"   # string template for the url for part a
 FILE_DIR = os.path.abspath(os.path.dirname(__file__))   # the current directory
 URL_TO_PATH_PREFIX = os.path.join(FILE_DIR, 'static')
 """Prefix which convers URL part assets to concrete files in the system"""
+ATLAS_ASSET_DIR = "img/atlas/"  # the part asset atlases directory, relative to the static files
+PART_LAYER_TEMPLATE = "{part}/{kind}{variation}.png"  # name of a part layer in the atlas map
 
-USERS_TO_ADD = 8    # The number of users sent on a deck request
+AVATAR_SCHEMA_MAX_AGE = 24 * 60 * 60  # seconds clients may cache the avatar schema without revalidation
+USERS_TO_ADD = 8    # The default number of users sent on a deck request
+MAX_DECK_SIZE = 64  # The maximal number of users sent on a deck request
+DECK_CURSOR_HEADER = 'X-Deck-Cursor'    # response header holding the cursor of the next deck
+AVATAR_ATLAS = load_atlas(
+    URL_TO_PATH_PREFIX + URL_PART_TEMPLATE.format(''),
+    os.path.join(URL_TO_PATH_PREFIX, ATLAS_ASSET_DIR)
+)
+"""Map of the regions of the part layers in the part asset atlases"""
+DEFAULT_SIMILAR_COUNT = 8   # The default number of users returned by similar avatar search
+MAX_SIMILAR_COUNT = 64  # The maximal number of users returned by similar avatar search
+MAX_SEARCH_PAGE_SIZE = 128  # The maximal number of users sent on a search page request
 
 def make_json_api(*args, **kwargs):
     """Decorator for turning functions and async coroutines to an API format
@@ -75,7 +90,63 @@ def make_json_api(*args, **kwargs):
         return decorated
     return decorator
 
-@caching_function(serializer=json)
+def part_layer(part_name, kind, variation):
+    """Names a part layer in the atlas map, after validating it's assets exist
+
+    Args:
+        part_name (str): the name of the body part
+        kind (str): the kind of the layer ('border' or 'color')
+        variation (int): the variation of the body part
+
+    Returns:
+        str: the name of the layer's atlas region
+    """
+    layer_name = PART_LAYER_TEMPLATE.format(part=part_name, kind=kind, variation=variation)
+    layer_path = URL_TO_PATH_PREFIX + URL_PART_TEMPLATE.format(part_name) + layer_name.split('/')[-1]
+    assert os.path.isfile(layer_path), f'Missing draw resource for part {layer_path}'
+    assert layer_name in AVATAR_ATLAS['regions'], f'Missing atlas region for part {layer_name}'
+    return layer_name
+
+
+def atlas_region(layer_name):
+    """Finds the atlas region of a part layer (see part_layer)
+
+    Returns:
+        dict: the atlas region of the layer, with the fingerprinted url of it's atlas
+    """
+    return _region_with_url(AVATAR_ATLAS['regions'][layer_name])
+
+
+def _region_with_url(region):
+    region = dict(region)
+    region['atlas'] = STATIC_ASSETS.url(ATLAS_ASSET_DIR + AVATAR_ATLAS['images'][region['atlas']])
+    return region
+
+
+@caching_function(
+    serializer=json,
+    recency_interval=current_app.config['SESSION_CACHE_RECENCY_INTERVAL'],
+    eviction_samples=current_app.config['SESSION_CACHE_EVICTION_SAMPLES']
+)
+def part_layers(part):
+    """Names the atlas layers which draw a body part
+
+    Note:
+        This function is cached. Only the layer names are cached, since the
+        easy and medium caches are kept in the session cookie - part_to_dict
+        looks up their regions.
+
+    Returns:
+        list: the name of the border layer, followed by the name of the
+            color layer if the part is colorable
+    """
+    part_name = part.__class__.__name__.lower()
+    layers = [part_layer(part_name, 'border', part.variation)]
+    if part.IS_COLORABLE:
+        layers.append(part_layer(part_name, 'color', part.variation))
+    return layers
+
+
 def part_to_dict(part):
     """Converts a body part to a dict of drawing properties for the js
     
@@ -83,19 +154,13 @@ def part_to_dict(part):
     will be converted to JSON, making the response solid JSON.
     
     Note:
-        This function is cached.
+        The part's layers are found by the cached part_layers.
     """
-    part_name = part.__class__.__name__.lower()
-    part_url = URL_PART_TEMPLATE.format(part_name)
+    border_layer, *color_layers = part_layers(part)
+    part_dict = {'border_image': atlas_region(border_layer)}
 
-    border_image = os.path.join(part_url, f"border{part.variation}.png")
-    assert os.path.isfile(URL_TO_PATH_PREFIX + border_image), f'Missing draw resource for part {URL_TO_PATH_PREFIX + border_image}'
-    part_dict = {'border_image': border_image}
-
-    color_image = os.path.join(part_url, f"color{part.variation}.png")
-    if part.IS_COLORABLE:
-        assert os.path.isfile(URL_TO_PATH_PREFIX + color_image), f'Missing draw resource for part {color_image}'
-        color_dict = {'image': color_image,
+    if color_layers:
+        color_dict = {'image': atlas_region(color_layers[0]),
                       'color': part.color}
     else:
         color_dict = None
@@ -103,6 +168,40 @@ def part_to_dict(part):
     return part_dict
 
 
+def make_avatar_schema():
+    """Makes the schema clients use for decoding DNA and drawing avatars
+
+    Returns:
+        dict: the Avatar schema, with the atlas regions of the part assets
+            (and templates for their names) and a version which changes
+            whenever the schema or the atlases change.
+    """
+    schema = Avatar.schema()
+    schema['assets'] = {
+        'border_image': PART_LAYER_TEMPLATE.format(part='{part}', kind='border', variation='{variation}'),
+        'color_image': PART_LAYER_TEMPLATE.format(part='{part}', kind='color', variation='{variation}'),
+        'regions': {
+            layer_name: _region_with_url(region)
+            for layer_name, region in AVATAR_ATLAS['regions'].items()
+        }
+    }
+    schema_json = json.dumps(schema, sort_keys=True).encode('utf-8')
+    schema['version'] = hashlib.sha256(schema_json).hexdigest()[:16]
+    return schema
+
+AVATAR_SCHEMA = make_avatar_schema()
+
+
+@api.route('avatar_schema')
+def avatar_schema():
+    """Returns the avatar schema as a cacheable JSON api response"""
+    response = jsonify(status='success', content=AVATAR_SCHEMA)
+    response.set_etag(AVATAR_SCHEMA['version'])
+    response.cache_control.public = True
+    response.cache_control.max_age = AVATAR_SCHEMA_MAX_AGE
+    return response.make_conditional(request)
+
+
 @make_json_api('part_from_dna', methods=['POST'])
 def part_from_dna():
     """API call which returns part_dict of a part from given DNA
@@ -139,11 +238,11 @@ async def fetch_part_from_user(uid, part_name):
     Returns:
         dict: part_dict of drawing details for the requested body part
     """
-    user = SessionUsers.query.filter(User.user_id==uid).first()
+    user = SessionUsers.get(uid)
     current_app.db.session.commit()
     if user is None:
         raise ValueError("User id not found")
-    avatar = Avatar.from_dna(user.dna)
+    avatar = Avatar.from_int(user.dna_code)
     return part_to_dict(avatar[part_name])
 
 
@@ -157,7 +256,7 @@ async def is_user_visible(uid):
     Returns:
         bool: True if requester is allowed, False otherwise
     """
-    user = SessionUsers.query.filter(User.user_id==uid).first()
+    user = SessionUsers.get(uid)
     # This Raven Darksomething asked us to let her know when she is being queried
     # weird, but she pays well...
     if Villain.is_villain(user):
@@ -197,8 +296,92 @@ async def part_from_user():
     return part
 
 
+@make_json_api('similar')
+def similar_users():
+    """API call which returns the public users whose avatars are most similar to a DNA
+
+    Note:
+        Parameters `dna` and optionally `k` (the number of users) are given in the query string
+
+    Raises:
+        ValueError: Missing or bad parameters
+
+    Returns:
+        list: dicts with the user_id, name, dna and distance of each similar user, closest first
+    """
+    if 'dna' not in request.args:
+        raise ValueError("Missing dna parameter")
+    k = int(request.args.get('k', DEFAULT_SIMILAR_COUNT))
+    if not (0 < k <= MAX_SIMILAR_COUNT):
+        raise ValueError(f"k must be between 1 and {MAX_SIMILAR_COUNT}")
+    avatar = Avatar.from_dna(request.args['dna'].strip())
+
+    matches = public_avatar_index().nearest(avatar, k)
+    users = USER_CACHE.get_many([uid for uid, _ in matches])
+    return [
+        {
+            'user_id': uid,
+            'name': users[uid].name,
+            'dna': users[uid].dna,
+            'distance': distance
+        }
+        for uid, distance in matches if uid in users
+    ]
+
+
+@make_json_api('pool_stats')
+def pool_stats():
+    """API call which returns the database connection pool metrics of this worker
+
+    Raises:
+        ValueError: pool metrics are not exposed by the app configuration
+
+    Returns:
+        dict: maps each database bind to it's pool metrics
+    """
+    if not current_app.config.get('EXPOSE_POOL_METRICS'):
+        raise ValueError("Pool metrics are not exposed")
+    return current_app.db.pool_stats()
+
+
+@api.route('search')
+def search_page():
+    """Returns html for the next page of users matching a search
+
+    Note:
+        Takes the search form parameters, the user id of the last user already
+        shown (`after`) and optionally the page size (`count`) from the query string.
+    """
+    query = SessionUsers.search(
+        request.args.get('search', ''),
+        privacy_select=request.args.get('privacySelect'),
+        force_job='forceJob' in request.args,
+        force_location='forceLocation' in request.args
+    )
+    page_size = current_app.config['SEARCH_PAGE_SIZE']
+    count = max(min(request.args.get('count', page_size, type=int), MAX_SEARCH_PAGE_SIZE), 1)
+    users = SessionUsers.page(query, after=request.args.get('after', type=int), count=count)
+    return FRAGMENT_CACHE.render_list("users_as_list_items.jinja", users)
+
+
 @api.route('get_user_deck')
 def get_user_deck():
-    """Returns html for new users being add to a list"""
-    new_users = SessionUsers.query.order_by(func.random()).limit(USERS_TO_ADD).all()
-    return render_template("users_as_list_items.jinja", users=new_users)
+    """Returns html for new users being add to a list
+
+    Note:
+        Takes the deck's `seed`, the deck position of the first user (`cursor`)
+        and optionally the deck size (`count`) from the query string. The cursor
+        of the following deck is returned in the DECK_CURSOR_HEADER header.
+        Without a seed, random users are sent.
+    """
+    count = max(min(request.args.get('count', USERS_TO_ADD, type=int), MAX_DECK_SIZE), 1)
+    seed = request.args.get('seed', type=int)
+    if seed is None:
+        new_users = SessionUsers.sample(count)
+        return FRAGMENT_CACHE.render_list("users_as_list_items.jinja", new_users)
+
+    cursor = max(request.args.get('cursor', 0, type=int), 0)
+    new_users, next_cursor = SessionUsers.deck(seed, cursor, count)
+    response = make_response(FRAGMENT_CACHE.render_list("users_as_list_items.jinja", new_users))
+    response.headers[DECK_CURSOR_HEADER] = str(next_cursor)
+    return response
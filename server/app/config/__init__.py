@@ -1,21 +1,81 @@
 import os
 from abc import ABC, abstractmethod
+try:
+    import fcntl
+except ImportError:     # not available on windows, secret files are generated without locking
+    fcntl = None
 
 # file system consts, finding the init dir if environs are missing
 FILE_DIR = os.path.abspath(os.path.dirname(__file__))
 INSTANCE_DIR = os.path.join(FILE_DIR, '../../instance')
+STATIC_CACHE_DIR = os.path.join(INSTANCE_DIR, 'static_cache')    # compressed static assets
 
 # no. of bytes in the application session key by default
 SESSION_KEY_BYTES = 32
+SESSION_KEY_FILE_NAME = 'session_key.secret'    # the generated session key, in the instance dir
 
 # session garbage collector consts, configures it's execution
 _SECONDS_IN_MINUTE = 60
 GARBAGE_COLLECTOR_CLEAN_INTERVAL = 15 * _SECONDS_IN_MINUTE
 APP_SESSION_DURATION = 20 * _SECONDS_IN_MINUTE
+SESSION_ACTIVITY_BUCKET = 1 * _SECONDS_IN_MINUTE  # granularity of recorded session activity
 
 # amount of users expected in db
 USER_COUNT = 128
 
+# process-local user row cache consts
+USER_CACHE_SIZE = 4 * USER_COUNT    # maximal amount of user rows cached by each worker
+USER_GENERATION_CHECK_INTERVAL = 5  # seconds between checks for user table changes
+DECK_CACHE_SIZE = 256   # maximal amount of explore deck permutations cached by each worker
+FRAGMENT_CACHE_SIZE = 2 * USER_COUNT    # maximal amount of rendered user pages and list items cached by each worker
+
+# connection pool consts, applied to every bind of every worker process
+_SECONDS_IN_HOUR = 60 * _SECONDS_IN_MINUTE
+DB_POOL_RECYCLE = 1 * _SECONDS_IN_HOUR   # reopen pooled connections older than this
+
+def _env_flag(name):
+    """Reads a boolean flag from an environment variable"""
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+def _env_int(name, default=0):
+    """Reads an integer from an environment variable"""
+    return int(os.environ.get(name, default))
+
+def load_secret(env_var, file_name, length):
+    """Loads a secret shared by all of the app's worker processes
+
+    Reads the secret from the file specified in an environment variable. If the
+    variable is missing, reads it from a file in the instance dir, which the first
+    process to load the secret generates (randomly). The file is generated under
+    an exclusive lock, so worker processes which start together share one secret.
+
+    Args:
+        env_var (str): the environment variable of the secret's file path
+        file_name (str): the name of the generated secret file in the instance dir
+        length (int): the byte length of a generated secret
+
+    Returns:
+        bytes: the secret
+    """
+    path = os.environ.get(env_var)
+    if path is not None:
+        with open(path, 'rb') as secret_file:
+            return secret_file.read()
+
+    os.makedirs(INSTANCE_DIR, exist_ok=True)
+    path = os.path.join(INSTANCE_DIR, file_name)
+    with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), 'r+b') as secret_file:
+        if fcntl is not None:
+            fcntl.flock(secret_file, fcntl.LOCK_EX)
+        secret = secret_file.read()
+        if not secret:
+            secret = os.urandom(length)
+            secret_file.write(secret)
+            secret_file.flush()
+            os.fsync(secret_file.fileno())
+        # the lock is released when the file is closed
+    return secret
+
 class DeploymentConfig(ABC):
     """Abstract base class for deployment configuration.
     
@@ -23,24 +83,69 @@ class DeploymentConfig(ABC):
     
     Note:
         The deployment attempts to load a secret key for flask sessions from the
-        file specified in the environment variable 'SESSION_KEY_FILE', and falls-back to using
-        a random session key on failure.
+        file specified in the environment variable 'SESSION_KEY_FILE', and falls-back to a
+        random session key which is generated once into the instance dir (see load_secret),
+        so all worker processes on a host sign sessions with the same key.
         
         If the setup is containerized (via docker) it is highly reccommended to use docker secrets
         for this file.
     """
     # Disables flask-sqlalchemy modification tracking (inefficient)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    # For development & testing or as a fallback, use a random secret key for each run
-    SECRET_KEY = os.urandom(SESSION_KEY_BYTES)
     # enables flask sessions and flask cookie signing
     SESSION_USE_SIGNER = True
-    
-    # if a session key secret is specified, use it instead of the random one
-    _session_key_path = os.environ.get('SESSION_KEY_FILE')
-    if _session_key_path is not None:
-        with open(_session_key_path, 'rb') as _sess_key_file:
-            SECRET_KEY = _sess_key_file.read()
+
+    # connection pool options for each flask-sqlalchemy bind (None is the users db).
+    # Pools are per worker process, so the maximal connection count of each bind
+    # is (pool_size + max_overflow) * workers.
+    SQLALCHEMY_POOL_OPTIONS = {
+        None: {
+            'pool_size': 2,
+            'max_overflow': 2,
+            'pool_recycle': DB_POOL_RECYCLE,
+            'pool_pre_ping': True,
+        },
+        'sql_sessions': {
+            'pool_size': 2,
+            'max_overflow': 2,
+            'pool_recycle': DB_POOL_RECYCLE,
+            'pool_pre_ping': True,
+        },
+        'active_sessions': {
+            'pool_size': 1,
+            'max_overflow': 1,
+            'pool_recycle': DB_POOL_RECYCLE,
+            'pool_pre_ping': True,
+        },
+    }
+    # if set, all binds are stored in (schemas of) the users db and share it's pool
+    SQLALCHEMY_CONSOLIDATE_BINDS = _env_flag('DB_CONSOLIDATE_BINDS')
+    # if positive, session cache and activity tables are hash partitioned by ssid (PostgreSQL only)
+    SESSION_TABLE_PARTITIONS = _env_int('SESSION_TABLE_PARTITIONS')
+    # approximate LRU policy of the session caches (0 keeps exact LRU, which the challenge is designed around):
+    # seconds in which hits don't refresh a cache entry, and the number of entries sampled by evictions
+    SESSION_CACHE_RECENCY_INTERVAL = _env_int('SESSION_CACHE_RECENCY_INTERVAL')
+    SESSION_CACHE_EVICTION_SAMPLES = _env_int('SESSION_CACHE_EVICTION_SAMPLES')
+    # seconds for which each worker serves a session's SQL cache records from a local copy (0 disables the copy).
+    # The copies make the SQL cache approximate LRU across workers, so they are opt-in like the policies above
+    SESSION_CACHE_LOCAL_TTL = _env_int('SESSION_CACHE_LOCAL_TTL')
+    SESSION_CACHE_LOCAL_SESSIONS = 1024     # sessions whose SQL cache records are copied by each worker
+    # keeps flask session data (the easy and medium caches) on the server instead of in the session cookie.
+    # The easy and medium attacks read and reset the cache through the cookie, so this changes the challenge
+    SERVER_SIDE_SESSIONS = _env_flag('SERVER_SIDE_SESSIONS')
+    # exposes the connection pool metrics in the api
+    EXPOSE_POOL_METRICS = True
+    # records request, sql, cache and gc metrics and serves them at /metrics
+    EXPOSE_METRICS = True
+    # logs slow statements and statements repeated within a request (N+1) as json lines
+    SLOW_QUERY_LOG = _env_flag('SLOW_QUERY_LOG')
+    SLOW_QUERY_LOG_FILE = os.path.join(INSTANCE_DIR, 'slow_queries.log')   # each worker adds it's pid to the name
+    SLOW_QUERY_THRESHOLD = 0.05     # seconds
+    REPEATED_QUERY_LIMIT = 5    # executions of a statement allowed in a request
+    SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+    SLOW_QUERY_LOG_BACKUPS = 3
+    # the number of users sent in each page of search results
+    SEARCH_PAGE_SIZE = 32
 
     @property
     @abstractmethod
@@ -48,6 +153,11 @@ class DeploymentConfig(ABC):
         """name of the sqlite db file in an instance subdirectory."""
         pass
 
+    @property
+    def SECRET_KEY(self):
+        """The session signing key - the SESSION_KEY_FILE secret, or a generated key shared by the workers"""
+        return load_secret('SESSION_KEY_FILE', SESSION_KEY_FILE_NAME, SESSION_KEY_BYTES)
+
     @property
     def SQLALCHEMY_DATABASE_URI(self):
         """SQLALCHEMY Default/Fallback database uri is a local sqlite database"""
@@ -82,6 +192,8 @@ class ProductionDeployment(DeploymentConfig):
         for this file.
     """
     DB_NAME = 'genetwork_users'
+    EXPOSE_POOL_METRICS = _env_flag('EXPOSE_POOL_METRICS')
+    EXPOSE_METRICS = _env_flag('EXPOSE_METRICS')
                 
     # if a db password is given, update sqlalchemy to use the remote db
     _db_pass_path = os.environ.get('DB_PASSWORD_FILE')
@@ -90,6 +202,48 @@ class ProductionDeployment(DeploymentConfig):
             _db_pass = _db_pass_file.read()
         SQLALCHEMY_DATABASE_URI = f'postgresql://genetwork:{_db_pass}@db/{DB_NAME}'
 
+class SessionBackendConfig(ABC):
+    """Abstract base class for configuration of the storage of server-side session state
+
+    Session state is the hard difficulty's cache, the villains' counters and the
+    activity of sessions (which is used to expire them).
+    """
+    @property
+    @abstractmethod
+    def SESSION_BACKEND(self):
+        """The name of the session backend."""
+        pass
+
+    @abstractmethod
+    def init_session_backend(self, app):
+        """Sets up an application's storage of session state.
+
+        Args:
+            app (Flask): the app to initialize with the storage
+
+        Returns:
+            The client of the key-value store in which session state is kept,
+            None if session state is kept in the SQL databases.
+        """
+        pass
+
+class SqlSessionBackendConfig(SessionBackendConfig):
+    """configuration for session state kept in the SQL databases, expired by a garbage collector"""
+    SESSION_BACKEND = 'sql'
+
+    def init_session_backend(self, app):
+        return None
+
+class RedisSessionBackendConfig(SessionBackendConfig):
+    """configuration for session state kept in a Redis-compatible store, expired by key TTLs"""
+    SESSION_BACKEND = 'redis'
+    # the url of the Redis server. memory:// is an in-process stand-in, for a single worker process only
+    REDIS_URL = os.environ.get('REDIS_URL', 'memory://')
+
+    def init_session_backend(self, app):
+        from app.modules.kv_store import init_kv_store
+        return init_kv_store(app)
+
 class CacheConfig(ABC):
     """Abstract base class for configuration of the different user caches
 
@@ -117,16 +271,21 @@ class CacheConfig(ABC):
     def init_app(self, app):
         """Initializes an application.
         
-        Enables custom sessions (app.modules.session_manager) on the app
-        and initializes the app's cache using cache_setup.
+        Sets up the storage of session state (see SessionBackendConfig), enables
+        custom sessions (app.modules.session_manager) on the app and initializes
+        the app's cache using cache_setup.
 
         Args:
             app (Flask): the app to initialize
         """
         from app.modules.session_manager import create_sessions
+        kv_store = self.init_session_backend(app)
         create_sessions(app,
                         session_duration=APP_SESSION_DURATION,
-                        clean_interval=GARBAGE_COLLECTOR_CLEAN_INTERVAL)
+                        clean_interval=GARBAGE_COLLECTOR_CLEAN_INTERVAL,
+                        activity_bucket=SESSION_ACTIVITY_BUCKET,
+                        kv_store=kv_store,
+                        server_side=app.config['SERVER_SIDE_SESSIONS'])
         
         self.cache_setup(app)
 
@@ -148,18 +307,22 @@ class MediumCacheConfig(CacheConfig):
 
 
 class HardCacheConfig(CacheConfig):
-    """configuration for hard mode- SQL server-side session cache"""
+    """configuration for hard mode- server-side session cache, kept in the session backend"""
     def cache_setup(self, app):
-        from app.modules.user_cache import SqlLRUSessionCache
-        app.config['CACHING_TYPE'] = SqlLRUSessionCache
+        if self.SESSION_BACKEND == RedisSessionBackendConfig.SESSION_BACKEND:
+            from app.modules.user_cache import RedisLRUSessionCache
+            app.config['CACHING_TYPE'] = RedisLRUSessionCache
+        else:
+            from app.modules.user_cache import SqlLRUSessionCache
+            app.config['CACHING_TYPE'] = SqlLRUSessionCache
     
     INDEX_PAGE_TEMPLATE = 'index_hard.jinja'
 
 class AppConfigFactory:
-    """Factory class for making combined deployment + difficulty configs.
+    """Factory class for making combined deployment + difficulty + session backend configs.
 
-    Creates a combined configuration object which inherits from both
-    DeploymentConfig and CacheConfig.
+    Creates a combined configuration object which inherits from
+    DeploymentConfig, CacheConfig and SessionBackendConfig.
     """
     # Possible names for each deployment type
     DEV_CONFIG_NAMES = ['dev', 'development']
@@ -171,7 +334,11 @@ class AppConfigFactory:
     MEDIUM_CACHE_NAMES = ['aes', 'encrypt', 'encrypted', 'medium', 'normal']
     HARD_CACHE_NAMES = ['sql', 'sqlalchemy', 'hard']
 
-    def make(self, deploy_type=None, difficulty=None):
+    # Possible names for each session backend
+    SQL_BACKEND_NAMES = ['sql', 'database', 'db', None]
+    REDIS_BACKEND_NAMES = ['redis', 'kv', 'memory']
+
+    def make(self, deploy_type=None, difficulty=None, session_backend=None):
         """Factory method for creating complete app configurations
 
         Args:
@@ -182,6 +349,10 @@ class AppConfigFactory:
             difficulty (str, optional): String name for the challenge difficulty.
                 Defaults to None. If None, will attempt to get a string form
                 the environment variable 'DIFFICULTY'. Should be all lowercase.
+            session_backend (str, optional): String name for the storage of session
+                state. Defaults to None. If None, will attempt to get a string form
+                the environment variable 'SESSION_BACKEND', and if fails uses the
+                SQL databases. Should be all lowercase.
 
         Raises:
             ValueError: if an invalid configuration string is supplied in any way.
@@ -189,8 +360,8 @@ class AppConfigFactory:
                 'DIFFICULTY' is not set.
 
         Returns:
-            DeploymentConfig & CacheConfig: An instance which inherits from both
-                DeploymentConfig and CacheConfig to be used as a flask app config.
+            DeploymentConfig & CacheConfig & SessionBackendConfig: An instance which
+                inherits from all three to be used as a flask app config.
         """
         # get the deployment type
         if deploy_type is None:
@@ -218,7 +389,18 @@ class AppConfigFactory:
         else:
             raise ValueError("Invalid Session Type")
 
-        class MyConfig(deploy_config, difficulty):
+        # get the session backend config
+        if session_backend is None:
+            session_backend = os.environ.get('SESSION_BACKEND')
+
+        if session_backend in self.SQL_BACKEND_NAMES:
+            backend_config = SqlSessionBackendConfig
+        elif session_backend in self.REDIS_BACKEND_NAMES:
+            backend_config = RedisSessionBackendConfig
+        else:
+            raise ValueError("Invalid Session Backend")
+
+        class MyConfig(deploy_config, difficulty, backend_config):
             pass
 
         return MyConfig()
\ No newline at end of file
@@ -5,31 +5,54 @@
     Note:
         This module does not handle the api calls to the module.
 """
-from flask import send_from_directory, render_template, Blueprint, abort, request, current_app
-from sqlalchemy.sql.expression import func
-from app.models import SessionUsers, Villain, User
+from flask import render_template, Blueprint, abort, request, current_app, make_response
+from app.models import SessionUsers, Villain, UserGeneration, USER_CACHE
+from app.config import STATIC_CACHE_DIR, FRAGMENT_CACHE_SIZE, USER_GENERATION_CHECK_INTERVAL
+from app.modules.static_assets import StaticAssets
+from app.modules.fragment_cache import FragmentCache
 import os
+import random
 import time
 
 # directory constants
-STATIC_DIR = "static"   # path for static files folder
-IMAGE_DIR = "static/img"    # path for images folder
+FILE_DIR = os.path.abspath(os.path.dirname(__file__))   # the current directory
+STATIC_DIR = os.path.join(FILE_DIR, "static")   # path for static files folder
+IMAGE_DIR = "img/"  # path for images folder, relative to the static files folder
+STATIC_URL = "/static/"     # url prefix of static files
+VIEWS_DIR = os.path.join(FILE_DIR, "views") # path for templates folder
 
 INITIAL_EXPLORE_COUNT = 16  # The initial number of users shown in the explore view
+DECK_SEED_BITS = 31 # The size in bits of the random seeds of explore decks
 
 controllers = Blueprint('controllers', __name__, template_folder="views")
+STATIC_ASSETS = StaticAssets(STATIC_DIR, STATIC_URL, STATIC_CACHE_DIR)
+# rendered pages of users. the villain depends on the session, so it isn't cached
+FRAGMENT_CACHE = FragmentCache(
+    row_getter=USER_CACHE.get_many,
+    row_generation_getter=UserGeneration.current,
+    template_dirs=(VIEWS_DIR, STATIC_DIR),
+    max_size=FRAGMENT_CACHE_SIZE,
+    check_interval=USER_GENERATION_CHECK_INTERVAL,
+    bypass=lambda user: user.user_id == Villain.FAKE_COLS['user_id']
+)
+
+
+@controllers.app_template_global()
+def asset_url(path):
+    """Template helper which makes the fingerprinted url of a static file"""
+    return STATIC_ASSETS.url(path)
 
 
 @controllers.route('/img/<path:image>')
 def images(image):
     """Handles image queries"""
-    return send_from_directory(IMAGE_DIR, image)
+    return STATIC_ASSETS.send(IMAGE_DIR + image)
 
 
-@controllers.route('/static/<path:path>')
+@controllers.route(f'{STATIC_URL}<path:path>')
 def static_files(path):
     """Handles queries for static files"""
-    return send_from_directory(STATIC_DIR, path)
+    return STATIC_ASSETS.send(path)
 
 
 @controllers.route('/', methods=['GET', 'POST'])
@@ -43,39 +66,46 @@ def home():
             return render_template(current_app.config['INDEX_PAGE_TEMPLATE'])
         return render_template('index_base.jinja')
     
-    # get initial search matches
-    search_term = request.form.get('search')
-    query = SessionUsers.query.filter(SessionUsers.name.ilike(f"%{search_term}%"))
-
-    # enforce privacy select
-    privacy_select = request.form.get('privacySelect')
-    if privacy_select == "private":
-        query = query.filter(User.is_private==True)
-    elif privacy_select == "public":
-        query = query.filter(User.is_private==False)
-
-    # enforce specified values
-    if 'forceJob' in request.form:
-        query = query.filter(SessionUsers.job.isnot(None))
-    if 'forceLocation' in request.form:
-        query = query.filter(SessionUsers.location.isnot(None))
-
-    return render_template("search.jinja", users=query.all())
+    # get the first page of search matches, the rest are loaded by the page's js
+    query = SessionUsers.search(
+        request.form.get('search', ''),
+        privacy_select=request.form.get('privacySelect'),
+        force_job='forceJob' in request.form,
+        force_location='forceLocation' in request.form
+    )
+    users = SessionUsers.page(query, count=current_app.config['SEARCH_PAGE_SIZE'])
+    return render_template("search.jinja", users=users, user_count=query.count(), search_form=request.form)
 
 
 @controllers.route('/explore')
 def explore():
     """The explore users page"""
-    explore_users = SessionUsers.query.order_by(func.random()).limit(INITIAL_EXPLORE_COUNT).all()
-    return render_template("explore.jinja", users=explore_users)
+    deck_seed = random.getrandbits(DECK_SEED_BITS)
+    explore_users, deck_cursor = SessionUsers.deck(deck_seed, 0, INITIAL_EXPLORE_COUNT)
+    return render_template(
+        "explore.jinja",
+        users=explore_users,
+        deck_seed=deck_seed,
+        deck_cursor=deck_cursor
+    )
 
 @controllers.route('/user/<int:uid>')
 def show_user(uid):
-    """The profile pages of users"""
-    user = SessionUsers.query.filter(User.user_id==uid).first()
+    """The profile pages of users
+
+    Note:
+        Pages are identified by an ETag, so browsers revalidate
+        them and unchanged pages are answered with 304 Not Modified.
+    """
+    user = SessionUsers.get(uid)
     if user is None:
         abort(404)
-    return render_template("profile.jinja", user=user)
+    html, etag = FRAGMENT_CACHE.render("profile.jinja", user)
+    response = make_response(html)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 @controllers.route('/draw')
@@ -0,0 +1,164 @@
+"""
+    Schema migrations for databases created by earlier versions of the app.
+    db.create_all only creates missing tables, so changes to existing tables
+    are applied here. Migrations are idempotent and run on app initialization.
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import load_only
+from sqlalchemy.dialects import postgresql
+from app import db
+from app.config.avatar import Avatar
+import uuid
+
+BACKFILL_BATCH_SIZE = 1000  # number of rows updated per commit in backfills
+
+
+def add_missing_columns(model, *column_names):
+    """Adds columns declared on a model which are missing from it's table
+
+    Indices declared on the added columns are created too.
+
+    Args:
+        model (db.Model): the model whose table is migrated
+        *column_names (str): the names of the columns which should exist
+    """
+    table = model.__table__
+    engine = db.get_engine(bind=table.info.get('bind_key'))
+    existing = {col['name'] for col in inspect(engine).get_columns(table.name, schema=table.schema)}
+    preparer = engine.dialect.identifier_preparer
+
+    for name in column_names:
+        if name in existing:
+            continue
+        column = table.columns[name]
+        col_type = column.type.compile(dialect=engine.dialect)
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(
+                    f'ALTER TABLE {preparer.format_table(table)} '
+                    f'ADD COLUMN {preparer.format_column(column)} {col_type}'
+                ))
+                for index in table.indexes:
+                    if name in index.columns:
+                        index.create(connection)
+        except DBAPIError as e:
+            # If race occurred, another worker added the column, which is fine
+            print(f'Migration: Exception on adding {table.name}.{name}:', e)
+
+
+def backfill_dna_codes(model):
+    """Fills the packed avatar column of rows created before it existed
+
+    Args:
+        model (db.Model): a model which extends PackedDnaMixin
+    """
+    while True:
+        # only the used columns are loaded, columns added by later migrations may not exist yet
+        rows = model.query.options(load_only(model.dna, model.dna_code))\
+            .filter(model.dna_code.is_(None)).limit(BACKFILL_BATCH_SIZE).all()
+        if len(rows) == 0:
+            return
+        for row in rows:
+            row.dna_code = Avatar.from_dna(row.dna).to_int()
+        db.session.commit()
+
+
+def add_packed_dna_columns():
+    """Adds and fills the dna_code columns of users and villains"""
+    from app.models import User, Villain
+    for model in (User, Villain):
+        add_missing_columns(model, 'dna_code')
+        backfill_dna_codes(model)
+
+
+def add_villain_shapeshifts_column():
+    """Adds the shapeshift counter of villains, existing villains never shapeshifted"""
+    from app.models import Villain
+    add_missing_columns(Villain, 'shapeshifts')
+    Villain.query.filter(Villain.shapeshifts.is_(None)).update({'shapeshifts': 0}, synchronize_session=False)
+    db.session.commit()
+
+
+def convert_session_id_column(table, column):
+    """Converts a session id column stored as strings to binary ids (see SessionIdType)
+
+    On PostgreSQL, the column's type is changed to uuid. SQLite columns accept
+    blobs whatever their declared type, so only the stored values are converted.
+
+    Args:
+        table (Table): the table of the column
+        column (Column): a column of the SessionIdType type
+    """
+    engine = db.get_engine(bind=table.info.get('bind_key'))
+    inspector = inspect(engine)
+    if not inspector.has_table(table.name, schema=table.schema):
+        return
+    preparer = engine.dialect.identifier_preparer
+    table_name = preparer.format_table(table)
+    column_name = preparer.format_column(column)
+
+    if engine.dialect.name == 'postgresql':
+        existing = {col['name']: col['type'] for col in inspector.get_columns(table.name, schema=table.schema)}
+        if isinstance(existing[column.name], postgresql.UUID):
+            return
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(
+                    f'ALTER TABLE {table_name} ALTER COLUMN {column_name} TYPE uuid USING {column_name}::uuid'
+                ))
+        except DBAPIError as e:
+            # If race occurred, another worker converted the column, which is fine
+            print(f'Migration: Exception on converting {table.name}.{column.name}:', e)
+
+    elif engine.dialect.name == 'sqlite':
+        with engine.begin() as connection:
+            text_ids = connection.execute(text(
+                f"SELECT {column_name} FROM {table_name} WHERE typeof({column_name}) = 'text'"
+            )).scalars().all()
+            for ssid in text_ids:
+                connection.execute(
+                    text(f'UPDATE {table_name} SET {column_name} = :binary_id WHERE {column_name} = :text_id'),
+                    {'binary_id': uuid.UUID(ssid).bytes, 'text_id': ssid}
+                )
+
+
+def convert_session_id_columns():
+    """Converts the session id columns of all tables (villains, session activity and caches) to binary ids"""
+    from app.modules.session_manager import SessionIdType
+    for table in list(db.Model.metadata.tables.values()):
+        for column in table.columns:
+            if isinstance(column.type, SessionIdType):
+                convert_session_id_column(table, column)
+
+
+def add_session_activity_buckets():
+    """Adds the activity bucket column of the session activity tables
+
+    Sessions recorded before the column existed are placed in the current
+    bucket, so they expire a full session duration after the migration.
+    """
+    from app.modules.session_manager import SessionGarbageCollector
+    for collector in SessionGarbageCollector.app_collectors():
+        table = collector.SessionTable
+        add_missing_columns(table, 'activity_bucket')
+        table.query.filter(table.activity_bucket.is_(None))\
+            .update({'activity_bucket': collector.current_bucket()}, synchronize_session=False)
+        db.session.commit()
+
+
+"""The migrations applied on initialization, in order"""
+MIGRATIONS = [
+    add_packed_dna_columns,
+    add_villain_shapeshifts_column,
+    convert_session_id_columns,
+    add_session_activity_buckets,
+]
+
+
+def migrate():
+    """Applies all migrations to the app's databases. Requires an app context."""
+    for migration in MIGRATIONS:
+        migration()
+        # ends the migration's transaction, so it can't block schema changes of the next ones
+        db.session.commit()
@@ -2,11 +2,21 @@
     The application's models (MVC app setup).
     Configures database tables and configurations
 """
-from sqlalchemy import literal
+from sqlalchemy import literal, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import validates
+from flask import current_app
 from app.config.avatar import Avatar
+from app.config import USER_CACHE_SIZE, USER_GENERATION_CHECK_INTERVAL, DECK_CACHE_SIZE
 from app import db
 from faker import Faker
-from .modules.session_manager import SessionHandler
+from collections import namedtuple
+from .modules.session_manager import SessionHandler, SessionIdType, SessionKeyExpiry
+from .modules.kv_store import kv_store
+from .modules.row_cache import GenerationalCache
+from .modules.avatar_index import AvatarIndex
+import hashlib
+import hmac
 import random
 
 def choose_with_prob(cand1, cand2, prob1):
@@ -14,7 +24,43 @@ def choose_with_prob(cand1, cand2, prob1):
     choice_weights = [prob1, 1 - prob1]
     return random.choices((cand1, cand2), choice_weights)[0]
 
-class User(db.Model):
+class PackedDnaMixin:
+    """Mixin for models with a dna column, which adds a packed avatar column
+
+    The packed avatar (Avatar.to_int encoding of the dna) is kept in sync with
+    the dna, and allows decoding avatars without string parsing and querying
+    by avatar features with bitmasks.
+    """
+    # packed avatar integer, matches the dna column
+    dna_code = db.Column(db.BigInteger, index=True)
+
+    @validates('dna')
+    def _sync_dna_code(self, key, dna):
+        self.dna_code = Avatar.from_dna(dna).to_int()
+        return dna
+
+    @property
+    def avatar(self):
+        """Avatar: the avatar described by the row's dna"""
+        return Avatar.from_int(self.dna_code)
+
+    @classmethod
+    def has_part(cls, part_name, variation=None, color=None):
+        """Makes a filter for rows whose avatar has a body part with the given features
+
+        Args:
+            part_name (str): the name of the body part to match
+            variation (int, optional): the variation to match. If None, matches any variation.
+            color (str, optional): the color name to match. If None, matches any color.
+
+        Returns:
+            ColumnElement: an SQL expression usable in query filters
+        """
+        mask, value = Avatar.part_mask(part_name, variation, color)
+        return cls.dna_code.op('&')(mask) == value
+
+
+class User(PackedDnaMixin, db.Model):
     """Database model for genetwork's users"""
     __tablename__ = 'users'
     # internal user id for database
@@ -32,6 +78,157 @@ class User(db.Model):
         return f'<User {self.user_id}(name={self.name}, job={self.job},' +\
                f' location={self.location}, private={self.is_private})>'
 
+    def snapshot(self):
+        """Returns an immutable copy of the user row (a UserSnapshot)"""
+        return UserSnapshot(*(getattr(self, col) for col in UserSnapshot._fields))
+
+
+class UserSnapshot(namedtuple('UserSnapshot', [col.key for col in User.__table__.columns])):
+    """Immutable copy of a User row, safe to share between requests"""
+    __slots__ = ()
+
+    @property
+    def avatar(self):
+        """Avatar: the avatar described by the user's dna"""
+        return Avatar.from_int(self.dna_code)
+
+
+class UserGeneration(db.Model):
+    """Database model for the generation counter of the users table
+
+    The users table is only changed when it is (re)populated, which must bump
+    the generation so the workers' user caches are invalidated.
+    Generations are random rather than counted, since reseeding drops this
+    table too, and a counter would restart at a generation the workers cached.
+    """
+    __tablename__ = 'users_generation'
+    _ROW_ID = 1     # the table holds a single row
+    _GENERATION_BITS = 31   # random generations fit a signed 32 bit column
+
+    id = db.Column(db.Integer, primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def current(cls):
+        """Returns the current generation of the users table"""
+        row = cls.query.get(cls._ROW_ID)
+        return 0 if row is None else row.generation
+
+    @classmethod
+    def bump(cls):
+        """Marks the users table as changed. Commit is left to the caller."""
+        row = cls.query.get(cls._ROW_ID)
+        previous = 0 if row is None else row.generation
+        generation = previous
+        while generation in (0, previous):
+            generation = random.SystemRandom().getrandbits(cls._GENERATION_BITS)
+        if row is None:
+            db.session.add(cls(id=cls._ROW_ID, generation=generation))
+        else:
+            row.generation = generation
+
+
+class UserCache(GenerationalCache):
+    """Process-local read-through cache of user rows by their user id
+
+    Maps user ids to UserSnapshots, and keeps a list of all user ids.
+    """
+    def __init__(self):
+        super().__init__(
+            loader=self._load_users,
+            generation_getter=UserGeneration.current,
+            max_size=USER_CACHE_SIZE,
+            check_interval=USER_GENERATION_CHECK_INTERVAL
+        )
+        self._user_ids = None
+
+    @staticmethod
+    def _load_users(user_ids):
+        users = User.query.filter(User.user_id.in_(user_ids)).all()
+        return {user.user_id: user.snapshot() for user in users}
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._user_ids = None
+
+    def user_ids(self):
+        """Returns a tuple of the ids of all users"""
+        self._validate_generation()
+        with self._lock:
+            if self._user_ids is None:
+                self._user_ids = tuple(uid for uid, in db.session.query(User.user_id))
+            return self._user_ids
+
+    def warm_all(self):
+        """Loads all users (up to the cache size) into the cache"""
+        self.warm(self.user_ids()[:self.max_size])
+
+
+USER_CACHE = UserCache()
+
+
+def _build_public_avatar_indices(keys):
+    public_users = db.session.query(User.user_id, User.dna_code).filter(User.is_private==False).all()
+    ids = [uid for uid, _ in public_users]
+    codes = [code for _, code in public_users]
+    return {key: AvatarIndex(Avatar, ids, codes) for key in keys}
+
+_PUBLIC_AVATAR_INDEX = GenerationalCache(
+    loader=_build_public_avatar_indices,
+    generation_getter=UserGeneration.current,
+    max_size=1,
+    check_interval=USER_GENERATION_CHECK_INTERVAL
+)
+
+
+def public_avatar_index():
+    """Returns the worker's AvatarIndex of all public users' avatars
+
+    Private users are never indexed, so similarity searches can't leak their DNA.
+    The index is rebuilt whenever the users table generation changes.
+    """
+    return _PUBLIC_AVATAR_INDEX.get(Avatar)
+
+
+def _build_deck_permutations(keys):
+    population = sorted(USER_CACHE.user_ids())
+    villain_id = Villain.FAKE_COLS['user_id']
+    if villain_id not in population:
+        population.append(villain_id)
+
+    permutations = {}
+    for seed, cycle in keys:
+        # string seeds are hashed deterministically, so all workers agree on the order
+        permutation = list(population)
+        random.Random(f'{seed}:{cycle}').shuffle(permutation)
+        permutations[(seed, cycle)] = tuple(permutation)
+    return permutations
+
+_DECK_PERMUTATIONS = GenerationalCache(
+    loader=_build_deck_permutations,
+    generation_getter=UserGeneration.current,
+    max_size=DECK_CACHE_SIZE,
+    check_interval=USER_GENERATION_CHECK_INTERVAL
+)
+
+
+def deck_permutation(seed, cycle):
+    """Returns the order in which an explore deck shows users
+
+    Every pass (cycle) over all users of a deck is a different permutation
+    of the user ids, determined by the deck's seed. The permutations are
+    rebuilt whenever the users table generation changes.
+
+    Args:
+        seed (int): the seed of the deck
+        cycle (int): the index of the pass over all users
+
+    Returns:
+        tuple: the user ids (the villain id included) in the deck's order
+    """
+    return _DECK_PERMUTATIONS.get((seed, cycle))
+
 
 class UserFactory:
     """Factory for creating random users
@@ -87,20 +284,34 @@ class UserFactory:
         return User(**random_vals)
 
 
-class Villain(db.Model):
-    """Database model for the villains for each session"""
+class Villain(PackedDnaMixin, db.Model):
+    """Database model for the villains for each session
+
+    Villains are provisioned lazily. A session's villain is derived from it's
+    ssid and shapeshift count (see derive_dna), so a row is only stored once
+    the villain has state to keep - it's first detection or shapeshift.
+    Until then, the session's villain is a transient (unsaved) instance.
+
+    If the app keeps session state in a key-value store (see app.modules.kv_store),
+    villains are never stored in the database. Their counters are kept in a
+    hash of the store instead, incremented atomically and expiring with the session.
+    """
     __tablename__ = 'villains'
 
     _SESSION_HANDLER = SessionHandler()
     MAX_DETECTIONS = 256    # the maximal number of queries until the villain shapeshifts
     _EMERGENCY_OVER = 5
+    _DNA_DERIVATION_TEMPLATE = "villain:{}:{}"  # message of the villain dna derivation, by ssid and shapeshifts
+    KV_KEY_TEMPLATE = "genetwork:villain:{}"    # the hash of a villain's counters in a key-value store, by ssid
 
     # ssid of user to which the villain belongs
-    ssid = db.Column(db.String(_SESSION_HANDLER.UUID_LEN), primary_key=True, nullable=False)
+    ssid = db.Column(SessionIdType(), primary_key=True, nullable=False)
     # tracks the number queries to protected columns
     detections = db.Column(db.Integer, nullable=False, default=0)
     # dna for villain
     dna = db.Column(db.Text, nullable=False)
+    # the number of times the villain shapeshifted, from which it's dna is derived
+    shapeshifts = db.Column(db.Integer, default=0)
 
     # Properties which aren't real columns
     # These make the villain match the usual user columns
@@ -112,17 +323,116 @@ class Villain(db.Model):
         'job': None
     }
 
-    _USER_FACTORY = UserFactory(Avatar)
-    _DNA_RANDOMIZER = lambda: UserFactory.randomizers['dna'](Villain._USER_FACTORY)
+    @classmethod
+    def derive_dna(cls, ssid, shapeshifts):
+        """Derives the dna of a session's villain
+
+        The dna is generated from a keyed hash (with the app's secret key) of the
+        ssid and shapeshift count, so it can be recomputed by every worker
+        but can't be predicted from the (client visible) ssid.
+
+        Args:
+            ssid (str): the session id of the villain
+            shapeshifts (int): the number of times the villain shapeshifted
+
+        Returns:
+            str: the dna of the villain
+        """
+        key = current_app.secret_key
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        message = cls._DNA_DERIVATION_TEMPLATE.format(ssid, shapeshifts).encode('utf-8')
+        seed = hmac.new(key, message, hashlib.sha256).digest()
+        return Avatar.randomize(random.Random(seed)).to_dna()
+
+    @classmethod
+    def kv_keys(cls, ssid):
+        """Returns the keys of a session's villain in a key-value store"""
+        return [cls.KV_KEY_TEMPLATE.format(ssid)]
+
+    @classmethod
+    def for_session(cls, ssid):
+        """Returns a session's villain, the stored one or a transient one if none is stored"""
+        store = kv_store()
+        if store is not None:
+            counters = store.hgetall(cls.KV_KEY_TEMPLATE.format(ssid))
+            detections = int(counters.get(b'detections', 0))
+            shapeshifts = int(counters.get(b'shapeshifts', 0))
+            return cls(ssid=ssid, detections=detections, shapeshifts=shapeshifts, dna=cls.derive_dna(ssid, shapeshifts))
+
+        villain = cls.query.get(ssid)
+        if villain is None:
+            villain = cls(ssid=ssid, detections=0, shapeshifts=0, dna=cls.derive_dna(ssid, 0))
+        return villain
+
+    @property
+    def is_stored(self):
+        """bool: True if the villain is stored in the database"""
+        return not inspect(self).transient
+
+    def _store(self):
+        """Stores a transient villain
+
+        Returns:
+            Villain: the stored villain. If another request stored the session's
+                villain first, the stored villain is returned instead.
+        """
+        db.session.add(self)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return Villain.query.get(self.ssid)
+        SessionHandler.state_stored(self.ssid)
+        return self
+
+    def _kv_shapeshift(self, store):
+        key = self.KV_KEY_TEMPLATE.format(self.ssid)
+        pipeline = store.pipeline()
+        pipeline.hincrby(key, 'shapeshifts', 1)
+        pipeline.hset(key, 'detections', 0)
+        SessionKeyExpiry.expire_with_session(pipeline, key)
+        self.shapeshifts = pipeline.execute()[0]
+        self.dna = Villain.derive_dna(self.ssid, self.shapeshifts)
+        self.detections = 0
+
+    def _kv_notify_detection(self, store):
+        key = self.KV_KEY_TEMPLATE.format(self.ssid)
+        pipeline = store.pipeline()
+        pipeline.hincrby(key, 'detections', 1)
+        SessionKeyExpiry.expire_with_session(pipeline, key)
+        self.detections = pipeline.execute()[0]
+        # the atomic increment returns the count after this detection
+        if self.detections == self.MAX_DETECTIONS + 1 or \
+            self.detections > self.MAX_DETECTIONS + self._EMERGENCY_OVER:   # failsafe
+
+            self._kv_shapeshift(store)
 
     def shapeshift(self):
         """Changes the villains DNA and resets it's detections"""
-        self.dna = Villain._DNA_RANDOMIZER()
+        store = kv_store()
+        if store is not None:
+            self._kv_shapeshift(store)
+            return
+        self.shapeshifts = (self.shapeshifts or 0) + 1
+        self.dna = Villain.derive_dna(self.ssid, self.shapeshifts)
         self.detections = 0
+        if not self.is_stored:
+            stored = self._store()
+            if stored is not self:
+                stored.shapeshift()
+            return
         db.session.commit()
 
     def notify_detection(self):
         """Update the session-villain's detection counter"""
+        store = kv_store()
+        if store is not None:
+            self._kv_notify_detection(store)
+            return
+        if not self.is_stored:
+            self._store().notify_detection()
+            return
         cur_detections = Villain.query.filter(Villain.ssid==self.ssid).first().detections
         self.detections = Villain.__table__.columns.detections + 1  # atomic inc
         db.session.commit()  # refresh data against db for accurate cur_detections
@@ -152,31 +462,18 @@ class Villain(db.Model):
     @staticmethod
     def get_session_villain():
         """Returns the current session's villain"""
-        cur_ssid = Villain._SESSION_HANDLER.ssid
-        return Villain.query.filter_by(ssid=cur_ssid).first()
-
-    @classmethod
-    def get_user_columns(cls):
-        """Generates fake columns to make villains match the User class"""
-        user_col_names = [col.key for col in User.__table__.columns]
-        fake_columns = []
-        for col_name in user_col_names:
-            if col_name in cls.FAKE_COLS:
-                fake_columns.append(literal(cls.FAKE_COLS[col_name]).label(col_name))
-            else:
-                fake_columns.append(getattr(cls, col_name))
-        return fake_columns
-
-    @staticmethod
-    @_SESSION_HANDLER.on_session_create
-    def _make_villain(new_ssid):
-        db.session.add(
-            Villain(
-                ssid=new_ssid,
-                dna=Villain._DNA_RANDOMIZER(),
-            )
-        )
-        db.session.commit()
+        return Villain.for_session(Villain._SESSION_HANDLER.ssid)
+
+    def snapshot(self):
+        """Returns the villain as a user (a UserSnapshot)"""
+        return UserSnapshot(*(
+            self.FAKE_COLS[col] if col in self.FAKE_COLS else getattr(self, col)
+            for col in UserSnapshot._fields
+        ))
+
+    def user_columns(self):
+        """Generates literal columns which select the villain as a User row"""
+        return [literal(value).label(col) for col, value in self.snapshot()._asdict().items()]
     
     @staticmethod
     @_SESSION_HANDLER.on_session_delete
@@ -184,6 +481,8 @@ class Villain(db.Model):
         Villain.query.filter_by(ssid=ssid).delete()
         db.session.commit()
 
+SessionKeyExpiry.register_session_keys(Villain.kv_keys)
+
 class FakeQueryMeta(type):
     """Metaclass which allows a class to fake being a table!
 
@@ -216,17 +515,149 @@ class SessionUsers(metaclass=FakeQueryMeta):
     name = User.name
     user_id = User.user_id
     dna = User.dna
+    dna_code = User.dna_code
     job = User.job
     location = User.location
     is_private = User.is_private
 
     @classmethod
-    def fake_query(cls):
-        """Generate the query for the fake QueryAPI"""
-        static_users = User.query
+    def _session_villain(cls):
         try:
             ssid = cls._SESSION_HANDLER.ssid
-            relevant_villains = db.session.query(*Villain.get_user_columns()).filter(Villain.ssid==ssid)
-            return relevant_villains.union(static_users)
         except ValueError:  # if no session exists, no villain exists.
+            return None
+        return Villain.for_session(ssid)
+
+    @classmethod
+    def _session_villain_row(cls):
+        villain = cls._session_villain()
+        return None if villain is None else villain.snapshot()
+
+    @classmethod
+    def get(cls, uid):
+        """Fetches a session user by id
+
+        Regular users are served from the worker's user cache,
+        so only the session's villain is queried from the database.
+
+        Args:
+            uid (int): the id of the requested user
+
+        Returns:
+            UserSnapshot or Row: the user with the given id, None if missing
+        """
+        if uid == Villain.FAKE_COLS['user_id']:
+            villain = cls._session_villain_row()
+            if villain is not None:
+                return villain
+        return USER_CACHE.get(uid)
+
+    @classmethod
+    def sample(cls, count):
+        """Picks random session users (the villain included)
+
+        Args:
+            count (int): the number of users to pick. If there are less users,
+                all users are returned.
+
+        Returns:
+            list: the picked users in random order
+        """
+        population = list(USER_CACHE.user_ids())
+        villain_id = Villain.FAKE_COLS['user_id']
+        if villain_id not in population:
+            population.append(villain_id)
+        picked_ids = random.sample(population, min(count, len(population)))
+        return cls._fetch_ordered(picked_ids)
+
+    @classmethod
+    def deck(cls, seed, cursor, count):
+        """Picks the next users of an explore deck
+
+        Decks walk over a seeded permutation of the users, so successive
+        picks from the same deck don't repeat users until all users were shown.
+
+        Args:
+            seed (int): the seed of the deck
+            cursor (int): the position in the deck of the first picked user
+            count (int): the number of users to pick
+
+        Returns:
+            tuple: a list of the picked users, and the cursor of the next pick
+        """
+        picked_ids = []
+        while len(picked_ids) < count:
+            cycle, position = divmod(cursor, len(deck_permutation(seed, 0)))
+            taken = deck_permutation(seed, cycle)[position:position + count - len(picked_ids)]
+            picked_ids.extend(taken)
+            cursor += len(taken)
+
+        return cls._fetch_ordered(picked_ids), cursor
+
+    @classmethod
+    def _fetch_ordered(cls, user_ids):
+        """Fetches session users by ids, keeping the order of the ids"""
+        users = USER_CACHE.get_many(user_ids)
+        villain_id = Villain.FAKE_COLS['user_id']
+        if villain_id in user_ids:
+            villain = cls._session_villain_row()
+            if villain is not None:
+                users[villain_id] = villain
+        return [users[uid] for uid in user_ids if uid in users]
+
+    @classmethod
+    def search(cls, term, privacy_select=None, force_job=False, force_location=False):
+        """Makes a query for the session users matching a search
+
+        Args:
+            term (str): a substring of the names of matching users
+            privacy_select (str, optional): 'private' or 'public' to match only
+                private or public users. Otherwise, matches both.
+            force_job (bool, optional): match only users who specify a job. Defaults to False.
+            force_location (bool, optional): match only users who specify a location. Defaults to False.
+
+        Returns:
+            Query: a query of the matching users
+        """
+        query = cls.query.filter(cls.name.ilike(f"%{term}%"))
+
+        # enforce privacy select
+        if privacy_select == "private":
+            query = query.filter(cls.is_private==True)
+        elif privacy_select == "public":
+            query = query.filter(cls.is_private==False)
+
+        # enforce specified values
+        if force_job:
+            query = query.filter(cls.job.isnot(None))
+        if force_location:
+            query = query.filter(cls.location.isnot(None))
+        return query
+
+    @classmethod
+    def page(cls, query, after=None, count=None):
+        """Fetches a page of users from a query using keyset pagination
+
+        Args:
+            query (Query): a query of session users
+            after (int, optional): only users with a larger user id are fetched.
+                If None, fetches the first page.
+            count (int, optional): the maximal number of users in the page.
+                If None, fetches all remaining users.
+
+        Returns:
+            list: the users of the page, ordered by their user id
+        """
+        if after is not None:
+            query = query.filter(cls.user_id > after)
+        return query.order_by(cls.user_id).limit(count).all()
+
+    @classmethod
+    def fake_query(cls):
+        """Generate the query for the fake QueryAPI"""
+        static_users = User.query
+        villain = cls._session_villain()
+        if villain is None:
             return static_users
+        # the villain may not be stored yet, so it's selected as literal values
+        return db.session.query(*villain.user_columns()).union(static_users)
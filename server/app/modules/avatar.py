@@ -8,7 +8,7 @@ from enum import Enum
 from math import log2, ceil
 from abc import abstractmethod, ABC
 from functools import reduce
-from random import randint, choice
+import random
 from utils.colors import COLOR_NAMES
 
 """ Enum for encoding the base units of DNA """
@@ -131,22 +131,87 @@ class BodyPart(ABC):
 
         return cls(variation, color)
 
+    def to_int(self):
+        """Encodes the body part to an integer
+
+        The integer's binary representation matches the to_bitstring encoding.
+
+        Returns:
+            int: an integer encoding of the body part
+        """
+        code = self.variation if self.VARIATIONS > 1 else 0
+        if self.IS_COLORABLE:
+            code = (code << self.COLOR_BIT_LEN) | COLOR_NAMES.index(self.color)
+        return code
+
     @classmethod
-    def randomize(cls):
+    def from_int(cls, code):
+        """Creates the body part represented by an integer
+
+        Args:
+            code (int): an integer which matches the to_int method.
+
+        Returns:
+            BodyPart: an instance of the class (extends BodyPart) which is encoded in the integer.
+        """
+        assert 0 <= code < (1 << cls.bit_len()), "Integer decode out of range"
+
+        # if required decode color
+        if cls.IS_COLORABLE:
+            color = COLOR_NAMES[code & ((1 << cls.COLOR_BIT_LEN) - 1)]
+            code >>= cls.COLOR_BIT_LEN
+        else:
+            color = None
+
+        # decode variation
+        variation = code if cls.VARIATIONS > 1 else None
+
+        return cls(variation, color)
+
+    @classmethod
+    def int_mask(cls, variation=None, color=None):
+        """Makes a bitmask matching parts with the given features
+
+        Args:
+            variation (int, optional): the variation to match. If None, matches any variation.
+            color (str, optional): the color name to match. If None, matches any color.
+
+        Returns:
+            tuple: (mask, value) such that an integer encoded part `code`
+                has the given features if and only if `code & mask == value`.
+        """
+        mask = value = 0
+        if color is not None:
+            assert cls.IS_COLORABLE, "color can only be matched for colorable body parts"
+            mask = (1 << cls.COLOR_BIT_LEN) - 1
+            value = COLOR_NAMES.index(color)
+        if variation is not None:
+            assert (0 <= variation < cls.VARIATIONS), \
+                f"variation must be between 0 (inclusive) and {cls.VARIATIONS} (exclusive)"
+            color_len = cls.COLOR_BIT_LEN if cls.IS_COLORABLE else 0
+            mask |= ((1 << _bit_length(cls.VARIATIONS)) - 1) << color_len
+            value |= variation << color_len
+        return mask, value
+
+    @classmethod
+    def randomize(cls, rng=random):
         """Randomly generate a body part
 
+        Args:
+            rng (random.Random, optional): the source of randomness. Defaults to the random module.
+
         Returns:
             BodyPart: A randomized body part of the matching class.
         """
         # if required generate color
         if cls.IS_COLORABLE:
-            color = choice(COLOR_NAMES)
+            color = rng.choice(COLOR_NAMES)
         else:
             color = None
 
         # if required generate variation
         if cls.VARIATIONS > 1:
-            variation = randint(0, cls.VARIATIONS - 1)
+            variation = rng.randint(0, cls.VARIATIONS - 1)
         else:
             variation = None
 
@@ -251,6 +316,119 @@ class AvatarBase(ABC):
             part_strings, cls._BODY_PART_TYPES)]
         return cls(*parts)
 
+    def to_int(self):
+        """Encodes the avatar into an integer (packed avatar)
+
+        The integer's binary representation matches the to_bitstring encoding,
+        so the first body part takes up the most significant bits.
+
+        Returns:
+            int: integer which represents the avatar
+        """
+        code = 0
+        for part in self.body_parts:
+            code = (code << part.bit_len()) | part.to_int()
+        return code
+
+    @classmethod
+    def from_int(cls, code):
+        """Creates an avatar from it's describing integer, without string parsing
+
+        Args:
+            code (int): an integer which matches the to_int format of the avatar.
+
+        Raises:
+            ValueError: The integer doesn't match the format.
+
+        Returns:
+            AvatarBase: an instance of this avatar subclass whose features match
+                the supplied integer.
+        """
+        if not (0 <= code < (1 << cls.bit_len())):
+            raise ValueError("Bad avatar integer")
+
+        parts = []
+        for p_type in reversed(cls._BODY_PART_TYPES):
+            part_len = p_type.bit_len()
+            parts.append(p_type.from_int(code & ((1 << part_len) - 1)))
+            code >>= part_len
+        return cls(*reversed(parts))
+
+    @classmethod
+    def schema(cls):
+        """Describes the DNA encoding of the avatar
+
+        The description allows clients to decode DNA sequences by themselves.
+
+        Returns:
+            dict: the nucleotide order, bit lengths, color palette and the body
+                parts of the avatar (in encoding order) with their properties.
+        """
+        return {
+            'nucleotides': [nucleotide.name for nucleotide in DNANucleotide],
+            'bits_in_nucleotide': cls.BITS_IN_NUCLEOTIDE,
+            'bit_len': cls.bit_len(),
+            'color_bit_len': BodyPart.COLOR_BIT_LEN,
+            'palette': list(COLOR_NAMES),
+            'parts': [
+                {
+                    'name': name,
+                    'bit_len': part.bit_len(),
+                    'variations': part.VARIATIONS,
+                    'variation_bit_len': _bit_length(part.VARIATIONS),
+                    'is_colorable': part.IS_COLORABLE
+                }
+                for name, part in cls.part_types().items()
+            ]
+        }
+
+    @classmethod
+    def part_types(cls):
+        """The body parts registered to the avatar
+
+        Returns:
+            dict: maps body part names to their BodyPart classes, in registration order
+        """
+        return {cls._part_to_name(part): part for part in cls._BODY_PART_TYPES}
+
+    @classmethod
+    def part_offset(cls, part_name):
+        """The position of a body part within the integer encoding of the avatar
+
+        Args:
+            part_name (str): the name of the body part
+
+        Raises:
+            KeyError: the avatar has no body part with the given name.
+
+        Returns:
+            int: the number of bits to the right of (less significant than) the part
+        """
+        key = part_name.lower()
+        if key not in cls.__PART_NAME_TO_INDEX:
+            raise KeyError(f"{cls.__qualname__} has not body part {key}")
+
+        index = cls.__PART_NAME_TO_INDEX[key]
+        return sum(p.bit_len() for p in cls._BODY_PART_TYPES[index + 1:])
+
+    @classmethod
+    def part_mask(cls, part_name, variation=None, color=None):
+        """Makes a bitmask matching avatars which have a body part with the given features
+
+        Args:
+            part_name (str): the name of the body part to match
+            variation (int, optional): the variation to match. If None, matches any variation.
+            color (str, optional): the color name to match. If None, matches any color.
+
+        Returns:
+            tuple: (mask, value) such that an avatar encoded by to_int as `code`
+                matches if and only if `code & mask == value`.
+        """
+        offset = cls.part_offset(part_name)
+        part_type = cls._BODY_PART_TYPES[cls.__PART_NAME_TO_INDEX[part_name.lower()]]
+        mask, value = part_type.int_mask(variation, color)
+        return mask << offset, value << offset
+
     def to_dna(self):
         """Encodes the avatar to a DNA sequence.
         
@@ -301,13 +479,16 @@ class AvatarBase(ABC):
         return cls.from_bitstring(bitstring)
 
     @classmethod
-    def randomize(cls):
+    def randomize(cls, rng=random):
         """Randomly generate an avatar
 
+        Args:
+            rng (random.Random, optional): the source of randomness. Defaults to the random module.
+
         Returns:
             AvatarBase: creates an avatar which has all of it's body parts randomized.
         """
-        return cls(*(p.randomize() for p in cls._BODY_PART_TYPES))
+        return cls(*(p.randomize(rng) for p in cls._BODY_PART_TYPES))
     
     @staticmethod
     def _part_to_name(part):
@@ -0,0 +1,122 @@
+"""Similarity search over packed avatars
+
+This module builds a columnar index of the body part features (variations
+and colors) of many avatars packed as integers (see AvatarBase.to_int), and
+answers nearest-avatar queries with a vectorized scan over the index.
+"""
+
+import numpy as np
+from utils.colors import COLOR_NAMES, COLOR_RGB
+
+VARIATION_MISMATCH_COST = 1.0   # distance added for every body part with a different variation
+GROUP_BIT_LIMIT = 16    # maximal bit length of a group of consecutive body parts scanned together
+
+
+def color_distances():
+    """Computes the distances between all palette colors
+
+    Returns:
+        np.ndarray: a matrix of the euclidean RGB distances between each pair
+            of colors in COLOR_NAMES (by index), scaled to the range [0, 1].
+    """
+    rgb = np.array([COLOR_RGB[name] for name in COLOR_NAMES], dtype=np.float32)
+    diffs = rgb[:, np.newaxis, :] - rgb[np.newaxis, :, :]
+    distances = np.sqrt((diffs ** 2).sum(axis=-1))
+    return distances / distances.max()
+
+
+class AvatarIndex:
+    """An index of packed avatars for similar avatar queries
+
+    The distance between two avatars is the sum of the distances between their
+    body parts. Body parts of different variations are VARIATION_MISMATCH_COST
+    apart, and colorable parts add the distance between their colors.
+
+    Attributes:
+        avatar_cls (type): the subclass of AvatarBase of the indexed avatars.
+        ids (np.ndarray): the ids of the indexed avatars.
+    """
+    _COLOR_DISTANCES = color_distances()
+
+    def __init__(self, avatar_cls, ids, codes):
+        """
+        Args:
+            avatar_cls (type): the subclass of AvatarBase of the indexed avatars
+            ids (sequence of int): the ids of the indexed avatars
+            codes (sequence of int): the packed avatars (to_int encodings) matching the ids
+        """
+        assert len(ids) == len(codes), "Every indexed avatar must have an id"
+        self.avatar_cls = avatar_cls
+        self.ids = np.asarray(ids, dtype=np.int64)
+        codes = np.asarray(codes, dtype=np.int64)
+
+        # group consecutive body parts, so each group has at most GROUP_BIT_LIMIT bits
+        self._groups = []
+        for part_type in avatar_cls.part_types().values():
+            group_len = sum(p.bit_len() for p in self._groups[-1]) if self._groups else None
+            if group_len is None or group_len + part_type.bit_len() > GROUP_BIT_LIMIT:
+                self._groups.append([])
+            self._groups[-1].append(part_type)
+
+        # split the packed avatars to a column of codes for each group
+        self._group_codes = []
+        offset = avatar_cls.bit_len()
+        for group in self._groups:
+            group_len = sum(p.bit_len() for p in group)
+            offset -= group_len
+            group_codes = (codes >> offset) & ((1 << group_len) - 1)
+            self._group_codes.append(group_codes.astype(np.uint16))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _part_distance_table(self, part):
+        """Computes the distances of all possible codes of a body part's type from the part"""
+        part_type = type(part)
+        all_codes = np.arange(1 << part_type.bit_len())
+        variations = all_codes
+        table = np.zeros(len(all_codes), dtype=np.float32)
+        if part_type.IS_COLORABLE:
+            color_row = self._COLOR_DISTANCES[COLOR_NAMES.index(part.color)]
+            table += color_row[all_codes & ((1 << part_type.COLOR_BIT_LEN) - 1)]
+            variations = all_codes >> part_type.COLOR_BIT_LEN
+        table += (variations != part.variation) * np.float32(VARIATION_MISMATCH_COST)
+        return table
+
+    def distances(self, avatar):
+        """Computes the distance of every indexed avatar from an avatar
+
+        Args:
+            avatar (AvatarBase): the avatar to measure distances from
+
+        Returns:
+            np.ndarray: the distances of the indexed avatars, ordered like ids
+        """
+        total = np.zeros(len(self.ids), dtype=np.float32)
+        parts = iter(avatar.body_parts)
+        for group, group_codes in zip(self._groups, self._group_codes):
+            # a group has at most 2^GROUP_BIT_LIMIT possible codes, so distances are
+            # computed once per code and looked up for every indexed avatar
+            table = np.zeros(1, dtype=np.float32)
+            for _ in group:
+                table = np.add.outer(table, self._part_distance_table(next(parts))).ravel()
+            total += table[group_codes]
+        return total
+
+    def nearest(self, avatar, k):
+        """Finds the indexed avatars closest to an avatar
+
+        Args:
+            avatar (AvatarBase): the avatar to which similar avatars are searched
+            k (int): the maximal number of results
+
+        Returns:
+            list of tuple: (id, distance) pairs of the k closest avatars, closest first
+        """
+        distances = self.distances(avatar)
+        if k < len(distances):
+            candidates = np.argpartition(distances, k)[:k]
+        else:
+            candidates = np.arange(len(distances))
+        ordered = candidates[np.argsort(distances[candidates], kind='stable')]
+        return [(int(self.ids[i]), float(distances[i])) for i in ordered]
@@ -0,0 +1,257 @@
+"""Database connection pooling utilities
+
+This module extends flask-sqlalchemy with per-bind connection pool
+configuration, optional consolidation of all binds into a single database
+(and a single pool), optional hash partitioning of tables and connection
+pool metrics.
+"""
+
+from flask_sqlalchemy import SQLAlchemy, _EngineConnector, get_state
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.schema import DDL, Table
+from threading import Lock
+import time
+
+DEFAULT_BIND_NAME = "default"   # the name used for the default (bind-less) engine in metrics
+PARTITION_NAME_TEMPLATE = "{table}_p{remainder}"    # the name of a hash partition of a table
+SQLITE_IGNORED_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+"""Pool options which sqlite engines (which don't use a QueuePool) can't accept"""
+
+
+class PoolMetrics:
+    """Thread-safe counters of connection pool activity for a single engine
+
+    Attributes:
+        checkouts (int): the number of connections checked out of the pool.
+        checkins (int): the number of connections returned to the pool.
+        connects (int): the number of new DBAPI connections the pool opened.
+        wait_count (int): the number of timed checkouts.
+        wait_time_total (float): the total time in seconds spent waiting for checkouts.
+        wait_time_max (float): the longest time in seconds a checkout waited.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.wait_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _increment(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_wait(self, seconds):
+        """Records the time a single checkout waited for a connection
+
+        Args:
+            seconds (float): the time in seconds the checkout took
+        """
+        with self._lock:
+            self.wait_count += 1
+            self.wait_time_total += seconds
+            self.wait_time_max = max(self.wait_time_max, seconds)
+
+    def attach(self, engine):
+        """Listens to the pool events of an engine and counts them"""
+        event.listen(engine, 'checkout', lambda *args: self._increment('checkouts'))
+        event.listen(engine, 'checkin', lambda *args: self._increment('checkins'))
+        event.listen(engine, 'connect', lambda *args: self._increment('connects'))
+        if isinstance(engine.pool, MeteredQueuePool):
+            engine.pool.metrics = self
+
+    def snapshot(self, pool=None):
+        """Returns the current metrics as a dict
+
+        Args:
+            pool (Pool, optional): the pool the metrics belong to. If given,
+                the live pool status (size and checked out connections) is added.
+
+        Returns:
+            dict: a mapping of metric names to their current values
+        """
+        with self._lock:
+            stats = {
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'connects': self.connects,
+                'wait_count': self.wait_count,
+                'wait_time_total': self.wait_time_total,
+                'wait_time_max': self.wait_time_max,
+            }
+        if isinstance(pool, QueuePool):
+            stats['pool_size'] = pool.size()
+            stats['checked_out'] = pool.checkedout()
+            stats['overflow'] = pool.overflow()
+        return stats
+
+
+class MeteredQueuePool(QueuePool):
+    """A QueuePool which times how long checkouts wait for a connection
+
+    Attributes:
+        metrics (PoolMetrics): the metrics to which wait times are reported.
+            If None, waits are not timed.
+    """
+    metrics = None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_wait(time.perf_counter() - start)
+
+    def recreate(self):
+        # keep reporting to the same metrics after engine disposal
+        new_pool = super().recreate()
+        new_pool.metrics = self.metrics
+        return new_pool
+
+
+class _PooledEngineConnector(_EngineConnector):
+    """Engine connector which applies the per-bind pool options of the app"""
+    def __init__(self, sa, app, bind=None):
+        super().__init__(sa, app, bind)
+        self.metrics = PoolMetrics()
+        self._metered_engine = None
+
+    def get_options(self, sa_url, echo):
+        sa_url, options = super().get_options(sa_url, echo)
+        pool_options = self._app.config.get('SQLALCHEMY_POOL_OPTIONS') or {}
+        bind_options = dict(pool_options.get(self._bind, {}))
+
+        if sa_url.get_backend_name() == 'sqlite':
+            for option in SQLITE_IGNORED_OPTIONS:
+                bind_options.pop(option, None)
+        else:
+            options.setdefault('poolclass', MeteredQueuePool)
+
+        options.update(bind_options)
+        return sa_url, options
+
+    def get_engine(self):
+        engine = super().get_engine()
+        if engine is not self._metered_engine:
+            self.metrics.attach(engine)
+            self._metered_engine = engine
+        return engine
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """flask-sqlalchemy extension with per-bind pool options and pool metrics
+
+    The following app configuration values are used:
+        SQLALCHEMY_POOL_OPTIONS (dict): maps bind names (None for the default
+            database) to `create_engine` pool keyword arguments for that bind.
+        SQLALCHEMY_CONSOLIDATE_BINDS (bool): if True, all binds share the engine
+            (and pool) of the default database. On servers which support schemas,
+            tables of each bind are placed in a schema named after the bind.
+    """
+    def make_connector(self, app=None, bind=None):
+        return _PooledEngineConnector(self, self.get_app(app), bind)
+
+    def get_engine(self, app=None, bind=None):
+        if is_consolidated(self.get_app(app)):
+            bind = None
+        return super().get_engine(app, bind)
+
+    def create_all(self, bind='__all__', app=None):
+        app = self.get_app(app)
+        if is_consolidated(app):
+            engine = self.get_engine(app)
+            schemas = {table.schema for table in self.Model.metadata.tables.values()}
+            if engine.dialect.name == 'postgresql':
+                with engine.begin() as connection:
+                    for schema in schemas - {None}:
+                        connection.execute(DDL(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
+        super().create_all(bind, app)
+
+    def pool_stats(self, app=None):
+        """Returns the pool metrics of all engines created for an app
+
+        Args:
+            app (Flask, optional): the app whose engines are inspected.
+                Defaults to the app in context.
+
+        Returns:
+            dict: maps bind names to a PoolMetrics snapshot of the bind's engine
+        """
+        state = get_state(self.get_app(app))
+        stats = {}
+        for bind, connector in list(state.connectors.items()):
+            pool = connector._engine.pool if connector._engine is not None else None
+            stats[bind or DEFAULT_BIND_NAME] = connector.metrics.snapshot(pool)
+        return stats
+
+
+def is_consolidated(app):
+    """Checks whether an app consolidates all binds into the default database"""
+    return bool(app.config.get('SQLALCHEMY_CONSOLIDATE_BINDS'))
+
+
+def hash_partition_count(app):
+    """Returns the number of hash partitions of partitioned tables, 0 if tables aren't partitioned
+
+    Tables are only partitioned on PostgreSQL, and only if the app's
+    SESSION_TABLE_PARTITIONS configuration value is positive.
+    """
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+        return 0
+    return max(app.config.get('SESSION_TABLE_PARTITIONS') or 0, 0)
+
+
+def bind_table_args(app, bind_key, *table_args, hash_partition_column=None):
+    """Makes the __table_args__ of a model which belongs to a bind
+
+    When binds are consolidated into a database which supports schemas,
+    tables are placed in a schema named after their bind, keeping the layout
+    of the separate databases.
+
+    Note:
+        The primary key and unique constraints of a hash partitioned table
+        must include the partition column.
+
+    Args:
+        app (Flask): the app whose configuration the model follows
+        bind_key (str): the flask-sqlalchemy bind of the model
+        *table_args: positional table arguments (constraints, indices etc.)
+        hash_partition_column (str, optional): if given, the table is partitioned
+            by the hash of this column when the app partitions tables (see hash_partition_count).
+
+    Returns:
+        tuple: table arguments to be used as the model's __table_args__
+    """
+    table_kwargs = {}
+    uses_schemas = not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+    if is_consolidated(app) and uses_schemas:
+        table_kwargs['schema'] = bind_key
+
+    partitions = hash_partition_count(app)
+    if hash_partition_column is not None and partitions > 0:
+        table_kwargs['postgresql_partition_by'] = f'HASH ({hash_partition_column})'
+        table_kwargs['info'] = {'hash_partitions': partitions}
+
+    if table_kwargs:
+        return (*table_args, table_kwargs)
+    return table_args
+
+
+@event.listens_for(Table, 'after_create')
+def _create_hash_partitions(table, connection, **kwargs):
+    """Creates the partitions of a hash partitioned table along with it"""
+    partitions = table.info.get('hash_partitions')
+    if not partitions or connection.dialect.name != 'postgresql':
+        return
+    preparer = connection.dialect.identifier_preparer
+    for remainder in range(partitions):
+        partition = preparer.quote(PARTITION_NAME_TEMPLATE.format(table=table.name, remainder=remainder))
+        if table.schema is not None:
+            partition = f'{preparer.quote_schema(table.schema)}.{partition}'
+        connection.execute(DDL(
+            f'CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {preparer.format_table(table)} '
+            f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})'
+        ))
@@ -0,0 +1,118 @@
+"""Process-local caching of rendered per-user template fragments
+
+Pages and fragments which depend only on an immutable user row are rendered
+once per worker, and identified by an ETag derived from the rendered output,
+so unchanged pages can be answered with 304 Not Modified.
+"""
+
+from flask import render_template
+from .row_cache import GenerationalCache
+import hashlib
+import os
+
+ETAG_LENGTH = 16    # the number of hex digits in fragment ETags
+
+
+def directory_version(*directories):
+    """Computes a version of the files in directories, which changes when any file changes
+
+    Args:
+        *directories (str): the directories whose files are versioned
+
+    Returns:
+        str: a hex digest of the paths, sizes and modification times of all files
+    """
+    digest = hashlib.sha256()
+    for directory in directories:
+        for root, _, files in sorted(os.walk(directory)):
+            for name in sorted(files):
+                stat = os.stat(os.path.join(root, name))
+                digest.update(f'{root}/{name}:{stat.st_size}:{stat.st_mtime_ns};'.encode('utf-8'))
+    return digest.hexdigest()[:ETAG_LENGTH]
+
+
+class FragmentCache(GenerationalCache):
+    """A cache of templates rendered for single users, keyed by (template, user id)
+
+    Templates are rendered with the user bound to `user`, and to `users` as a
+    single user list (so list item templates render a single item).
+    Entries are (html, etag) pairs. The cache is cleared whenever the rows'
+    generation or the version of the templates (and the assets they link) changes.
+
+    Attributes:
+        row_getter (callable): receives a list of user ids and returns a dict
+            which maps the found ids to their rows.
+        template_dirs (tuple of str): the directories whose files the rendered output depends on.
+        bypass (callable): receives a row and returns True if it's output mustn't be
+            cached (e.g. rows which depend on the session).
+    """
+    def __init__(self, row_getter, row_generation_getter, template_dirs, max_size, check_interval=0, bypass=None):
+        self.row_getter = row_getter
+        self.bypass = bypass if bypass is not None else (lambda row: False)
+        self.template_dirs = tuple(template_dirs)
+        super().__init__(
+            loader=self._render_fragments,
+            generation_getter=lambda: (row_generation_getter(), directory_version(*self.template_dirs)),
+            max_size=max_size,
+            check_interval=check_interval
+        )
+
+    def _render_fragments(self, keys):
+        rows = self.row_getter([user_id for _, user_id in keys])
+        fragments = {}
+        for template, user_id in keys:
+            if user_id in rows:
+                row = rows[user_id]
+                fragments[(template, user_id)] = render_fragment(template, user=row, users=[row])
+        return fragments
+
+    def render(self, template, user):
+        """Renders a template for a user
+
+        Args:
+            template (str): the name of the rendered template
+            user: the row of the user the template is rendered for
+
+        Returns:
+            tuple: the rendered html and it's ETag
+        """
+        if self.bypass(user):
+            return render_fragment(template, user=user, users=[user])
+        rendered = self.get((template, user.user_id))
+        if rendered is None:
+            # the row isn't in the table (anymore), render it as is
+            return render_fragment(template, user=user, users=[user])
+        return rendered
+
+    def render_list(self, template, users):
+        """Renders a template for each of several users, and joins the outputs
+
+        Args:
+            template (str): the name of the rendered template
+            users (list): the rows of the users to render, in order
+
+        Returns:
+            str: the html rendered for all users
+        """
+        cached = self.get_many([(template, user.user_id) for user in users if not self.bypass(user)])
+        fragments = []
+        for user in users:
+            rendered = None if self.bypass(user) else cached.get((template, user.user_id))
+            if rendered is None:
+                rendered = render_fragment(template, user=user, users=[user])
+            fragments.append(rendered[0])
+        return ''.join(fragments)
+
+
+def render_fragment(template, **context):
+    """Renders a template to an (html, etag) pair
+
+    Args:
+        template (str): the name of the rendered template
+        **context: the variables the template is rendered with
+
+    Returns:
+        tuple: the rendered html and an ETag derived from it
+    """
+    html = render_template(template, **context)
+    return html, hashlib.sha256(html.encode('utf-8')).hexdigest()[:ETAG_LENGTH]
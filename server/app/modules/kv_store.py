@@ -0,0 +1,299 @@
+"""Redis-compatible key-value storage for ephemeral per-session state
+
+Connects to a Redis server given by a `redis://` (or `rediss://`, `unix://`)
+url, which requires the optional `redis` package, or to an in-process
+stand-in given by a `memory://` url. The stand-in implements the subset of
+Redis commands (and their redis-py signatures and return values) which the app
+uses - strings, hashes, sorted sets, key TTLs and transactional pipelines - so
+the app runs without a Redis server.
+
+Note:
+    The stand-in's data is private to the worker process, so it must only be
+    used with a single worker process (development, tests and benchmarks).
+"""
+
+from flask import current_app
+from threading import RLock
+import time
+
+MEMORY_URL_SCHEME = "memory://"     # the url scheme of the in-process stand-in
+EXTENSION_NAME = "kv_store"     # the key of the store in the app's extensions
+
+
+class InProcessRedis:
+    """A thread-safe, in-process stand-in for a Redis server (through redis-py)
+
+    Values are stored as bytes and returned as bytes, like redis-py without
+    `decode_responses`. Expired keys are removed when accessed, and by a sweep
+    of all keys with a TTL at most every SWEEP_INTERVAL seconds.
+    """
+    SWEEP_INTERVAL = 1  # the minimal seconds between sweeps of expired keys
+
+    def __init__(self):
+        self._data = {}     # name -> (type name, value)
+        self._deadlines = {}    # name -> expiry time (in time.monotonic seconds)
+        self._last_sweep = time.monotonic()
+        self._lock = RLock()
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bytes):
+            return value
+        if isinstance(value, (int, float)):
+            return repr(value).encode('utf-8')
+        return str(value).encode('utf-8')
+
+    def _sweep(self, now):
+        if now - self._last_sweep < self.SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        for name in [name for name, deadline in self._deadlines.items() if deadline <= now]:
+            self._data.pop(name, None)
+            del self._deadlines[name]
+
+    def _entry(self, name, type_name, create=False):
+        """Returns the value of a live key of a type, None if it doesn't exist"""
+        name = self._encode(name)
+        now = time.monotonic()
+        self._sweep(now)
+        if name in self._deadlines and self._deadlines[name] <= now:
+            self._data.pop(name, None)
+            del self._deadlines[name]
+        entry = self._data.get(name)
+        if entry is None:
+            if not create:
+                return None
+            entry = self._data[name] = (type_name, {} if type_name != 'string' else b'')
+        if entry[0] != type_name:
+            raise ValueError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return entry[1]
+
+    def _delete(self, name):
+        name = self._encode(name)
+        self._deadlines.pop(name, None)
+        return self._data.pop(name, None) is not None
+
+    def _clean_empty(self, name, container):
+        # like Redis, hashes and sorted sets are deleted with their last member
+        if not container:
+            self._delete(name)
+
+    # keys
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(self._delete(name) for name in names if self.exists(name))
+
+    def exists(self, *names):
+        with self._lock:
+            return sum(self._encode(name) in self._data and self.ttl(name) != -2 for name in names)
+
+    def expire(self, name, time_seconds):
+        with self._lock:
+            if not self.exists(name):
+                return False
+            self._deadlines[self._encode(name)] = time.monotonic() + time_seconds
+            return True
+
+    def ttl(self, name):
+        with self._lock:
+            name = self._encode(name)
+            if name not in self._data:
+                return -2
+            if name not in self._deadlines:
+                return -1
+            remaining = self._deadlines[name] - time.monotonic()
+            if remaining <= 0:
+                self._delete(name)
+                return -2
+            return int(round(remaining))
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+            self._deadlines.clear()
+            return True
+
+    # strings
+
+    def get(self, name):
+        with self._lock:
+            return self._entry(name, 'string')
+
+    def set(self, name, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self.exists(name):
+                return None
+            self._delete(name)
+            self._data[self._encode(name)] = ('string', self._encode(value))
+            if ex is not None:
+                self.expire(name, ex)
+            return True
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            value = int(self._entry(name, 'string') or 0) + amount
+            self._data[self._encode(name)] = ('string', self._encode(value))
+            return value
+
+    # hashes
+
+    def hget(self, name, key):
+        with self._lock:
+            return (self._entry(name, 'hash') or {}).get(self._encode(key))
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._entry(name, 'hash') or {})
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self._lock:
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            fields = self._entry(name, 'hash', create=True)
+            added = 0
+            for field, field_value in items.items():
+                field = self._encode(field)
+                added += field not in fields
+                fields[field] = self._encode(field_value)
+            return added
+
+    def hincrby(self, name, key, amount=1):
+        with self._lock:
+            fields = self._entry(name, 'hash', create=True)
+            value = int(fields.get(self._encode(key), 0)) + amount
+            fields[self._encode(key)] = self._encode(value)
+            return value
+
+    def hdel(self, name, *keys):
+        with self._lock:
+            fields = self._entry(name, 'hash')
+            if fields is None:
+                return 0
+            deleted = sum(fields.pop(self._encode(key), None) is not None for key in keys)
+            self._clean_empty(name, fields)
+            return deleted
+
+    # sorted sets
+
+    def zadd(self, name, mapping, nx=False, xx=False):
+        with self._lock:
+            members = self._entry(name, 'zset', create=not xx)
+            if members is None:
+                return 0
+            added = 0
+            for member, score in mapping.items():
+                member = self._encode(member)
+                exists = member in members
+                if (nx and exists) or (xx and not exists):
+                    continue
+                added += not exists
+                members[member] = float(score)
+            self._clean_empty(name, members)
+            return added
+
+    def zscore(self, name, value):
+        with self._lock:
+            return (self._entry(name, 'zset') or {}).get(self._encode(value))
+
+    def zcard(self, name):
+        with self._lock:
+            return len(self._entry(name, 'zset') or {})
+
+    def zrem(self, name, *values):
+        with self._lock:
+            members = self._entry(name, 'zset')
+            if members is None:
+                return 0
+            removed = sum(members.pop(self._encode(value), None) is not None for value in values)
+            self._clean_empty(name, members)
+            return removed
+
+    def _ordered(self, members):
+        return sorted(members.items(), key=lambda item: (item[1], item[0]))
+
+    def zrange(self, name, start, end, withscores=False):
+        with self._lock:
+            ordered = self._ordered(self._entry(name, 'zset') or {})
+            end = len(ordered) if end == -1 else end + 1
+            selected = ordered[start:end]
+            return selected if withscores else [member for member, _ in selected]
+
+    def zpopmin(self, name, count=None):
+        with self._lock:
+            members = self._entry(name, 'zset')
+            if members is None:
+                return []
+            popped = self._ordered(members)[:count or 1]
+            for member, _ in popped:
+                del members[member]
+            self._clean_empty(name, members)
+            return popped
+
+    def pipeline(self, transaction=True):
+        return InProcessPipeline(self)
+
+
+class InProcessPipeline:
+    """A pipeline of an InProcessRedis, executed atomically (like a MULTI/EXEC transaction)"""
+    def __init__(self, store):
+        self._store = store
+        self._commands = []
+
+    def __getattr__(self, command):
+        method = getattr(self._store, command)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self._store._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._commands = []
+
+
+def connect(url):
+    """Connects to a key-value store
+
+    Args:
+        url (str): a `memory://` url for a new in-process stand-in, or the url of a Redis server
+
+    Raises:
+        RuntimeError: a Redis server url was given, but the `redis` package isn't installed
+
+    Returns:
+        InProcessRedis or redis.Redis: the store's client
+    """
+    if url.startswith(MEMORY_URL_SCHEME):
+        return InProcessRedis()
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("The redis package is required for a Redis session backend")
+    return redis.Redis.from_url(url)
+
+
+def init_kv_store(app):
+    """Connects an app to the key-value store at it's REDIS_URL config
+
+    Returns:
+        the store's client, also kept in the app's extensions
+    """
+    store = connect(app.config['REDIS_URL'])
+    app.extensions[EXTENSION_NAME] = store
+    return store
+
+
+def kv_store():
+    """Returns the key-value store of the app in context, None if the app doesn't use one"""
+    return current_app.extensions.get(EXTENSION_NAME)
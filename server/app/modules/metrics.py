@@ -0,0 +1,138 @@
+"""Request-level performance metrics in the Prometheus text format
+
+Records per-route request latencies, the SQL statements executed by each
+request, session cache hits, misses, evictions and write conflicts, created
+sessions and session garbage collector runs, and exposes them at a `/metrics` endpoint.
+
+Note:
+    When served by several worker processes (e.g. gunicorn), the environment
+    variable PROMETHEUS_MULTIPROC_DIR must point to an empty directory shared
+    by the workers before they start (see gunicorn.conf.py). Every worker then
+    writes it's metrics there, and `/metrics` aggregates all workers.
+"""
+
+from flask import g, has_request_context, request, Response
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import os
+import time
+
+METRICS_URL = "/metrics"    # the url of the metrics endpoint
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"  # environment variable of the shared metrics dir
+UNKNOWN_ENDPOINT = "unknown"    # the endpoint label of requests which matched no route
+SQL_COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)    # buckets of SQL statements per request
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Latency of HTTP requests',
+    ['endpoint', 'method', 'status']
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    'http_request_sql_statements', 'Number of SQL statements executed by HTTP requests',
+    ['endpoint'], buckets=SQL_COUNT_BUCKETS
+)
+REQUEST_SQL_TIME = Histogram(
+    'http_request_sql_duration_seconds', 'Time HTTP requests spent executing SQL statements',
+    ['endpoint']
+)
+CACHE_EVENTS = Counter(
+    'session_cache_events', 'Session cache hits, misses, evictions and write conflicts',
+    ['cache_type', 'cache', 'event']
+)
+SESSIONS_CREATED = Counter(
+    'sessions_created', 'Sessions created for requests without a valid session, or renewed after expiring',
+    ['reason']
+)
+GC_RUNS = Counter('session_gc_runs', 'Session garbage collector scans')
+GC_COLLECTED = Counter('session_gc_collected_sessions', 'Sessions removed by the session garbage collector')
+GC_DURATION = Histogram('session_gc_duration_seconds', 'Duration of session garbage collector scans')
+
+
+def record_cache_event(cache, event_name):
+    """Counts an event of a session cache
+
+    Args:
+        cache (LRUSessionCache): the cache in which the event occurred
+        event_name (str): the event - 'hit', 'miss', 'evict' or 'conflict'
+    """
+    CACHE_EVENTS.labels(type(cache).__name__, cache.cache_name, event_name).inc()
+
+
+def record_session_created(reason):
+    """Counts a created session
+
+    A high rate of new sessions which isn't matched by new visitors hints at
+    sessions which are lost, e.g. workers which sign cookies with different keys.
+
+    Args:
+        reason (str): 'new' for a request without a (valid) session, or
+            'renewed' for a session whose server-side state expired
+    """
+    SESSIONS_CREATED.labels(reason).inc()
+
+
+def record_gc_run(duration, collected):
+    """Records a single scan of a session garbage collector
+
+    Args:
+        duration (float): the duration of the scan in seconds
+        collected (int): the number of sessions removed in the scan
+    """
+    GC_RUNS.inc()
+    GC_COLLECTED.inc(collected)
+    GC_DURATION.observe(duration)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.metrics_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metrics_sql_count' in g:
+        g.metrics_sql_count += 1
+        g.metrics_sql_time += time.perf_counter() - context.metrics_query_start
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_sql_count = 0
+    g.metrics_sql_time = 0.0
+
+
+def _finish_request(response):
+    if 'metrics_start' not in g:
+        return response
+    endpoint = request.endpoint or UNKNOWN_ENDPOINT
+    REQUEST_LATENCY.labels(endpoint, request.method, response.status_code).observe(time.perf_counter() - g.metrics_start)
+    REQUEST_SQL_STATEMENTS.labels(endpoint).observe(g.metrics_sql_count)
+    REQUEST_SQL_TIME.labels(endpoint).observe(g.metrics_sql_time)
+    return response
+
+
+def metrics_registry():
+    """Returns the registry to expose, aggregating all worker processes in multiprocess mode"""
+    if MULTIPROC_DIR_ENV not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_view():
+    """Returns the collected metrics in the Prometheus text format"""
+    return Response(generate_latest(metrics_registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    """Instruments an app's requests and database engines, and adds the metrics endpoint
+
+    Args:
+        app (Flask): the app to instrument
+    """
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule(METRICS_URL, 'metrics', metrics_view)
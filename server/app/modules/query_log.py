@@ -0,0 +1,142 @@
+"""Slow SQL statement and repeated statement (N+1) logging
+
+Logs statements which take longer than a threshold, and requests which
+execute the same (normalized) statement more times than a limit, along with
+the Flask endpoint and the app code which issued the statement. Entries are
+written as JSON lines to a rotating log file of the worker process - rotation
+isn't safe across processes, so every process writes (and rotates) a file of
+it's own, named after the configured file and the process id.
+
+The following app configuration values are used:
+    SLOW_QUERY_LOG (bool): enables the log.
+    SLOW_QUERY_LOG_FILE (str): the path of the log file, before the process id is added.
+    SLOW_QUERY_THRESHOLD (float): statements slower than this (in seconds) are logged.
+    REPEATED_QUERY_LIMIT (int): requests which execute a statement more times are logged.
+    SLOW_QUERY_LOG_MAX_BYTES (int): the size at which the log file is rotated.
+    SLOW_QUERY_LOG_BACKUPS (int): the number of rotated log files kept.
+"""
+
+from flask import g, has_request_context, request
+from logging.handlers import RotatingFileHandler
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import json
+import logging
+import os
+import re
+import time
+import traceback
+
+LOGGER_NAME = "genetwork.query_log"
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))   # the app package directory
+_IN_LIST = re.compile(r'\(\s*(\?|%\(\w+\)s|:\w+)(\s*,\s*(\?|%\(\w+\)s|:\w+))+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+logger = logging.getLogger(LOGGER_NAME)
+
+
+def normalize_statement(statement):
+    """Normalizes an SQL statement, so statements which differ only by parameters are equal
+
+    Args:
+        statement (str): the statement (with parameter placeholders) sent to the database
+
+    Returns:
+        str: the statement with collapsed whitespace and parameter lists
+    """
+    statement = _WHITESPACE.sub(' ', statement).strip()
+    return _IN_LIST.sub('(...)', statement)
+
+
+def call_site():
+    """Finds the innermost app code (outside of this module) on the call stack
+
+    Returns:
+        str: the `file:line in function` of the app code, None if missing
+    """
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(APP_DIR) and filename != os.path.abspath(__file__):
+            return f'{os.path.relpath(filename, APP_DIR)}:{frame.lineno} in {frame.name}'
+    return None
+
+
+class QueryLog:
+    """Logs slow and repeated SQL statements of an app's requests
+
+    Attributes:
+        threshold (float): statements slower than this (in seconds) are logged.
+        repeat_limit (int): statements executed more times by a request are logged.
+    """
+    def __init__(self, threshold, repeat_limit):
+        self.threshold = threshold
+        self.repeat_limit = repeat_limit
+
+    def _log(self, kind, **fields):
+        entry = {'time': time.time(), 'kind': kind}
+        if has_request_context():
+            entry['endpoint'] = request.endpoint
+            entry['method'] = request.method
+            entry['path'] = request.path
+        entry.update(fields)
+        logger.info(json.dumps(entry))
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context.query_log_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context.query_log_start
+        if duration > self.threshold:
+            self._log('slow_statement', statement=statement, duration=duration, call_site=call_site())
+
+        if not has_request_context():
+            return
+        counts = g.setdefault('query_log_counts', {})
+        normalized = normalize_statement(statement)
+        counts[normalized] = counts.get(normalized, 0) + 1
+        if counts[normalized] == self.repeat_limit + 1:
+            # the call site of the first execution over the limit is kept
+            g.setdefault('query_log_repeats', {})[normalized] = call_site()
+
+    def finish_request(self, exception=None):
+        """Logs the statements the request repeated over the limit"""
+        counts = g.pop('query_log_counts', {})
+        for statement, site in g.pop('query_log_repeats', {}).items():
+            self._log('repeated_statement', statement=statement, count=counts[statement], call_site=site)
+
+    def attach(self, app):
+        """Listens to the statements of all engines and the teardown of the app's requests"""
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+        app.teardown_request(self.finish_request)
+
+
+def worker_log_file(log_file):
+    """Returns the log file of the current process, e.g. slow_queries.1234.log for slow_queries.log"""
+    root, extension = os.path.splitext(log_file)
+    return f'{root}.{os.getpid()}{extension}'
+
+
+def init_query_log(app):
+    """Enables the slow and repeated statement log on an app, if configured
+
+    Args:
+        app (Flask): the app whose statements are logged
+    """
+    if not app.config.get('SLOW_QUERY_LOG'):
+        return
+
+    if not logger.handlers:
+        log_file = worker_log_file(app.config['SLOW_QUERY_LOG_FILE'])
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        handler = RotatingFileHandler(
+            log_file,
+            maxBytes=app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+            backupCount=app.config['SLOW_QUERY_LOG_BACKUPS']
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    QueryLog(app.config['SLOW_QUERY_THRESHOLD'], app.config['REPEATED_QUERY_LIMIT']).attach(app)
@@ -0,0 +1,105 @@
+"""Process-local read-through caching for rarely changing database rows
+
+The cache is shared by all requests handled by a worker process (unlike the
+per-session caches of the user_cache module), and is invalidated as a whole
+whenever a generation counter (usually stored in the database) changes.
+"""
+
+from collections import OrderedDict
+from threading import RLock
+import time
+
+
+class GenerationalCache:
+    """A size-bounded, thread-safe LRU read-through cache invalidated by generations
+
+    Attributes:
+        loader (callable): loads missing entries. Receives a list of keys
+            and returns a dict which maps the found keys to their values.
+            Keys missing from the returned dict are treated as nonexistent.
+        generation_getter (callable): returns the current generation of the
+            cached data. Whenever the generation changes, the cache is cleared.
+        max_size (int): the maximal number of entries held by the cache.
+        check_interval (float): the minimal time in seconds between generation checks.
+            If 0, the generation is checked on every access.
+    """
+    def __init__(self, loader, generation_getter, max_size, check_interval=0):
+        self.loader = loader
+        self.generation_getter = generation_getter
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        self._lock = RLock()
+        self._generation = None
+        self._last_check = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Drops all cached entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def _validate_generation(self):
+        now = time.monotonic()
+        if self._last_check is not None and now - self._last_check < self.check_interval:
+            return
+
+        generation = self.generation_getter()
+        with self._lock:
+            self._last_check = now
+            if generation != self._generation:
+                self.clear()
+                self._generation = generation
+
+    def _insert(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get_many(self, keys):
+        """Fetches several entries, loading all missing entries at once
+
+        Args:
+            keys (iterable): the keys of the requested entries
+
+        Returns:
+            dict: maps the requested keys which exist to their values
+        """
+        self._validate_generation()
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+                else:
+                    missing.append(key)
+
+        if missing:
+            loaded = self.loader(missing)
+            with self._lock:
+                for key, value in loaded.items():
+                    self._insert(key, value)
+            found.update(loaded)
+        return found
+
+    def get(self, key, default=None):
+        """Fetches a single entry, loading it on a miss
+
+        Args:
+            key: the key of the requested entry
+            default (optional): returned if the entry doesn't exist. Defaults to None.
+        """
+        return self.get_many([key]).get(key, default)
+
+    def warm(self, keys):
+        """Loads entries ahead of time
+
+        Args:
+            keys (iterable): the keys to load. At most max_size keys are kept.
+        """
+        self.get_many(keys)
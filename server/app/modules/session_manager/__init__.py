@@ -4,9 +4,13 @@
 """
 
 from .events import SessionHandler
+from .session_id_type import SessionIdType
 from .garbage_collector import SessionGarbageCollector
+from .key_expiry import SessionKeyExpiry
+from .server_side import ServerSideSessionInterface
 
-def create_sessions(app, clean_interval=None, session_duration=None):
+def create_sessions(app, clean_interval=None, session_duration=None, activity_bucket=None, kv_store=None,
+                    server_side=False):
     """Attaches session management to an application
 
     Note:
@@ -20,9 +24,26 @@ def create_sessions(app, clean_interval=None, session_duration=None):
         session_duration (int, optional): the maximal lifetime of an inactive session in seconds.
             Defines the time an app needs to be inactive in order for it to be garbage collected.
             If None, disables garbase collection. Defaults to None.
+        activity_bucket (int, optional): the length in seconds of the time buckets in which
+            session activity is recorded. If None, uses the garbage collector's default.
+        kv_store (optional): a Redis-compatible store (see app.modules.kv_store) in
+            which session state is kept. If given, inactive sessions expire through
+            key TTLs (SessionKeyExpiry) instead of a garbage collector, and
+            clean_interval and activity_bucket are unused. Defaults to None.
+        server_side (bool, optional): if True, flask session data is kept on the
+            server (in kv_store if given, otherwise in the SQL sessions database)
+            and the session cookie only holds the signed session id
+            (see ServerSideSessionInterface). Defaults to False.
     """
     SessionHandler.attach_app(app)
+
+    if server_side:
+        with app.app_context():
+            app.session_interface = ServerSideSessionInterface(app, kv_store)
     
-    if session_duration is not None and clean_interval is not None:
+    if kv_store is not None and session_duration is not None:
+        with app.app_context():
+            SessionKeyExpiry(kv_store, session_duration)
+    elif session_duration is not None and clean_interval is not None:
         with app.app_context():
-            SessionGarbageCollector(session_duration, clean_interval)
+            SessionGarbageCollector(session_duration, clean_interval, activity_bucket)
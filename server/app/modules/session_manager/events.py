@@ -1,6 +1,7 @@
 from uuid import uuid4
 from flask import session, current_app
 from enum import Enum
+from ..metrics import record_session_created
 
 class SessionEvent(Enum):
     """Enum which specifies session event types.
@@ -11,6 +12,7 @@ class SessionEvent(Enum):
     CREATE = "create_handler"   # first connection by user (no session set)
     CONNECT = "connect_handler" # a session connected (made a request form the server)
     DELETE = "delete_handler"   # a session should be deleted (triggered by garbage collector)
+    STORE = "store_handler"     # state of a session was stored on the server (e.g. it's villain)
     
 class SessionHandler:
     """Session event handlers.
@@ -65,9 +67,25 @@ class SessionHandler:
         if SessionHandler.SESSION_ID_FIELD not in session:
             new_ssid = str(uuid4())
             session[SessionHandler.SESSION_ID_FIELD] = new_ssid
+            record_session_created('new')
             return True
         return False
     
+    @staticmethod
+    def renew_session():
+        """Replaces the id of the current session with a new one
+
+        Used when the server-side state of a session was deleted, so state which
+        is derived from the old session id (e.g. the session's villain) doesn't return.
+
+        Returns:
+            str: the new session id
+        """
+        new_ssid = str(uuid4())
+        session[SessionHandler.SESSION_ID_FIELD] = new_ssid
+        record_session_created('renewed')
+        return new_ssid
+    
     @staticmethod
     def trigger_event(session_event, ssid):
         """Triggers a session event
@@ -95,6 +113,20 @@ class SessionHandler:
         self.delete_handler = func
         return func
     
+    def on_session_store(self, func):
+        """Decorator which sets a function as the store event handler"""
+        self.store_handler = func
+        return func
+    
+    @staticmethod
+    def state_stored(ssid):
+        """Triggers the store event of a session, called when state of the session is stored on the server
+
+        Args:
+            ssid (str): the id of the session whose state was stored
+        """
+        SessionHandler.trigger_event(SessionEvent.STORE, ssid)
+    
     def _handle_event(self, session_event, ssid):
         handler_name = session_event.value
         if hasattr(self, handler_name):
@@ -1,7 +1,8 @@
 from .events import SessionEvent, SessionHandler
-from sqlalchemy.sql import func
-from flask import copy_current_request_context
-from datetime import datetime, timezone, timedelta
+from .session_id_type import SessionIdType
+from ..db_pool import bind_table_args
+from ..metrics import record_gc_run
+from flask import copy_current_request_context, current_app, session
 from threading import Thread
 import os.path
 import time
@@ -10,21 +11,40 @@ import time
 class SessionGarbageCollector(SessionHandler):
     """Garbage collector for inactive sessions
 
+    Session activity is recorded in coarse time buckets - each session's row
+    holds the bucket of it's last connection, and is only updated when a
+    connection falls in a later bucket. Expired sessions are the sessions of
+    whole buckets which ended more than session_duration ago, found through an
+    index on the bucket, so a scan costs in proportion to the expired sessions
+    rather than to all sessions.
+
+    Sessions are recorded lazily - a new session is only marked as unrecorded
+    (in the flask session), and it's row is inserted on it's second request or
+    when state of it is first stored on the server (see SessionHandler.state_stored),
+    so one-off clients which never return a cookie add no rows. The mark holds
+    the session's creation bucket, and is ignored once that bucket expired, since
+    the cookie which carries it may be replayed after the session was collected.
 
     Attributes:
-        session_duration (int): the time in seconds between session
-            garbage collector scans.
-        clean_interval (int): the maximal lifetime of an inactive session in seconds.
+        session_duration (int): the maximal lifetime of an inactive session in seconds.
             Defines the time an app needs to be inactive in order for it to be garbage collected.
+        clean_interval (int): the time in seconds between session
+            garbage collector scans.
+        activity_bucket (int): the length in seconds of the activity time buckets.
+            Sessions are collected up to a bucket later than their lifetime ends.
     """
     _next_gc_id = 0
     DB_BIND = "active_sessions" # the flask-sqlalchemy bind for the garbage collector db
     TABLE_TEMPLATE = "GC_{}"    # a string format for the table name for a garbage collector
     DB_NAME = "active_sessions" # the database table name for the garbage collector
+    DEFAULT_ACTIVITY_BUCKET = 60    # the default length in seconds of activity time buckets
+    LOOKUP_BATCH_SIZE = 500     # the maximal number of session ids in a single IN lookup
+    UNRECORDED_FIELD = "GcUnrecorded"   # the flask session field holding the creation bucket of a session with no row yet
     
-    def __init__(self, session_duration, clean_interval):
-        self.session_duration = timedelta(seconds=session_duration)
+    def __init__(self, session_duration, clean_interval, activity_bucket=None):
+        self.session_duration = session_duration
         self.clean_interval = clean_interval
+        self.activity_bucket = activity_bucket or self.DEFAULT_ACTIVITY_BUCKET
         self._gc_id = SessionGarbageCollector._next_gc_id 
         SessionGarbageCollector._next_gc_id += 1
         
@@ -36,11 +56,13 @@ class SessionGarbageCollector(SessionHandler):
         self._make_db()
         
         # deactivates changing the event handlers
-        self.on_session_create = self.on_session_connect = self.on_session_delete = lambda func: func
+        self.on_session_create = self.on_session_connect = self.on_session_delete = \
+            self.on_session_store = lambda func: func
         
         # sets the event handlers to the bound functions
         setattr(self, SessionEvent.CREATE.value, self._add_session)
         setattr(self, SessionEvent.CONNECT.value, self._update_session)
+        setattr(self, SessionEvent.STORE.value, self._record_stored_session)
         
         self.started = False
     
@@ -48,11 +70,13 @@ class SessionGarbageCollector(SessionHandler):
         class SessionId(self.app.db.Model):
             __bind_key__ = self.DB_BIND
             __tablename__ = self.TABLE_TEMPLATE.format(self._gc_id)
-            ssid = self.app.db.Column(self.app.db.String(SessionHandler.UUID_LEN), primary_key=True)
-            last_connection = self.app.db.Column(self.app.db.DateTime)
+            __table_args__ = bind_table_args(self.app, self.DB_BIND, hash_partition_column='ssid')
+            ssid = self.app.db.Column(SessionIdType(), primary_key=True)
+            # the time bucket of the last connection (see current_bucket)
+            activity_bucket = self.app.db.Column(self.app.db.Integer, index=True)
             
             def __repr__(self) -> str:
-                return f"SSID: {self.ssid} (last {self.last_connection})"
+                return f"SSID: {self.ssid} (last bucket {self.activity_bucket})"
         
         self.SessionTable = SessionId
         new_bind = {self.DB_BIND: self.db_uri}
@@ -63,6 +87,26 @@ class SessionGarbageCollector(SessionHandler):
         self.app.config['SQLALCHEMY_BINDS'].update(new_bind) 
         
     
+    @staticmethod
+    def app_collectors():
+        """Returns the garbage collectors of the app in context"""
+        return [client for client in SessionHandler._clients
+                if isinstance(client, SessionGarbageCollector) and client.app == current_app]
+
+    def current_bucket(self):
+        """int: the activity time bucket of the current time"""
+        return int(time.time() // self.activity_bucket)
+
+    def expiry_threshold(self):
+        """int: the oldest activity bucket which didn't expire"""
+        # a bucket expires once it's end is older than the session duration
+        return int((time.time() - self.session_duration) // self.activity_bucket)
+
+    def _is_unrecorded(self):
+        """Checks if the current session is marked unrecorded, by a mark which didn't expire"""
+        created_bucket = session.get(self.UNRECORDED_FIELD)
+        return isinstance(created_bucket, int) and created_bucket >= self.expiry_threshold()
+
     def start(self):
         """Starts the garbage collection thread"""
         self.started = True
@@ -74,11 +118,17 @@ class SessionGarbageCollector(SessionHandler):
     def _add_session(self, ssid):
         if not self.started:
             self.start()
+        # the row is inserted once the session returns or stores state (see _record_session)
+        session[self.UNRECORDED_FIELD] = self.current_bucket()
+
+    def _record_session(self, ssid):
+        """Inserts the row of an unrecorded session"""
+        session.pop(self.UNRECORDED_FIELD, None)
         try:
             self.app.db.session.add(
                 self.SessionTable(
                     ssid=ssid,
-                    last_connection=func.now()
+                    activity_bucket=self.current_bucket()
                 )
             )
             self.app.db.session.commit()
@@ -87,18 +137,35 @@ class SessionGarbageCollector(SessionHandler):
             print(f'GC: Exception on add {ssid}:', e)
             self.app.db.session.rollback()
                 
+    def _record_stored_session(self, ssid):
+        if self._is_unrecorded() and ssid == SessionHandler.get_ssid():
+            self._record_session(ssid)
+
     def _update_session(self, ssid):
         connection_row = self.SessionTable.query.filter_by(ssid=ssid).first()
         if connection_row is None:
+            if self._is_unrecorded():
+                self._record_session(ssid)     # the session's second request
+                return
             """
                 if the session is actually an old session which was removed,
-                it needs to be recreated
+                it needs to be recreated. It gets a new id, since state derived
+                from the old id was removed with it. A session is only collected
+                after it's creation bucket expired, so a replayed cookie of
+                it's first response is renewed too.
             """
-            SessionHandler.trigger_event(SessionEvent.CREATE, ssid)
+            SessionHandler.trigger_event(SessionEvent.CREATE, SessionHandler.renew_session())
             return
+        if self.UNRECORDED_FIELD in session:
+            # a concurrent request recorded the session, but this request's cookie predates it
+            session.pop(self.UNRECORDED_FIELD)
+
+        bucket = self.current_bucket()
+        if connection_row.activity_bucket == bucket:
+            return  # the activity was already recorded in this bucket
 
         try:
-            connection_row.last_connection=func.now()
+            connection_row.activity_bucket = bucket
             self.app.db.session.commit()
         except Exception as e:
             # If race occurred, another thread updated the time at the same time
@@ -112,18 +179,43 @@ class SessionGarbageCollector(SessionHandler):
             time.sleep(collector.clean_interval)
             collector._collect_garbage()
     
+    def expired_buckets(self):
+        """Returns the activity buckets whose sessions expired, from the oldest"""
+        buckets = self.app.db.session.query(self.SessionTable.activity_bucket).filter(
+            self.SessionTable.activity_bucket < self.expiry_threshold()
+        ).distinct().order_by(self.SessionTable.activity_bucket).all()
+        return [bucket for bucket, in buckets]
+
+    def _collect_bucket(self, bucket):
+        """Removes the sessions of an expired activity bucket
+
+        Returns:
+            list: the ids of the removed sessions
+        """
+        table = self.SessionTable
+        ssids = [ssid for ssid, in self.app.db.session.query(table.ssid).filter(table.activity_bucket == bucket)]
+        table.query.filter(table.activity_bucket == bucket).delete(synchronize_session=False)
+        self.app.db.session.commit()
+
+        # sessions which connected since they were listed moved to a later bucket and remain
+        remaining = set()
+        for start in range(0, len(ssids), self.LOOKUP_BATCH_SIZE):
+            batch = ssids[start:start + self.LOOKUP_BATCH_SIZE]
+            remaining.update(ssid for ssid, in self.app.db.session.query(table.ssid).filter(table.ssid.in_(batch)))
+        return [ssid for ssid in ssids if ssid not in remaining]
+
     def _collect_garbage(self):
-        age_threshold = datetime.now(timezone.utc) - self.session_duration
-        remove_targets = self.SessionTable.query.filter(
-                    self.SessionTable.last_connection < age_threshold
-                ).all()      
-        for session in remove_targets:
+        started = time.perf_counter()
+        collected = 0
+        for bucket in self.expired_buckets():
             try:
-                self.app.db.session.delete(session)
-                self.app.db.session.commit()
+                removed = self._collect_bucket(bucket)
             except Exception as e:
                 # handle race condition by trying to collect next time
                 print(f'GC: Exception on delete:', e)
                 self.app.db.session.rollback()
-            else:
-                SessionHandler.trigger_event(SessionEvent.DELETE, session.ssid)
+                continue
+            for ssid in removed:
+                SessionHandler.trigger_event(SessionEvent.DELETE, ssid)
+            collected += len(removed)
+        record_gc_run(time.perf_counter() - started, collected)
@@ -0,0 +1,84 @@
+from .events import SessionEvent, SessionHandler
+from flask import current_app
+
+
+class SessionKeyExpiry(SessionHandler):
+    """Expires inactive sessions through the TTLs of their keys in a Redis-compatible store
+
+    Replaces the session garbage collector when session state is kept in a
+    key-value store. Every session has a marker key, and every component which
+    keeps session state in the store registers the keys of a session (see
+    register_session_keys). All of a session's keys expire session_duration
+    seconds after it's last request, so no scans are needed and no delete
+    events are triggered - the store drops the expired state itself.
+
+    Attributes:
+        store: the client of the key-value store (see app.modules.kv_store).
+        session_duration (int): the maximal lifetime of an inactive session in seconds.
+    """
+    SESSION_KEY_TEMPLATE = "genetwork:session:{}"   # the marker key of a session, by ssid
+    _session_key_getters = []
+
+    def __init__(self, store, session_duration):
+        self.store = store
+        self.session_duration = session_duration
+
+        # call super for app register
+        super().__init__()
+
+        # deactivates changing the event handlers
+        self.on_session_create = self.on_session_connect = self.on_session_delete = lambda func: func
+
+        # sets the event handlers to the bound functions
+        setattr(self, SessionEvent.CREATE.value, self._add_session)
+        setattr(self, SessionEvent.CONNECT.value, self._refresh_session)
+
+    @staticmethod
+    def register_session_keys(key_getter):
+        """Registers the keys of session state kept in a key-value store, so they expire with the session
+
+        Args:
+            key_getter (callable): receives a session id and returns a list of
+                the keys in which state of the session may be kept
+        """
+        SessionKeyExpiry._session_key_getters.append(key_getter)
+
+    @staticmethod
+    def app_expiry():
+        """Returns the session key expiry of the app in context, None if it has none"""
+        for client in SessionHandler._clients:
+            if isinstance(client, SessionKeyExpiry) and client.app == current_app:
+                return client
+        return None
+
+    @staticmethod
+    def expire_with_session(pipeline, *keys):
+        """Queues the expiry of keys of the current session on a pipeline, if sessions expire
+
+        Keys which are created after the session's last request must be given
+        their TTL, since they were missing when the session was refreshed.
+        """
+        expiry = SessionKeyExpiry.app_expiry()
+        if expiry is not None:
+            for key in keys:
+                pipeline.expire(key, expiry.session_duration)
+
+    def session_keys(self, ssid):
+        """Returns all registered keys of a session"""
+        return [key for key_getter in self._session_key_getters for key in key_getter(ssid)]
+
+    def _add_session(self, ssid):
+        self.store.set(self.SESSION_KEY_TEMPLATE.format(ssid), 1, ex=self.session_duration)
+
+    def _refresh_session(self, ssid):
+        pipeline = self.store.pipeline()
+        pipeline.expire(self.SESSION_KEY_TEMPLATE.format(ssid), self.session_duration)
+        for key in self.session_keys(ssid):
+            pipeline.expire(key, self.session_duration)
+        is_active = pipeline.execute()[0]
+        if not is_active:
+            """
+                the session expired, and it's state expired with it. It's
+                recreated with a new id, like a garbage collected session.
+            """
+            SessionHandler.trigger_event(SessionEvent.CREATE, SessionHandler.renew_session())
@@ -0,0 +1,303 @@
+"""
+    Server-side flask sessions - session data is kept in a store on the server,
+    and the session cookie only holds the signed session id.
+"""
+
+from .events import SessionHandler
+from .key_expiry import SessionKeyExpiry
+from .session_id_type import SessionIdType
+from ..db_pool import bind_table_args
+from flask import has_app_context
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from itsdangerous import BadSignature, Signer
+from sqlalchemy.exc import IntegrityError
+from uuid import uuid4
+import json
+import os.path
+
+
+def flatten_session(data, whole_fields=()):
+    """Flattens session data to fields, which are saved independently of each other
+
+    Every top level value is a field, and so is every item of a top level dict
+    (e.g. every entry of a session cache), so concurrent requests which change
+    different items of the same dict don't overwrite each other's changes.
+
+    Args:
+        data (dict): the session data
+        whole_fields (collection, optional): top level dicts which are a single
+            field, since their items can't be merged with concurrent changes.
+
+    Returns:
+        dict: maps field names to their serialized values
+    """
+    fields = {}
+    for key, value in data.items():
+        if isinstance(value, dict) and key not in whole_fields:
+            fields[json.dumps([key])] = session_json_serializer.dumps({})
+            for item_key, item_value in value.items():
+                fields[json.dumps([key, item_key])] = session_json_serializer.dumps(item_value)
+        else:
+            fields[json.dumps([key])] = session_json_serializer.dumps(value)
+    return fields
+
+
+def unflatten_session(fields):
+    """Rebuilds session data from it's fields (see flatten_session)"""
+    data = {}
+    items = []
+    for field, value in fields.items():
+        path = json.loads(field)
+        if len(path) == 1:
+            data[path[0]] = session_json_serializer.loads(value)
+        else:
+            items.append((path, value))
+    for (key, item_key), value in items:
+        data.setdefault(key, {})[item_key] = session_json_serializer.loads(value)
+    return data
+
+
+class ServerSideSession(SessionMixin):
+    """A flask session whose data is loaded from the session store on it's first access
+
+    Attributes:
+        sid (str): the store key of the session's data, None for a new session.
+        loaded (bool): whether the session's data was loaded.
+        whole_fields (collection): the top level dicts which are saved as a
+            single field (see flatten_session).
+    """
+    def __init__(self, sid, load, whole_fields=()):
+        self.sid = sid
+        self.new = sid is None
+        self.loaded = False
+        self.whole_fields = whole_fields
+        self._load = load
+        self._data = None
+        self._loaded_fields = None
+
+    @property
+    def data(self):
+        """dict: the session's data, loaded on the first access"""
+        if not self.loaded:
+            self._loaded_fields = self._load(self.sid) if self.sid is not None else {}
+            self._data = unflatten_session(self._loaded_fields)
+            self.loaded = self.accessed = True
+        return self._data
+
+    def changes(self):
+        """Compares the session's data with the data it loaded
+
+        Returns:
+            tuple: a dict which maps the changed (or new) fields to their
+                serialized values, and a list of the removed fields
+        """
+        fields = flatten_session(self.data, self.whole_fields)
+        changed = {field: value for field, value in fields.items() if self._loaded_fields.get(field) != value}
+        removed = [field for field in self._loaded_fields if field not in fields]
+        return changed, removed
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class SqlSessionStore:
+    """Keeps the fields of server-side sessions in an SQL table, a row per field
+
+    Attributes:
+        SessionField (db.Model): the flask-sqlalchemy table of the session fields.
+    """
+    BIND_NAME = "sql_sessions"  # the flask-sqlalchemy bind of the session fields
+    DB_NAME = "sql_sessions"    # the name of the bind's database
+    TABLE_NAME = "server_sessions"
+    SAVE_ATTEMPTS = 3   # attempts of a save which conflicts with concurrent saves of the same fields
+
+    def __init__(self, app):
+        self.db = app.db
+
+        class SessionField(app.db.Model):
+            __bind_key__ = self.BIND_NAME
+            __tablename__ = self.TABLE_NAME
+            __table_args__ = bind_table_args(app, self.BIND_NAME, hash_partition_column='ssid')
+            ssid = app.db.Column(SessionIdType(), primary_key=True)
+            field = app.db.Column(app.db.Text, primary_key=True)
+            value = app.db.Column(app.db.Text, nullable=False)
+
+        self.SessionField = SessionField
+
+        db_prefix = os.path.dirname(app.config['SQLALCHEMY_DATABASE_URI'])
+        if app.config['SQLALCHEMY_BINDS'] is None:
+            app.config['SQLALCHEMY_BINDS'] = {}
+        app.config['SQLALCHEMY_BINDS'].setdefault(self.BIND_NAME, os.path.join(db_prefix, self.DB_NAME))
+
+    def load(self, ssid):
+        rows = self.db.session.query(self.SessionField.field, self.SessionField.value).filter_by(ssid=ssid)
+        return dict(rows.all())
+
+    def save(self, ssid, changed, removed):
+        written = list(changed) + list(removed)
+        for _ in range(self.SAVE_ATTEMPTS):
+            try:
+                if written:
+                    self.SessionField.query.filter(
+                        self.SessionField.ssid == ssid, self.SessionField.field.in_(written)
+                    ).delete(synchronize_session=False)
+                self.db.session.add_all(
+                    self.SessionField(ssid=ssid, field=field, value=value) for field, value in changed.items()
+                )
+                self.db.session.commit()
+                return
+            except IntegrityError:
+                # a concurrent save inserted the same field, overwrite it
+                self.db.session.rollback()
+        print(f'ServerSideSessions: Gave up saving session {ssid}')
+
+    def delete(self, ssid):
+        self.SessionField.query.filter_by(ssid=ssid).delete()
+        self.db.session.commit()
+
+
+class KvSessionStore:
+    """Keeps the fields of server-side sessions in hashes of a Redis-compatible store
+
+    The hashes expire with their sessions (see SessionKeyExpiry).
+    """
+    KEY_TEMPLATE = "genetwork:flask_session:{}"    # the hash of a session's fields, by ssid
+
+    def __init__(self, store):
+        self.store = store
+        SessionKeyExpiry.register_session_keys(self.session_keys)
+
+    def session_keys(self, ssid):
+        return [self.KEY_TEMPLATE.format(ssid)]
+
+    def load(self, ssid):
+        fields = self.store.hgetall(self.KEY_TEMPLATE.format(ssid))
+        return {field.decode('utf-8'): value.decode('utf-8') for field, value in fields.items()}
+
+    def save(self, ssid, changed, removed):
+        key = self.KEY_TEMPLATE.format(ssid)
+        pipeline = self.store.pipeline()
+        if changed:
+            pipeline.hset(key, mapping=changed)
+        if removed:
+            pipeline.hdel(key, *removed)
+        SessionKeyExpiry.expire_with_session(pipeline, key)
+        pipeline.execute()
+
+    def delete(self, ssid):
+        self.store.delete(self.KEY_TEMPLATE.format(ssid))
+
+
+class ServerSideSessionInterface(SessionInterface, SessionHandler):
+    """A flask session interface which keeps session data on the server
+
+    The session cookie holds the signed id of the session (see SessionHandler),
+    which keys the session's data in the store, so it stays small however much
+    data the session holds. Data is only loaded when the session is accessed, and
+    only the fields which changed are saved (see flatten_session), so requests
+    which don't change the session write nothing, and concurrent requests which
+    change different cache entries keep each other's entries. The stored data
+    is deleted with the session (by the garbage collector or key expiry).
+
+    Attributes:
+        store (SqlSessionStore or KvSessionStore): the store of the session data.
+    """
+    SIGNER_SALT = "server-side-session"     # the salt of the session cookie's signature
+    _whole_fields = set()
+
+    def __init__(self, app, kv_store=None):
+        self.store = KvSessionStore(kv_store) if kv_store is not None else SqlSessionStore(app)
+
+        # call super for app register
+        SessionHandler.__init__(self)
+        self.on_session_delete(self.store.delete)
+
+    @staticmethod
+    def register_whole_field(name):
+        """Registers a top level dict of sessions which is saved as a single field
+
+        Items of the dict are not merged with the items concurrent requests
+        saved (see flatten_session), the last saved dict replaces the others.
+        Needed when the same item may be saved under different keys.
+
+        Args:
+            name (str): the session key of the dict
+        """
+        ServerSideSessionInterface._whole_fields.add(name)
+
+    def _loader(self, app):
+        def load(sid):
+            if has_app_context():
+                return self.store.load(sid)
+            # sessions may be accessed out of context, e.g. by the test client's session_transaction
+            with app.app_context():
+                return self.store.load(sid)
+        return load
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.SIGNER_SALT)
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        sid = None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('utf-8')
+            except BadSignature:
+                pass
+        return ServerSideSession(sid, self._loader(app), self._whole_fields)
+
+    def save_session(self, app, session, response):
+        if not session.loaded:
+            return  # never accessed, hence unchanged
+        response.vary.add('Cookie')
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # sessions are keyed by their ssid, so the state of a session is deleted with it
+        ssid = session.get(SessionHandler.SESSION_ID_FIELD) or session.sid or str(uuid4())
+        if ssid != session.sid:
+            # a new or renewed session, all of it's data is saved
+            SessionHandler.state_stored(ssid)
+            changed, removed = flatten_session(session, self._whole_fields), []
+        else:
+            changed, removed = session.changes()
+        if changed or removed:
+            self.store.save(ssid, changed, removed)
+
+        # the cookie only changes with the ssid, unless permanent sessions are refreshed
+        refresh = session.permanent and app.config['SESSION_REFRESH_EACH_REQUEST']
+        if ssid != session.sid or refresh:
+            response.set_cookie(
+                name,
+                self._signer(app).sign(ssid).decode('utf-8'),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
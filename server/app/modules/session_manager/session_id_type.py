@@ -0,0 +1,38 @@
+"""
+    A compact column type for session ids.
+"""
+
+from sqlalchemy.types import TypeDecorator, LargeBinary
+from sqlalchemy.dialects import postgresql
+import uuid
+
+
+class SessionIdType(TypeDecorator):
+    """Column type for session ids (uuid strings), stored in binary form
+
+    Session ids are stored as native UUIDs (16 bytes) on PostgreSQL and as
+    16 byte blobs on other databases, instead of 36 character strings, which
+    shrinks every index over them. On the python side, values remain uuid strings.
+    """
+    BYTE_LEN = 16   # the byte length of a binary uuid
+
+    impl = LargeBinary(BYTE_LEN)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+        return dialect.type_descriptor(LargeBinary(self.BYTE_LEN))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name == 'postgresql':
+            return value
+        return uuid.UUID(value).bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if dialect.name == 'postgresql' or isinstance(value, str):
+            # strings are ids stored before the migration to binary ids
+            return str(value)
+        return str(uuid.UUID(bytes=bytes(value)))
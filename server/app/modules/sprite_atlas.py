@@ -0,0 +1,140 @@
+"""Sprite atlases of the avatar part assets
+
+The part layers (`<part>/border<variation>.png` and `<part>/color<variation>.png`)
+are trimmed to their visible pixels and packed into one atlas image per layer
+kind, along with a JSON map of the region of every layer in it's atlas. This way
+clients fetch a couple of images instead of an image per layer.
+"""
+
+from PIL import Image
+import glob
+import json
+import os
+
+ATLAS_KINDS = ('border', 'color')  # layer kinds, each packed into an atlas of it's own
+ATLAS_MAX_WIDTH = 1024  # maximal width in pixels of an atlas image
+ATLAS_PADDING = 1   # transparent pixels between packed layers, avoids bleeding when drawn
+ATLAS_MAP_NAME = "atlas.json"   # the file name of the region map in the atlas directory
+
+
+def _layer_kind(layer_name):
+    for kind in ATLAS_KINDS:
+        if os.path.basename(layer_name).startswith(kind):
+            return kind
+    return None
+
+
+def _trimmed_layers(asset_dir):
+    """Loads the part layers of an asset directory, cropped to their visible pixels
+
+    Returns:
+        dict: maps layer kinds to lists of (name, image, left, top) tuples, where
+            name is the layer path relative to asset_dir (with forward slashes),
+            and (left, top) is the position of the cropped image in the layer.
+    """
+    layers = {kind: [] for kind in ATLAS_KINDS}
+    for path in sorted(glob.glob(os.path.join(asset_dir, '*', '*.png'))):
+        name = os.path.relpath(path, asset_dir).replace(os.sep, '/')
+        kind = _layer_kind(name)
+        if kind is None:
+            continue
+        with Image.open(path) as image:
+            image = image.convert('RGBA')
+        # fully transparent layers keep a single pixel, so every layer has a region
+        left, top, right, bottom = image.getchannel('A').getbbox() or (0, 0, 1, 1)
+        layers[kind].append((name, image.crop((left, top, right, bottom)), left, top))
+    return layers
+
+
+def pack(sizes, max_width=ATLAS_MAX_WIDTH, padding=ATLAS_PADDING):
+    """Packs rectangles into an atlas with shelf packing
+
+    Rectangles are placed tallest first, left to right in rows (shelves).
+
+    Args:
+        sizes (list of tuple): the (width, height) of each rectangle
+        max_width (int, optional): the maximal width of the atlas. Defaults to ATLAS_MAX_WIDTH.
+        padding (int, optional): the space between rectangles. Defaults to ATLAS_PADDING.
+
+    Returns:
+        tuple: a list of the (x, y) positions of the rectangles (ordered like sizes),
+            and the (width, height) of the atlas
+    """
+    positions = [None] * len(sizes)
+    x = y = shelf_height = atlas_width = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        width, height = sizes[i]
+        if x > 0 and x + width > max_width:
+            # open a new shelf below the current one
+            y += shelf_height + padding
+            x = shelf_height = 0
+        positions[i] = (x, y)
+        x += width + padding
+        shelf_height = max(shelf_height, height)
+        atlas_width = max(atlas_width, x - padding)
+    return positions, (max(atlas_width, 1), max(y + shelf_height, 1))
+
+
+def build_atlas(asset_dir, atlas_dir):
+    """Packs the part layers of an asset directory into atlases
+
+    Writes an image for every layer kind and the region map to atlas_dir.
+    Files are replaced atomically, so concurrent builds are safe.
+
+    Args:
+        asset_dir (str): the directory of the part asset subdirectories
+        atlas_dir (str): the directory to which the atlases are written
+
+    Returns:
+        dict: the region map. `images` maps layer kinds to atlas file names,
+            and `regions` maps layer names to their atlas kind, position in the
+            atlas (x, y), size (width, height) and position in the layer (left, top).
+    """
+    os.makedirs(atlas_dir, exist_ok=True)
+    atlas_map = {'images': {}, 'regions': {}}
+    for kind, layers in _trimmed_layers(asset_dir).items():
+        positions, atlas_size = pack([image.size for _, image, _, _ in layers])
+        atlas = Image.new('RGBA', atlas_size)
+        for (name, image, left, top), (x, y) in zip(layers, positions):
+            atlas.paste(image, (x, y))
+            atlas_map['regions'][name] = {
+                'atlas': kind,
+                'x': x,
+                'y': y,
+                'width': image.width,
+                'height': image.height,
+                'left': left,
+                'top': top
+            }
+        file_name = f'{kind}.png'
+        _replace_file(os.path.join(atlas_dir, file_name), lambda f: atlas.save(f, format='PNG', optimize=True))
+        atlas_map['images'][kind] = file_name
+
+    _replace_file(os.path.join(atlas_dir, ATLAS_MAP_NAME), lambda f: f.write(json.dumps(atlas_map, sort_keys=True).encode('utf-8')))
+    return atlas_map
+
+
+def _replace_file(path, write):
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        write(f)
+    os.replace(temp_path, path)
+
+
+def load_atlas(asset_dir, atlas_dir):
+    """Loads the region map of the atlases, building them if they are outdated
+
+    Args:
+        asset_dir (str): the directory of the part asset subdirectories
+        atlas_dir (str): the directory of the atlases
+
+    Returns:
+        dict: the region map (see build_atlas)
+    """
+    map_path = os.path.join(atlas_dir, ATLAS_MAP_NAME)
+    sources = glob.glob(os.path.join(asset_dir, '*', '*.png'))
+    newest_source = max((os.path.getmtime(path) for path in sources), default=0)
+    if os.path.isfile(map_path) and os.path.getmtime(map_path) >= newest_source:
+        with open(map_path) as f:
+            return json.load(f)
+    return build_atlas(asset_dir, atlas_dir)
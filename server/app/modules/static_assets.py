@@ -0,0 +1,154 @@
+"""Long-lived HTTP caching for static assets
+
+Assets are fingerprinted by a hash of their content, and fingerprinted urls
+are served as immutable for a year, so repeat visits don't request them at
+all. Textual assets are precompressed (gzip, and brotli when the `brotli`
+package is installed) once per content version, and the variant served is
+chosen by the request's Accept-Encoding.
+"""
+
+from flask import request, send_file, abort
+from threading import Lock
+from werkzeug.security import safe_join
+import gzip
+import hashlib
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_SECONDS_IN_YEAR = 365 * 24 * 60 * 60
+IMMUTABLE_MAX_AGE = _SECONDS_IN_YEAR    # max-age of fingerprinted asset responses
+FINGERPRINT_PARAM = "v"     # the query parameter holding the fingerprint of an asset url
+FINGERPRINT_LENGTH = 16     # the number of hex digits in fingerprints
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+"""Mime type prefixes of assets which are precompressed"""
+MIN_COMPRESS_SIZE = 256     # assets smaller than this (in bytes) aren't compressed
+
+
+def _compress_gzip(data):
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+# encodings by order of preference, mapped to their compressors
+ENCODERS = {'gzip': _compress_gzip}
+if brotli is not None:
+    ENCODERS = {'br': brotli.compress, **ENCODERS}
+
+
+class StaticAssets:
+    """Serves the files of a static directory with fingerprints and precompression
+
+    Attributes:
+        root (str): the directory of the served files.
+        url_prefix (str): the url prefix under which the files are served.
+        compressed_dir (str): the directory in which compressed variants are stored.
+    """
+    def __init__(self, root, url_prefix, compressed_dir):
+        self.root = os.path.abspath(root)
+        self.url_prefix = url_prefix
+        self.compressed_dir = compressed_dir
+        self._fingerprints = {}     # path -> (mtime, size, fingerprint)
+        self._lock = Lock()
+
+    def _file_path(self, path):
+        file_path = safe_join(self.root, path)
+        if file_path is None or not os.path.isfile(file_path):
+            abort(404)
+        return file_path
+
+    def fingerprint(self, path):
+        """Computes the content hash of an asset, cached until the file changes
+
+        Args:
+            path (str): the path of the asset relative to the root
+
+        Returns:
+            str: a hex digest of the asset's content
+        """
+        file_path = self._file_path(path)
+        stat = os.stat(file_path)
+        cached = self._fingerprints.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+
+        with open(file_path, 'rb') as f:
+            fingerprint = hashlib.sha256(f.read()).hexdigest()[:FINGERPRINT_LENGTH]
+        with self._lock:
+            self._fingerprints[path] = (stat.st_mtime, stat.st_size, fingerprint)
+        return fingerprint
+
+    def url(self, path):
+        """Makes the fingerprinted url of an asset
+
+        Args:
+            path (str): the path of the asset relative to the root
+
+        Returns:
+            str: the url of the asset, which changes whenever it's content does
+        """
+        return f'{self.url_prefix}{path}?{FINGERPRINT_PARAM}={self.fingerprint(path)}'
+
+    def _compressed_variant(self, path, fingerprint, encoding):
+        """Returns the path of a compressed variant of an asset, creating it if needed"""
+        variant_path = os.path.join(self.compressed_dir, f'{fingerprint}.{encoding}')
+        if not os.path.isfile(variant_path):
+            with open(self._file_path(path), 'rb') as f:
+                compressed = ENCODERS[encoding](f.read())
+            os.makedirs(self.compressed_dir, exist_ok=True)
+            # written atomically, as workers may compress the same asset concurrently
+            temp_path = f'{variant_path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(compressed)
+            os.replace(temp_path, variant_path)
+        return variant_path
+
+    def _pick_encoding(self, path, mimetype):
+        """Picks the preferred encoding accepted by the request, None for identity"""
+        if mimetype is None or not mimetype.startswith(COMPRESSIBLE_TYPES):
+            return None
+        if os.path.getsize(self._file_path(path)) < MIN_COMPRESS_SIZE:
+            return None
+        for encoding in ENCODERS:
+            if request.accept_encodings[encoding] > 0:
+                return encoding
+        return None
+
+    def send(self, path):
+        """Makes the response to an asset request
+
+        Fingerprinted requests (with the asset's current fingerprint) are cached
+        as immutable for a year. Other requests must revalidate with the ETag.
+
+        Args:
+            path (str): the path of the asset relative to the root
+
+        Returns:
+            Response: the (possibly compressed or 304) response with the asset
+        """
+        file_path = self._file_path(path)
+        fingerprint = self.fingerprint(path)
+        mimetype, _ = mimetypes.guess_type(file_path)
+        encoding = self._pick_encoding(path, mimetype)
+
+        if encoding is None:
+            response = send_file(file_path, mimetype=mimetype, etag=fingerprint, conditional=True)
+        else:
+            variant_path = self._compressed_variant(path, fingerprint, encoding)
+            response = send_file(variant_path, mimetype=mimetype, etag=f'{fingerprint}-{encoding}', conditional=True)
+            response.headers['Content-Encoding'] = encoding
+            # the variant's file name isn't the asset's
+            response.headers.pop('Content-Disposition', None)
+        response.vary.add('Accept-Encoding')
+
+        if request.args.get(FINGERPRINT_PARAM) == fingerprint:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
@@ -5,4 +5,5 @@
 
 from .lru_session_cache import LRUSessionCache
 from .aes_lru_session_cache import AesLRUSessionCache
-from .sql_lru_session_cache import SqlLRUSessionCache
\ No newline at end of file
+from .sql_lru_session_cache import SqlLRUSessionCache
+from .redis_lru_session_cache import RedisLRUSessionCache
\ No newline at end of file
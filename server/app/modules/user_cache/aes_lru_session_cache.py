@@ -6,7 +6,8 @@
 from Crypto.Cipher import AES
 from base64 import b64encode, b64decode
 from .lru_session_cache import LRUSessionCache
-import os
+from ..session_manager import ServerSideSessionInterface
+from app.config import load_secret
 
 class AesLRUSessionCache(LRUSessionCache):
     """Decorator, an AES encrypted LRU caching solution for functions.
@@ -14,8 +15,8 @@ class AesLRUSessionCache(LRUSessionCache):
     Attributes:
         key (bytes, optional): an AES private key to be used. If missing or
             None, attempts to fetch an AES key from the file specified in the
-            `AES_SESSION_KEY_FILE` environment variable, and if all fails, randomly
-            generate a key.
+            `AES_SESSION_KEY_FILE` environment variable, and if all fails, uses a
+            random key generated once into the instance dir (shared by all workers).
         mode: an AES mode of operation ot be used. Defaults to CTR.
 
     Note:
@@ -23,17 +24,14 @@ class AesLRUSessionCache(LRUSessionCache):
         and requirements there apply too.
     """
     DEFAULT_KEY_LENGTH = 32     # the byte length of a generated AES key
+    KEY_FILE_NAME = 'medium_difficulty_key.secret'  # the generated AES key, in the instance dir
     SEPARATOR = b','    # The seperator used between the IV and ciphertext
 
     def __init__(self, key=None, mode=AES.MODE_CTR, *args, **kwargs):
-        key_path = os.environ.get('AES_SESSION_KEY_FILE')
         if key is not None:
             self.key = key
-        elif key_path is not None:
-            with open(key_path, 'rb') as key_file:
-                self.key = key_file.read()
         else:
-            key = os.urandom(self.DEFAULT_KEY_LENGTH)
+            self.key = load_secret('AES_SESSION_KEY_FILE', self.KEY_FILE_NAME, self.DEFAULT_KEY_LENGTH)
         
         self.mode = mode
         super().__init__(*args, **kwargs)
@@ -60,6 +58,13 @@ class AesLRUSessionCache(LRUSessionCache):
                 break
         super()._store(enc_cache_key, enc_cache_value)
 
+    def __call__(self, func):
+        decorated = super().__call__(func)
+        # keys are encrypted with a random nonce, so concurrent requests which
+        # store the same entry store it under different keys and can't be merged
+        ServerSideSessionInterface.register_whole_field(self.cache_name)
+        return decorated
+
     def __getitem__(self, cache_key):
         for cached in self._cache:
             if self._decode_and_decrypt(cached) == cache_key:
@@ -0,0 +1,142 @@
+"""
+    A process-local copy of the cache records of recently active sessions.
+    Used as a first tier in front of the SQL session caches.
+"""
+
+from collections import OrderedDict
+from threading import Lock, RLock
+import time
+
+
+class LocalSessionRecords:
+    """A size-bounded, thread-safe copy of the cache records of recently active sessions
+
+    The records of a session are loaded at once, and are served by the copy for
+    `ttl` seconds after they were loaded. Hits on copied records refresh their
+    access time in the copy, and are buffered as touches which the caller writes
+    back (coalesced - every record is written once, with it's latest access time)
+    when the session's copy expires or when it's eviction order is needed.
+
+    Attributes:
+        ttl (float): the seconds for which loaded records are served.
+        max_sessions (int): the maximal number of sessions whose records are held.
+    """
+    def __init__(self, ttl, max_sessions):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # ssid -> (load time, records, touches)
+        self._load_locks = {}
+        self._dropped_touches = {}  # ssid -> touches of sessions dropped for space
+        self._last_sweep = time.monotonic()
+        self._lock = RLock()
+
+    def _fresh(self, ssid):
+        local = self._sessions.get(ssid)
+        if local is None or time.monotonic() - local[0] >= self.ttl:
+            return None
+        self._sessions.move_to_end(ssid)
+        return local
+
+    def records(self, ssid, loader):
+        """Returns a copy of a session's records, loading them if they aren't held or expired
+
+        Concurrent loads of the same session within the process are made once.
+
+        Args:
+            ssid (str): the session id
+            loader (callable): receives the pending touches of the session (as a
+                dict which maps keys to access times), writes them, and returns a
+                dict which maps the session's keys to (access time, value) records.
+
+        Returns:
+            dict: maps the session's keys to (access time, value) records
+        """
+        with self._lock:
+            local = self._fresh(ssid)
+            if local is not None:
+                return dict(local[1])
+            load_lock = self._load_locks.setdefault(ssid, Lock())
+
+        with load_lock:
+            with self._lock:
+                local = self._fresh(ssid)
+                if local is not None:
+                    return dict(local[1])
+                expired = self._sessions.pop(ssid, None)
+                touches = self._dropped_touches.pop(ssid, {})
+                if expired is not None:
+                    touches.update(expired[2])
+            records = loader(touches)
+            with self._lock:
+                self._sessions[ssid] = (time.monotonic(), dict(records), {})
+                self._load_locks.pop(ssid, None)
+                while len(self._sessions) > self.max_sessions:
+                    dropped_ssid, (_, _, touches) = self._sessions.popitem(last=False)
+                    if touches:
+                        self._dropped_touches.setdefault(dropped_ssid, {}).update(touches)
+        return records
+
+    def set(self, ssid, key, record):
+        """Sets a record of a held session, after it was written to the database"""
+        with self._lock:
+            if ssid in self._sessions:
+                self._sessions[ssid][1][key] = record
+
+    def remove(self, ssid, key):
+        """Removes a record of a held session, after it was removed from the database"""
+        with self._lock:
+            if ssid in self._sessions:
+                _, records, touches = self._sessions[ssid]
+                records.pop(key, None)
+                touches.pop(key, None)
+
+    def touch(self, ssid, key, access_time):
+        """Refreshes the access time of a held record, buffering it for writing"""
+        with self._lock:
+            if ssid in self._sessions:
+                _, records, touches = self._sessions[ssid]
+                if key in records:
+                    records[key] = (access_time, records[key][1])
+                    touches[key] = access_time
+
+    def pop_touches(self, ssid):
+        """Removes and returns the buffered touches of a session
+
+        Returns:
+            dict: maps the touched keys to their latest access times
+        """
+        with self._lock:
+            if ssid not in self._sessions:
+                return {}
+            touches = dict(self._sessions[ssid][2])
+            self._sessions[ssid][2].clear()
+            return touches
+
+    def pop_expired_touches(self):
+        """Drops all expired sessions, and returns their buffered touches
+
+        Sessions are swept at most once every `ttl` seconds, so touches are returned
+        at most twice the ttl after the session's records were loaded.
+
+        Returns:
+            dict: maps the ids of dropped sessions (expired, or dropped earlier
+                to make space) which had touches to their touches
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep < self.ttl:
+                return {}
+            self._last_sweep = now
+            expired = [ssid for ssid, local in self._sessions.items() if now - local[0] >= self.ttl]
+            touched, self._dropped_touches = self._dropped_touches, {}
+            for ssid in expired:
+                _, _, touches = self._sessions.pop(ssid)
+                if touches:
+                    touched.setdefault(ssid, {}).update(touches)
+            return touched
+
+    def drop(self, ssid):
+        """Drops the records (and the buffered touches) of a session"""
+        with self._lock:
+            self._sessions.pop(ssid, None)
+            self._dropped_touches.pop(ssid, None)
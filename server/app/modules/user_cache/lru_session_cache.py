@@ -5,6 +5,8 @@
 
 from flask import session
 from functools import wraps
+from ..metrics import record_cache_event
+import random
 import time
 
 
@@ -23,16 +25,26 @@ class LRUSessionCache:
             the cached function's outputs to strings. A serializer should support
             a `dumps` and `loads` functions which serialize outputs to strings and
             deserialize these strings back to the correct values respectively.
+        recency_interval (float, optional): seconds during which hits don't refresh
+            the access time of an entry. A hit on an entry which was accessed less
+            than recency_interval seconds ago doesn't write to the cache at all.
+            Defaults to 0 - every hit refreshes the entry (exact LRU).
+        eviction_samples (int, optional): if positive, evictions remove the least
+            recently used of this many randomly sampled entries (approximate LRU)
+            instead of the least recently used entry of the whole cache.
+            Defaults to 0 - exact LRU eviction.
     """
     CACHE_NAME_TEMPLATE = "cache_for_{}"    # template for cache naming
     DEFAULT_SIZE = 10   # default size of the LRU cache
 
-    def __init__(self, max_size=None, serializer=None):
+    def __init__(self, max_size=None, serializer=None, recency_interval=0, eviction_samples=0):
         if max_size is None:
             max_size = self.DEFAULT_SIZE
         
         self.max_size = max_size
         self.serializer = serializer
+        self.recency_interval = recency_interval
+        self.eviction_samples = eviction_samples
 
     @property
     def _cache(self):
@@ -44,12 +56,32 @@ class LRUSessionCache:
     def _encode_params(*args, **kwargs):
         return str(args + tuple(kwargs.items()))
 
+    def _now(self):
+        """The access time of entries accessed now"""
+        return time.time()
+
+    def _is_recent(self, access_time):
+        """Checks if an entry accessed at a given time needs no refresh on a hit"""
+        return self._now() - access_time < self.recency_interval
+
     def _evict(self):
-        evicted = min(self._cache, key=lambda param: self._cache[param][0])
-        self._cache.pop(evicted)
+        cache = self._cache
+        # server-side sessions merge the entries of concurrent requests, which may overfill the cache
+        while cache and len(cache) >= self.max_size:
+            record_cache_event(self, 'evict')
+            candidates = cache
+            if 0 < self.eviction_samples < len(cache):
+                candidates = random.sample(list(cache), self.eviction_samples)
+            evicted = min(candidates, key=lambda param: cache[param][0])
+            cache.pop(evicted)
 
     def _store(self, key, value):
-        self._cache[key] = (time.time(), value)
+        self._cache[key] = (self._now(), value)
+
+    def _touch(self, key, value):
+        """Refreshes the access time of a cached entry"""
+        self._store(key, value)
+        self.set_modified()
 
     def __getitem__(self, key):
         if key in self._cache:
@@ -65,17 +97,19 @@ class LRUSessionCache:
 
         @wraps(func)
         def cached_func(*args, **kwargs):
-            self.set_modified()     # makes sure the cache update flows to user
             parameters = self._encode_params(*args, **kwargs)
             fetched = self[parameters]
             if fetched is not None:
-                _, result = fetched
-                self._store(parameters, result)
+                record_cache_event(self, 'hit')
+                access_time, result = fetched
+                if not self._is_recent(access_time):
+                    self._touch(parameters, result)
 
                 if self.serializer is None:
                     return result
                 return self.serializer.loads(result)
 
+            record_cache_event(self, 'miss')
             result = func(*args, **kwargs)
             if self.serializer is None:
                 to_store = result
@@ -86,6 +120,7 @@ class LRUSessionCache:
                 self._evict()
 
             self._store(parameters, to_store)
+            self.set_modified()     # makes sure the cache update flows to user
             return result
 
         return cached_func
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""
+    A server side per-user caching solution on a Redis-compatible key-value store.
+    Assumes a SessionHandler is attached to the flask app (SessionIDs are required),
+    and a key-value store is initialized for the app (see app.modules.kv_store).
+"""
+
+from .lru_session_cache import LRUSessionCache
+from ..kv_store import kv_store
+from ..session_manager import SessionHandler, SessionKeyExpiry
+from ..metrics import record_cache_event
+
+
+class RedisLRUSessionCache(LRUSessionCache):
+    """A decorator, a server side LRU per-session caching solution on a key-value store.
+
+    Each session's cache is kept in two keys - a hash which maps the cached
+    parameters to their values, and a sorted set of the parameters scored by
+    their last access time. Evictions pop the lowest scored parameters (ZPOPMIN),
+    so concurrent evictions never remove the same entry twice. Both keys expire
+    with the session (see SessionKeyExpiry), so no cleanup is required.
+
+    Attributes:
+        index (int): a unique index for the cache's keys.
+        store: the client of the app's key-value store.
+
+    Note:
+        This class extends the LRUSessionCache solution, and all attributes
+        and requirements there apply too. Evictions are always exact, hence
+        `eviction_samples` is ignored.
+    """
+    DEFAULT_SIZE = 64   # The default LRU cache size
+    VALUES_KEY_TEMPLATE = "genetwork:cache:{index}:{ssid}:values"   # the hash of a session's cached values
+    ACCESS_KEY_TEMPLATE = "genetwork:cache:{index}:{ssid}:access"   # the sorted set of a session's access times
+    _DECLARED_SESSION_CACHES = []
+    _SESSION_HANDLER = SessionHandler()
+
+    def __init__(self, *args, **kwargs):
+        self.index = len(self._DECLARED_SESSION_CACHES)
+        self._DECLARED_SESSION_CACHES.append(self)
+        self.store = kv_store()
+        SessionKeyExpiry.register_session_keys(self._session_keys)
+        super().__init__(*args, **kwargs)
+
+    def _session_keys(self, ssid):
+        return [
+            self.VALUES_KEY_TEMPLATE.format(index=self.index, ssid=ssid),
+            self.ACCESS_KEY_TEMPLATE.format(index=self.index, ssid=ssid)
+        ]
+
+    @property
+    def current_ssid(self):
+        """str: the current userid being handled, used for clearness only"""
+        return self._SESSION_HANDLER.ssid
+
+    @property
+    def _cache(self):
+        values_key, access_key = self._session_keys(self.current_ssid)
+        pipeline = self.store.pipeline()
+        pipeline.hgetall(values_key)
+        pipeline.zrange(access_key, 0, -1, withscores=True)
+        values, access_times = pipeline.execute()
+        return {
+            key.decode('utf-8'): (access_time, values[key].decode('utf-8'))
+            for key, access_time in access_times if key in values
+        }
+
+    def _store(self, key, value):
+        values_key, access_key = self._session_keys(self.current_ssid)
+        pipeline = self.store.pipeline()
+        pipeline.hset(values_key, key, value)
+        pipeline.zadd(access_key, {key: self._now()})
+        SessionKeyExpiry.expire_with_session(pipeline, values_key, access_key)
+        pipeline.zcard(access_key)
+        size = pipeline.execute()[-1]
+        # concurrent stores may exceed the size before evicting
+        for _ in range(size - self.max_size):
+            self._evict()
+
+    def _evict(self):
+        record_cache_event(self, 'evict')
+        values_key, access_key = self._session_keys(self.current_ssid)
+        popped = self.store.zpopmin(access_key)
+        if popped:
+            evicted, _ = popped[0]
+            self.store.hdel(values_key, evicted)
+
+    def _touch(self, key, value):
+        _, access_key = self._session_keys(self.current_ssid)
+        # only refreshes entries which weren't evicted in the meantime
+        self.store.zadd(access_key, {key: self._now()}, xx=True)
+
+    def __getitem__(self, key):
+        values_key, access_key = self._session_keys(self.current_ssid)
+        pipeline = self.store.pipeline()
+        pipeline.hget(values_key, key)
+        pipeline.zscore(access_key, key)
+        value, access_time = pipeline.execute()
+        if value is None or access_time is None:
+            return None
+        return (access_time, value.decode('utf-8'))
+
+    def set_modified(self):
+        """Disabling the inherited set_modified function. Not required."""
+        pass
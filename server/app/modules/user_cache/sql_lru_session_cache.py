@@ -5,12 +5,21 @@
 
 from app import db
 from flask import current_app
-from sqlalchemy.sql import func
+from sqlalchemy import bindparam, update
 from sqlalchemy.orm.exc import StaleDataError
 from sqlalchemy.exc import IntegrityError
 from .lru_session_cache import LRUSessionCache
-from ..session_manager import SessionHandler
+from .local_session_records import LocalSessionRecords
+from ..session_manager import SessionHandler, SessionIdType
+from ..db_pool import bind_table_args, hash_partition_count
+from ..metrics import record_cache_event
+from contextlib import contextmanager
+from functools import wraps
+from datetime import datetime, timedelta
+from threading import Lock
 import os
+import random
+import time
 
 
 class SqlLRUSessionCache(LRUSessionCache):
@@ -21,37 +30,67 @@ class SqlLRUSessionCache(LRUSessionCache):
             Used for table identification within the database.
         CacheRecord (db.Model): the flask-sqlalchemy table object
             which stores all cached values.
+        local_records (LocalSessionRecords): the worker's copy of the records
+            of recently active sessions, None if disabled. Set by the `local_ttl`
+            argument (defaults to the app's SESSION_CACHE_LOCAL_TTL config), the
+            seconds for which a copy is served before it's reloaded. Hits served
+            by the copy write their access times to the database when the copy
+            expires (or before evictions), so other workers may see access times
+            which are older by up to twice the ttl, and may serve records for up
+            to the ttl after another worker evicted them.
+
+    Concurrent calls with the same parameters in a session are made one at a
+    time within a process, so concurrent misses are computed and stored once
+    (the waiting calls hit the stored value). Writes which conflict with other
+    processes are retried up to STORE_ATTEMPTS times, with an exponential backoff.
 
     Note:
         This class extends the LRUSessionCache solution, and all attributes
-        and requirements there apply too.
+        and requirements there apply too. The least recently used record is
+        found by the eviction query itself, hence `eviction_samples` is ignored
+        and evictions are always exact.
     """
     DEFAULT_SIZE = 64   # The default LRU cache size
+    DEFAULT_LOCAL_SESSIONS = 1024   # the default number of sessions whose records are copied locally
+    STORE_ATTEMPTS = 5  # attempts of a store (or an eviction) which conflicts with concurrent writes
+    RETRY_BACKOFF = 0.005   # seconds before the first retry of a conflicting write, doubled on each retry
     DB_NAME = "sql_sessions"    # the name for the sessions' database
     BIND_NAME = "sql_sessions"  # the flask-sqlalchemy bind name for the sessions' database
     TABLE_NAME_TEMPLATE = "sql_session_cache_{}"    # a string format template for table names
     _DECLARED_SESSION_CACHES = []
     _SESSION_HANDLER = SessionHandler()
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, local_ttl=None, local_sessions=None, **kwargs):
         self.index = len(self._DECLARED_SESSION_CACHES)
         self._DECLARED_SESSION_CACHES.append(self)
+        # the primary key of a partitioned table must include the partition column
+        partitioned = hash_partition_count(current_app) > 0
 
         class CacheRecord(db.Model):
             __bind_key__ = self.BIND_NAME
             __tablename__ = self.table_name
-            id = db.Column(db.Integer, primary_key=True)
-            ssid = db.Column(db.String(self._SESSION_HANDLER.UUID_LEN), nullable=False)
+            id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+            ssid = db.Column(SessionIdType(), nullable=False, primary_key=partitioned)
             cache_key = db.Column(db.PickleType)
             cache_value = db.Column(db.PickleType)
             last_access = db.Column(db.DateTime)
-            __table_args__ = (
+            __table_args__ = bind_table_args(
+                current_app, self.BIND_NAME,
                 # Makes sure users can't store the same key twice
                 db.UniqueConstraint('ssid', 'cache_key'),
+                hash_partition_column='ssid'
             )
         
         self.CacheRecord = CacheRecord
 
+        if local_ttl is None:
+            local_ttl = current_app.config.get('SESSION_CACHE_LOCAL_TTL', 0)
+        if local_sessions is None:
+            local_sessions = current_app.config.get('SESSION_CACHE_LOCAL_SESSIONS', self.DEFAULT_LOCAL_SESSIONS)
+        self.local_records = LocalSessionRecords(local_ttl, local_sessions) if local_ttl > 0 else None
+        self._flights = {}  # (ssid, parameters) -> [lock, number of calls holding or waiting for it]
+        self._flights_lock = Lock()
+
         super().__init__(*args, **kwargs)
     
     def _register_cache(self, app):
@@ -70,6 +109,8 @@ class SqlLRUSessionCache(LRUSessionCache):
     def _delete_session(ssid):
         for cache in SqlLRUSessionCache._DECLARED_SESSION_CACHES:
             cache.CacheRecord.query.filter_by(ssid=ssid).delete()
+            if cache.local_records is not None:
+                cache.local_records.drop(ssid)
         db.session.commit()
     
     @property
@@ -82,45 +123,126 @@ class SqlLRUSessionCache(LRUSessionCache):
         """str: the current userid being handled, used for clearness only"""
         return self._SESSION_HANDLER.ssid
     
+    def _write_touches(self, touched):
+        """Writes access times buffered by the local records. Commit is left to the caller.
+
+        Args:
+            touched (dict): maps session ids to dicts which map their touched keys to access times
+        """
+        params = [
+            {'touched_ssid': ssid, 'touched_key': key, 'touched_time': access_time}
+            for ssid, touches in touched.items() for key, access_time in touches.items()
+        ]
+        if not params:
+            return
+        record = self.CacheRecord
+        db.session.execute(
+            update(record)
+            .where(record.ssid == bindparam('touched_ssid'), record.cache_key == bindparam('touched_key'))
+            .values(last_access=bindparam('touched_time'))
+            .execution_options(synchronize_session=False),
+            params
+        )
+
+    def _load_records(self, ssid, touches):
+        if touches:
+            self._write_touches({ssid: touches})
+            db.session.commit()
+        user_records = self.CacheRecord.query.filter_by(ssid=ssid).all()
+        return {record.cache_key: (record.last_access, record.cache_value) for record in user_records}
+
+    def _flush_expired_touches(self, exception=None):
+        """Writes the buffered access times of expired local records, after each request"""
+        touched = self.local_records.pop_expired_touches()
+        if touched:
+            self._write_touches(touched)
+            db.session.commit()
+
     @property
     def _cache(self):
-        user_records = self.CacheRecord.query.filter_by(ssid=self.current_ssid).all()
-        cache = {record.cache_key: (record.last_access, record.cache_value) for record in user_records}
-        return cache
+        ssid = self.current_ssid
+        if self.local_records is None:
+            return self._load_records(ssid, {})
+        return self.local_records.records(ssid, lambda touches: self._load_records(ssid, touches))
     
+    def _retry_delay(self, attempt):
+        """The seconds to wait before retrying a conflicting write (exponential, with jitter)"""
+        return self.RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1)
+
     def _store(self, key, value):
-        record = self.CacheRecord.query.filter_by(ssid=self.current_ssid, cache_key=key).first()
-        if record is None:
-            db.session.add(
-                self.CacheRecord(
-                    ssid=self.current_ssid,
-                    cache_key=key,
-                    cache_value=value,
-                    last_access=func.now()
+        for attempt in range(self.STORE_ATTEMPTS):
+            access_time = self._now()
+            record = self.CacheRecord.query.filter_by(ssid=self.current_ssid, cache_key=key).first()
+            if record is None:
+                db.session.add(
+                    self.CacheRecord(
+                        ssid=self.current_ssid,
+                        cache_key=key,
+                        cache_value=value,
+                        last_access=access_time
+                    )
                 )
-            )
 
-            if len(self._cache) > self.max_size:
-                self._evict()
-            
-        else:
-            record.last_access = func.now()
+                if self.CacheRecord.query.filter_by(ssid=self.current_ssid).count() > self.max_size:
+                    self._evict()
 
-        try:
-            db.session.commit()
-        except (StaleDataError, IntegrityError):
-            # record was modified while operating! Retry to store.
-            db.session.rollback()
-            self._store(key, value)
+            else:
+                record.last_access = access_time
+
+            try:
+                db.session.commit()
+            except (StaleDataError, IntegrityError):
+                # the records were modified by another process while operating, retry to store
+                db.session.rollback()
+                record_cache_event(self, 'conflict')
+                time.sleep(self._retry_delay(attempt))
+                continue
+
+            if record is None:
+                SessionHandler.state_stored(self.current_ssid)
+            if self.local_records is not None:
+                self.local_records.set(self.current_ssid, key, (access_time, value))
+            return
+
+        # the value was computed, it's only left uncached
+        print(f'SqlLRUSessionCache: Gave up storing a record of {self.current_ssid} after {self.STORE_ATTEMPTS} conflicts')
     
     def _evict(self):
-        eviction_target = self.CacheRecord.query.filter_by(ssid=self.current_ssid).order_by(self.CacheRecord.last_access).first()
-        deleted = db.session.delete(eviction_target)
-        if deleted == 0:
-            # if deleted item was deleted by another thread, retry
-            self._evict()
+        record_cache_event(self, 'evict')
+        if self.local_records is not None:
+            # the eviction order must include the hits served by the local records
+            self._write_touches({self.current_ssid: self.local_records.pop_touches(self.current_ssid)})
+        for attempt in range(self.STORE_ATTEMPTS):
+            eviction_target = self.CacheRecord.query.filter_by(ssid=self.current_ssid).order_by(self.CacheRecord.last_access).first()
+            if eviction_target is None:
+                return
+            deleted = self.CacheRecord.query.filter_by(id=eviction_target.id).delete(synchronize_session=False)
+            if deleted:
+                if self.local_records is not None:
+                    self.local_records.remove(self.current_ssid, eviction_target.cache_key)
+                return
+            # the target was evicted by another process, evict the next least recently used record
+            time.sleep(self._retry_delay(attempt))
     
+    def _now(self):
+        # access times are set by the app (not the database clock) so hits can compare them to the current time
+        return datetime.utcnow()
+
+    def _is_recent(self, access_time):
+        return self._now() - access_time < timedelta(seconds=self.recency_interval)
+
+    def _touch(self, key, value):
+        if self.local_records is not None:
+            self.local_records.touch(self.current_ssid, key, self._now())
+            return
+        self.CacheRecord.query.filter_by(ssid=self.current_ssid, cache_key=key).update(
+            {'last_access': self._now()}, synchronize_session=False
+        )
+        db.session.commit()
+
     def __getitem__(self, key):
+        if self.local_records is not None:
+            return self._cache.get(key)
         record = self.CacheRecord.query.filter_by(ssid=self.current_ssid, cache_key=key).first()
         if record is None:
             return None
@@ -130,7 +252,31 @@ class SqlLRUSessionCache(LRUSessionCache):
         """Disabling the inherited set_modified function. Not required."""
         pass
     
+    @contextmanager
+    def _single_flight(self, flight_key):
+        """Makes the calls of a flight key one at a time, within the process"""
+        with self._flights_lock:
+            flight = self._flights.setdefault(flight_key, [Lock(), 0])
+            flight[1] += 1
+        try:
+            with flight[0]:
+                yield
+        finally:
+            with self._flights_lock:
+                flight[1] -= 1
+                if flight[1] == 0:
+                    del self._flights[flight_key]
+
     def __call__(self, func):
         decorated = super().__call__(func)
         self._register_cache(current_app)
-        return decorated
\ No newline at end of file
+        if self.local_records is not None:
+            current_app.teardown_request(self._flush_expired_touches)
+
+        @wraps(func)
+        def single_flight(*args, **kwargs):
+            # concurrent identical calls wait for the first, and then hit the value it stored
+            with self._single_flight((self.current_ssid, self._encode_params(*args, **kwargs))):
+                return decorated(*args, **kwargs)
+
+        return single_flight
\ No newline at end of file
@@ -5,23 +5,111 @@ const PRIVATE_AVATAR = "/img/avatar/private.svg";
 const USER_ID_ATTR = "data-user-id";
 const WAS_DRAWN_NAME = "was-drawn";
 
+const AVATAR_SCHEMA_URL = "/api/avatar_schema";
+const RECOLOR_WORKER_URL = "/static/recolor_worker.js";
+const LAZY_DRAW_MARGIN = "200px";   // avatars this close to the viewport are drawn
+
+var avatar_schema_promise = null;
+
+// fetches the avatar schema (once per page) for decoding DNA on the client
+function fetch_avatar_schema() {
+    if (avatar_schema_promise === null) {
+        avatar_schema_promise = new Promise((resolve, reject) => {
+            var request = $.ajax({
+                url: AVATAR_SCHEMA_URL,
+                type: 'GET',
+            });
+            request.done((result) => {
+                if (result['status'] === 'success'){
+                    resolve(result['content'])
+                }
+                reject(result['content'])
+            });
+            request.fail(reject);
+        });
+    }
+    return avatar_schema_promise;
+}
+
+// fills the {key} placeholders of a schema url template
+function format_template(template, values) {
+    return template.replace(/{(\w+)}/g, (match, key) => values[key]);
+}
+
+// decodes a DNA sequence to a dict of part name -> part json (like part_to_dict)
+// the layers of the parts are described by their regions in the part atlases
+function parts_from_dna(schema, dna) {
+    // convert the DNA to bits
+    let bitstring = "";
+    for (const nucleotide of dna) {
+        const value = schema['nucleotides'].indexOf(nucleotide);
+        if (value < 0)
+            throw "Invalid DNA string.";
+        bitstring += value.toString(2).padStart(schema['bits_in_nucleotide'], "0");
+    }
+
+    // remove the padding
+    const needed_len = schema['bit_len'];
+    const pad_len = bitstring.length - needed_len;
+    if (pad_len < 0 || pad_len >= schema['bits_in_nucleotide'])
+        throw "Bad DNA string length";
+    if (bitstring.slice(0, pad_len).includes("1"))
+        throw "Bad DNA string length";
+    bitstring = bitstring.slice(pad_len);
+
+    // decode each part in order
+    let parts = {};
+    let offset = 0;
+    for (const part of schema['parts']) {
+        const variation_bits = bitstring.slice(offset, offset + part['variation_bit_len']);
+        const variation = variation_bits ? parseInt(variation_bits, 2) : 0;
+        if (variation >= part['variations'])
+            throw `variation must be between 0 (inclusive) and ${part['variations']} (exclusive)`;
+        const template_values = {'part': part['name'], 'variation': variation};
+
+        let part_json = {
+            'border_image': schema['assets']['regions'][format_template(schema['assets']['border_image'], template_values)],
+            'color_image': null
+        };
+        if (part['is_colorable']) {
+            const color_start = offset + part['variation_bit_len'];
+            const color_bits = bitstring.slice(color_start, color_start + schema['color_bit_len']);
+            part_json['color_image'] = {
+                'image': schema['assets']['regions'][format_template(schema['assets']['color_image'], template_values)],
+                'color': schema['palette'][parseInt(color_bits, 2)]
+            };
+        }
+        parts[part['name']] = part_json;
+        offset += part['bit_len'];
+    }
+    return parts;
+}
+
+// caches of image promises, shared by all avatars in the page
+var image_cache = new Map();        // image url -> image
+var recolored_cache = new Map();    // (atlas region, color) -> recolored region
+
 function fetch_image(src) {
-    return new Promise((resolve) => {
-        var img = new Image();
-        img.onload = () => resolve(img);
-        img.src = src;
-    });
+    if (!image_cache.has(src)) {
+        image_cache.set(src, new Promise((resolve) => {
+            var img = new Image();
+            img.onload = () => resolve(img);
+            img.src = src;
+        }));
+    }
+    return image_cache.get(src);
 }
 
-function recolor_image(new_color, img) {
+function recolor_image(new_color, region, img) {
     // create canvas on which the new image is generated
     const canvas = document.createElement("canvas");
     const ctx = canvas.getContext("2d");
-    canvas.width = AVATAR_WIDTH;
-    canvas.height = AVATAR_HEIGHT;
+    canvas.width = region['width'];
+    canvas.height = region['height'];
 
-    // draw the image to color
-    ctx.drawImage(img, 0, 0);
+    // draw the atlas region to color
+    ctx.drawImage(img, region['x'], region['y'], region['width'], region['height'],
+                  0, 0, region['width'], region['height']);
 
     // override the canvas color with new color
     ctx.globalCompositeOperation = "source-in";
@@ -32,6 +120,69 @@ function recolor_image(new_color, img) {
     return canvas;
 }
 
+// recoloring in a worker with an OffscreenCanvas, where supported
+var recolor_worker = null;
+var recolor_requests = new Map();   // request id -> promise resolvers
+var next_recolor_request = 0;
+
+function supports_recolor_worker() {
+    return !!(window.Worker && window.OffscreenCanvas && window.createImageBitmap);
+}
+
+function get_recolor_worker() {
+    if (recolor_worker === null) {
+        recolor_worker = new Worker(RECOLOR_WORKER_URL);
+        recolor_worker.onmessage = (event) => {
+            const {id, bitmap, error} = event.data;
+            const {resolve, reject} = recolor_requests.get(id);
+            recolor_requests.delete(id);
+            if (bitmap)
+                resolve(bitmap);
+            else
+                reject(error);
+        };
+    }
+    return recolor_worker;
+}
+
+function recolor_in_worker(region, color) {
+    return new Promise((resolve, reject) => {
+        const id = next_recolor_request++;
+        recolor_requests.set(id, {resolve, reject});
+        get_recolor_worker().postMessage({
+            'id': id,
+            'src': new URL(region['atlas'], document.baseURI).href,
+            'color': color,
+            'region': region
+        });
+    });
+}
+
+function recolor_in_page(region, color) {
+    let recolored = fetch_image(region['atlas'])
+        .then(recolor_image.bind(undefined, color, region));
+    if (window.createImageBitmap)
+        recolored = recolored.then((canvas) => createImageBitmap(canvas));
+    return recolored;
+}
+
+// fetches an atlas region recolored with a color, each (region, color) pair is only made once
+function fetch_recolored(region, color) {
+    const key = `${region['atlas']}#${region['x']},${region['y']}|${color}`;
+    if (!recolored_cache.has(key)) {
+        let recolored;
+        if (supports_recolor_worker()) {
+            // fall back to recoloring in the page if the worker fails
+            recolored = recolor_in_worker(region, color)
+                .catch(() => recolor_in_page(region, color));
+        } else {
+            recolored = recolor_in_page(region, color);
+        }
+        recolored_cache.set(key, recolored);
+    }
+    return recolored_cache.get(key);
+}
+
 function draw_promise(context, img) {
     return new Promise((resolve) => {
         context.drawImage(img, 0, 0);
@@ -39,26 +190,30 @@ function draw_promise(context, img) {
     });
 }
 
+// draws a layer - an image region placed at a position of the avatar
+function draw_layer(context, layer) {
+    context.drawImage(layer['image'], layer['x'], layer['y'], layer['width'], layer['height'],
+                      layer['left'], layer['top'], layer['width'], layer['height']);
+}
+
+// loads the layers of a part json, border first
+function part_images(json) {
+    const border = json['border_image'];
+    let layers = [fetch_image(border['atlas'])
+        .then((atlas) => Object.assign({}, border, {'image': atlas}))];
+    if (!!json['color_image']) {
+        const color_region = json['color_image']['image'];
+        layers.push(fetch_recolored(color_region, json['color_image']['color'])
+            .then((recolored) => Object.assign({}, color_region, {'image': recolored, 'x': 0, 'y': 0})));
+    }
+    return Promise.all(layers);
+}
+
 function draw_json_part(context, json) {
-    return new Promise((resolve) => {
-        // variable for promises to which we wait
-        let promises = []
-        // draw the body part
-        promises.push(
-            fetch_image(json['border_image'])
-                .then(draw_promise.bind(undefined, context))
-        );
-        
-        if (!!json['color_image']) {
-            promises.push(
-                fetch_image(json['color_image']['image'])
-                    .then(recolor_image.bind(undefined, json['color_image']['color']))
-                    .then(draw_promise.bind(undefined, context))
-            );
-        }
-        
-        Promise.allSettled(promises).then(resolve);
-    });
+    return part_images(json)
+        .then((layers) => {
+            layers.forEach((layer) => {draw_layer(context, layer);});
+        });
 }
 
 
@@ -101,35 +256,45 @@ function fetch_part_from_user(user_id, part) {
     });
 }
 
-function canvas_from_json(part_json) {
-    return new Promise((resolve) => {
-        const canvas = document.createElement('canvas');
-        canvas.width = AVATAR_WIDTH;
-        canvas.height = AVATAR_HEIGHT;
-        const ctx = canvas.getContext('2d');
-        draw_json_part(ctx, part_json)
-            .then(() => {
-                resolve(canvas);
-            });
-    });
-}
-
 function draw_user(canvas, user_id){
     var ctx = canvas.getContext('2d');
     var json_parts = AVATAR_BODY_PARTS.map(fetch_part_from_user.bind(undefined, user_id));
-    var promises = [];
-    for (let i = 0; i < json_parts.length; i++) {
-        promises.push(json_parts[i].then(canvas_from_json));
-    }
+    var promises = json_parts.map((json_part) => json_part.then(part_images));
+    // draw all parts in order once all their images are ready
     Promise.all(promises)
         .then((body_parts) => {
-            body_parts.forEach((part) => {
-                ctx.drawImage(part, 0, 0);
+            body_parts.forEach((layers) => {
+                layers.forEach((layer) => {draw_layer(ctx, layer);});
             });
         })
         .catch((err) => {draw_private_avatar(ctx)});
 }
 
+function draw_avatar(avatar) {
+    // if avatar is bound to a user id, draw it
+    if (!avatar.hasAttribute(USER_ID_ATTR))
+        return;
+    user_id = avatar.getAttribute(USER_ID_ATTR);
+    draw_user(avatar, user_id);
+}
+
+// draws avatars only once they (nearly) become visible
+var avatar_observer = null;
+
+function get_avatar_observer() {
+    if (avatar_observer === null && window.IntersectionObserver) {
+        avatar_observer = new IntersectionObserver((entries, observer) => {
+            entries.forEach((entry) => {
+                if (!entry.isIntersecting)
+                    return;
+                observer.unobserve(entry.target);
+                draw_avatar(entry.target);
+            });
+        }, {rootMargin: LAZY_DRAW_MARGIN});
+    }
+    return avatar_observer;
+}
+
 function prepare_avatar(avatar) {
     // don't redraw drawn canvases
     if ($(avatar).data(WAS_DRAWN_NAME))
@@ -141,11 +306,11 @@ function prepare_avatar(avatar) {
     avatar.width = AVATAR_WIDTH;
     avatar.height = AVATAR_HEIGHT;
 
-    // if avatar is bound to a user id, draw it
-    if (!avatar.hasAttribute(USER_ID_ATTR))
-        return;
-    user_id = avatar.getAttribute(USER_ID_ATTR);
-    draw_user(avatar, user_id);
+    const observer = get_avatar_observer();
+    if (observer === null)
+        draw_avatar(avatar);
+    else
+        observer.observe(avatar);
 }
 
 function draw_all_avatars(){
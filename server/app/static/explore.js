@@ -1,13 +1,67 @@
+const EXPLORE_LIST_ID = "exploreUserList";
+const DECK_CURSOR_HEADER = "X-Deck-Cursor";
+const PREFETCH_MARGIN = 1.5;    // screen heights from the bottom at which the next deck is shown
+
+var deck_request = null;    // the in-flight deck request, at most one at a time
+var next_deck = null;       // a prefetched deck which wasn't shown yet
+
+// fetches the deck after the last fetched one
 function get_more_users() {
+    let list = $(`#${EXPLORE_LIST_ID}`);
     return new Promise((resolve, reject) => {
         var request = $.ajax({
             url: '/api/get_user_deck',
             type: 'GET',
+            data: {
+                'seed': list.data('deck-seed'),
+                'cursor': list.data('deck-cursor')
+            }
+        });
+        request.done((content, status, xhr) => {
+            list.data('deck-cursor', xhr.getResponseHeader(DECK_CURSOR_HEADER));
+            resolve(content);
         });
-        request.done(resolve);
+        request.fail(reject);
     });
 }
 
+// requests the next deck, unless it's already being fetched or was fetched
+function prefetch_deck() {
+    if (deck_request !== null || next_deck !== null)
+        return deck_request;
+    deck_request = get_more_users()
+        .then((content) => {next_deck = content;})
+        // a failed request leaves no deck, so the next scroll fetches it again
+        .catch(() => {next_deck = null;})
+        .finally(() => {deck_request = null;});
+    return deck_request;
+}
+
+function near_bottom() {
+    let margin = PREFETCH_MARGIN * $(window).height();
+    return $(window).scrollTop() > $(document).height() - $(window).height() - margin;
+}
+
+// shows the prefetched deck when the bottom nears, and prefetches the one after it
+function show_deck_if_needed() {
+    if (!near_bottom())
+        return;
+    if (next_deck === null) {
+        // show the deck once it arrives
+        let request = prefetch_deck();
+        if (request !== null)
+            request.then(() => {
+                if (next_deck !== null)
+                    show_deck_if_needed();
+            });
+        return;
+    }
+    $(`#${EXPLORE_LIST_ID}`).append(next_deck);
+    next_deck = null;
+    draw_all_avatars();
+    prefetch_deck();
+}
+
 
 // Restores scroll position on refresh
 history.scrollRestoration = "manual";
@@ -15,15 +69,10 @@ window.onbeforeunload = () => {
     $(window).scrollTop(0);
 };
 
-// When page reaches bottom, load more users
-$(window).scroll(function() {
-    bottom_margin = 10;
-    // check if bottom of page is reached
-    if( $(window).scrollTop() > $(document).height() - $(window).height() - bottom_margin ) {
-        get_more_users()
-            .then((new_content) => {
-                $("#exploreUserList").append(new_content);
-            })
-            .then(draw_all_avatars);
-    }
-});
\ No newline at end of file
+$().ready(() => {
+    prefetch_deck();
+    show_deck_if_needed();
+});
+
+// When page nears bottom, show more users
+$(window).scroll(show_deck_if_needed);
@@ -0,0 +1,42 @@
+// Recolors part atlas regions off the main thread with an OffscreenCanvas.
+// Receives {id, src, color, region} and replies with {id, bitmap} or {id, error}.
+
+var bitmap_cache = new Map();   // atlas url -> decoded image bitmap
+
+function fetch_bitmap(src) {
+    if (!bitmap_cache.has(src)) {
+        bitmap_cache.set(src, fetch(src)
+            .then((response) => response.blob())
+            .then((blob) => createImageBitmap(blob)));
+    }
+    return bitmap_cache.get(src);
+}
+
+function recolor_bitmap(bitmap, color, region) {
+    const width = region['width'];
+    const height = region['height'];
+    const canvas = new OffscreenCanvas(width, height);
+    const ctx = canvas.getContext("2d");
+
+    // draw the atlas region to color
+    ctx.drawImage(bitmap, region['x'], region['y'], width, height, 0, 0, width, height);
+
+    // override the canvas color with new color
+    ctx.globalCompositeOperation = "source-in";
+    ctx.fillStyle = color;
+    ctx.fillRect(0, 0, width, height);
+
+    return canvas.transferToImageBitmap();
+}
+
+onmessage = (event) => {
+    const {id, src, color, region} = event.data;
+    fetch_bitmap(src)
+        .then((bitmap) => {
+            const recolored = recolor_bitmap(bitmap, color, region);
+            postMessage({'id': id, 'bitmap': recolored}, [recolored]);
+        })
+        .catch((error) => {
+            postMessage({'id': id, 'error': String(error)});
+        });
+};
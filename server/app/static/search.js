@@ -0,0 +1,54 @@
+const SEARCH_LIST_ID = "searchUserList";
+
+var is_loading_results = false;
+var has_more_results = true;
+
+// builds the search parameters of the current results page
+function search_parameters() {
+    let list = $(`#${SEARCH_LIST_ID}`);
+    let params = {
+        'search': list.data('search'),
+        'privacySelect': list.data('privacy-select')
+    };
+    if (list.data('force-job') === 'True')
+        params['forceJob'] = 'on';
+    if (list.data('force-location') === 'True')
+        params['forceLocation'] = 'on';
+
+    // continue after the last shown user
+    let last_user = $(`#${SEARCH_LIST_ID} .avatar`).last();
+    if (last_user.length)
+        params['after'] = last_user.attr(USER_ID_ATTR);
+    return params;
+}
+
+function get_more_results() {
+    return new Promise((resolve, reject) => {
+        var request = $.ajax({
+            url: '/api/search',
+            type: 'GET',
+            data: search_parameters()
+        });
+        request.done(resolve);
+        request.fail(reject);
+    });
+}
+
+// When page reaches bottom, load the next page of results
+$(window).scroll(function() {
+    bottom_margin = 10;
+    if (is_loading_results || !has_more_results)
+        return;
+    // check if bottom of page is reached
+    if( $(window).scrollTop() > $(document).height() - $(window).height() - bottom_margin ) {
+        is_loading_results = true;
+        get_more_results()
+            .then((new_content) => {
+                // an empty page means all results were shown
+                has_more_results = !!new_content.trim();
+                $(`#${SEARCH_LIST_ID}`).append(new_content);
+            })
+            .then(draw_all_avatars)
+            .finally(() => {is_loading_results = false;});
+    }
+});
@@ -0,0 +1,21 @@
+"""
+    Gunicorn configuration, loaded automatically when gunicorn runs from this directory.
+    Sets up the shared directory of the Prometheus multiprocess metrics (see app.modules.metrics).
+"""
+import os
+import shutil
+import tempfile
+
+METRICS_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+
+def on_starting(server):
+    # the metrics directory must be empty when the workers start
+    metrics_dir = os.environ.setdefault(METRICS_DIR_ENV, os.path.join(tempfile.gettempdir(), 'genetwork_metrics'))
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
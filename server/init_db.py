@@ -3,7 +3,7 @@
     recreating them.
     Supplied as a utility but no longer necessary for user generation.
 """
-from app.models import UserFactory, User
+from app.models import UserFactory, User, UserGeneration
 from app.config.avatar import Avatar
 from app.config import USER_COUNT
 from app import db, create_app
@@ -27,6 +27,7 @@ if __name__ == '__main__':
         for _ in range(USER_COUNT):
             db.session.add(user_factory.randomize())
         
+        UserGeneration.bump()
         db.session.commit()
     
     # shows first few users
@@ -0,0 +1,66 @@
+"""
+    Fixtures of the tests, which run against the in-process key-value store.
+    A single app is created for all tests (the app's modules are configured on
+    import), of the hard difficulty with the key-value session backend.
+"""
+from types import SimpleNamespace
+import os
+import sys
+import tempfile
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+
+class FakeClock:
+    """A monotonic clock which only advances when told to"""
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the clock of the in-process key-value store with a FakeClock"""
+    from app.modules import kv_store
+    fake_clock = FakeClock()
+    monkeypatch.setattr(kv_store, 'time', SimpleNamespace(monotonic=fake_clock))
+    return fake_clock
+
+
+@pytest.fixture(scope='session')
+def app():
+    import app.config as app_config
+    app_config.INSTANCE_DIR = tempfile.mkdtemp()
+    from app import create_app
+    return create_app(deploy_type='test', difficulty='hard', session_backend='memory')
+
+
+@pytest.fixture
+def store(app):
+    """The app's in-process key-value store, emptied for every test"""
+    store = app.extensions['kv_store']
+    store.flushall()
+    return store
+
+
+@pytest.fixture
+def client(app, store):
+    return app.test_client()
+
+
+@pytest.fixture
+def session_id():
+    """Returns a function which gets the session id in a test client's session"""
+    from app.modules.session_manager import SessionHandler
+
+    def get_session_id(client):
+        with client.session_transaction() as session:
+            return session[SessionHandler.SESSION_ID_FIELD]
+    return get_session_id
@@ -0,0 +1,71 @@
+"""
+    Tests of session expiry through the TTLs of session keys.
+"""
+import pytest
+from app.models import Villain
+from app.modules.session_manager import SessionKeyExpiry
+
+
+@pytest.fixture
+def session_duration(app):
+    with app.app_context():
+        return SessionKeyExpiry.app_expiry().session_duration
+
+
+def marker_key(ssid):
+    return SessionKeyExpiry.SESSION_KEY_TEMPLATE.format(ssid)
+
+
+def store_villain_counters(client):
+    """Makes a request which stores the counters of the session's villain"""
+    client.post('/api/part_from_user', data={'id': Villain.FAKE_COLS['user_id'], 'part': 'head'})
+
+
+def test_new_session_has_marker(client, store, session_id, session_duration):
+    client.get('/')
+    assert store.ttl(marker_key(session_id(client))) == session_duration
+
+
+def test_request_refreshes_ttls(client, store, clock, session_id, session_duration):
+    client.get('/')
+    store_villain_counters(client)
+    ssid = session_id(client)
+    villain_key = Villain.KV_KEY_TEMPLATE.format(ssid)
+    assert store.exists(villain_key)
+
+    clock.advance(session_duration - 10)
+    assert store.ttl(marker_key(ssid)) == 10
+    client.get('/')
+    assert session_id(client) == ssid
+    assert store.ttl(marker_key(ssid)) == session_duration
+    assert store.ttl(villain_key) == session_duration
+
+
+def test_expired_session_is_renewed(client, store, clock, session_id, session_duration):
+    client.get('/')
+    store_villain_counters(client)
+    ssid = session_id(client)
+
+    clock.advance(session_duration)
+    client.get('/')
+    renewed_ssid = session_id(client)
+    assert renewed_ssid != ssid
+    assert store.ttl(marker_key(renewed_ssid)) == session_duration
+    assert not store.exists(marker_key(ssid), Villain.KV_KEY_TEMPLATE.format(ssid))
+
+
+def test_only_registered_keys_are_refreshed(client, store, clock, session_id, session_duration):
+    client.get('/')
+    store.set('unregistered', 1, ex=session_duration)
+    clock.advance(session_duration - 10)
+    client.get('/')
+    assert store.ttl('unregistered') == 10
+
+
+def test_keys_created_later_expire_with_session(app, store, session_duration):
+    with app.app_context():
+        pipeline = store.pipeline()
+        pipeline.set('name', 1)
+        SessionKeyExpiry.expire_with_session(pipeline, 'name')
+        pipeline.execute()
+    assert store.ttl('name') == session_duration
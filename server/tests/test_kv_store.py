@@ -0,0 +1,144 @@
+"""
+    Tests of the in-process stand-in for a Redis server.
+"""
+import pytest
+from app.modules.kv_store import InProcessRedis, connect
+
+
+@pytest.fixture
+def redis(clock):
+    return InProcessRedis()
+
+
+def test_connect_memory_url():
+    assert isinstance(connect('memory://'), InProcessRedis)
+
+
+def test_values_are_bytes(redis):
+    redis.set('name', 'value')
+    redis.hset('hash', 'field', 3)
+    assert redis.get('name') == b'value'
+    assert redis.hgetall('hash') == {b'field': b'3'}
+    assert redis.get('missing') is None
+
+
+def test_set_nx_keeps_existing_value(redis):
+    assert redis.set('name', 'first', nx=True)
+    assert redis.set('name', 'second', nx=True) is None
+    assert redis.get('name') == b'first'
+
+
+def test_wrong_type(redis):
+    redis.set('name', 'value')
+    with pytest.raises(ValueError):
+        redis.hget('name', 'field')
+
+
+def test_ttl_states(redis):
+    assert redis.ttl('missing') == -2
+    redis.set('name', 'value')
+    assert redis.ttl('name') == -1
+    assert redis.expire('name', 10)
+    assert redis.ttl('name') == 10
+    assert not redis.expire('missing', 10)
+
+
+def test_key_expires(redis, clock):
+    redis.set('name', 'value', ex=10)
+    clock.advance(9)
+    assert redis.get('name') == b'value'
+    clock.advance(1)
+    assert redis.get('name') is None
+    assert redis.ttl('name') == -2
+    assert redis.exists('name') == 0
+
+
+def test_expire_refreshes_ttl(redis, clock):
+    redis.set('name', 'value', ex=10)
+    clock.advance(8)
+    redis.expire('name', 10)
+    clock.advance(8)
+    assert redis.get('name') == b'value'
+    assert redis.ttl('name') == 2
+
+
+def test_expired_key_is_recreated_without_ttl(redis, clock):
+    redis.hset('hash', 'field', 1)
+    redis.expire('hash', 10)
+    clock.advance(10)
+    assert redis.hincrby('hash', 'field') == 1
+    assert redis.ttl('hash') == -1
+
+
+def test_sweep_removes_expired_keys(redis, clock):
+    redis.set('name', 'value', ex=1)
+    clock.advance(InProcessRedis.SWEEP_INTERVAL + 1)
+    redis.get('other')
+    assert redis._data == {}
+    assert redis._deadlines == {}
+
+
+def test_set_clears_ttl(redis):
+    redis.set('name', 'value', ex=10)
+    redis.set('name', 'other')
+    assert redis.ttl('name') == -1
+
+
+def test_hincrby(redis):
+    assert redis.hincrby('hash', 'count') == 1
+    assert redis.hincrby('hash', 'count', 5) == 6
+    assert redis.hget('hash', 'count') == b'6'
+
+
+def test_empty_hash_is_deleted(redis):
+    redis.hset('hash', mapping={'a': 1, 'b': 2})
+    assert redis.hdel('hash', 'a', 'b', 'c') == 2
+    assert redis.exists('hash') == 0
+
+
+def test_zset_order(redis):
+    redis.zadd('zset', {'b': 2, 'a': 2, 'c': 1})
+    assert redis.zrange('zset', 0, -1) == [b'c', b'a', b'b']
+    assert redis.zrange('zset', 0, 0, withscores=True) == [(b'c', 1.0)]
+
+
+def test_zadd_nx_and_xx(redis):
+    redis.zadd('zset', {'a': 1})
+    assert redis.zadd('zset', {'a': 5, 'b': 2}, nx=True) == 1
+    assert redis.zscore('zset', 'a') == 1.0
+    assert redis.zadd('zset', {'a': 3, 'c': 3}, xx=True) == 0
+    assert redis.zscore('zset', 'a') == 3.0
+    assert redis.zscore('zset', 'c') is None
+    assert redis.zadd('missing', {'a': 1}, xx=True) == 0
+    assert redis.exists('missing') == 0
+
+
+def test_zpopmin(redis):
+    redis.zadd('zset', {'a': 3, 'b': 1, 'c': 2})
+    assert redis.zpopmin('zset') == [(b'b', 1.0)]
+    assert redis.zpopmin('zset', 5) == [(b'c', 2.0), (b'a', 3.0)]
+    assert redis.zpopmin('zset') == []
+    assert redis.exists('zset') == 0
+
+
+def test_pipeline_returns_results_in_order(redis):
+    redis.set('name', 'value')
+    pipeline = redis.pipeline()
+    pipeline.get('name').hincrby('hash', 'count').expire('hash', 10).ttl('hash')
+    assert pipeline.execute() == [b'value', 1, True, 10]
+    assert pipeline.execute() == []
+
+
+def test_pipeline_is_deferred(redis):
+    pipeline = redis.pipeline()
+    pipeline.set('name', 'value')
+    assert redis.get('name') is None
+    pipeline.execute()
+    assert redis.get('name') == b'value'
+
+
+def test_pipeline_context_discards_commands(redis):
+    with redis.pipeline() as pipeline:
+        pipeline.set('name', 'value')
+    assert pipeline.execute() == []
+    assert redis.get('name') is None
@@ -0,0 +1,107 @@
+"""
+    Tests of the LRU session cache on the key-value store.
+"""
+from itertools import count
+from uuid import uuid4
+from flask import session
+import pytest
+from app.modules.session_manager import SessionHandler, SessionKeyExpiry
+from app.modules.user_cache.redis_lru_session_cache import RedisLRUSessionCache
+
+
+@pytest.fixture
+def request_session(app, store):
+    """Runs the test in a request of a session, and returns the session id"""
+    with app.test_request_context():
+        ssid = str(uuid4())
+        session[SessionHandler.SESSION_ID_FIELD] = ssid
+        yield ssid
+
+
+@pytest.fixture
+def make_cached(app):
+    """Returns a function which makes a cached function (with a cache of a given size) and it's cache"""
+    def make_cached(max_size, recency_interval=0):
+        with app.app_context():
+            cache = RedisLRUSessionCache(max_size=max_size, recency_interval=recency_interval)
+        access_times = count(1)
+        cache._now = lambda: next(access_times)     # every access is later than the previous one
+        cache.calls = []
+
+        @cache
+        def echo(value):
+            cache.calls.append(value)
+            return value
+        return echo, cache
+    return make_cached
+
+
+def cached_keys(store, cache, ssid):
+    """Returns the cached parameters of a session by their access order"""
+    values_key, access_key = cache._session_keys(ssid)
+    ordered = [key.decode('utf-8') for key in store.zrange(access_key, 0, -1)]
+    assert sorted(ordered) == sorted(key.decode('utf-8') for key in store.hgetall(values_key))
+    return ordered
+
+
+def test_hit_skips_call(make_cached, request_session):
+    echo, cache = make_cached(max_size=4)
+    assert echo('a') == 'a'
+    assert echo('a') == 'a'
+    assert echo('b') == 'b'
+    assert cache.calls == ['a', 'b']
+
+
+def test_sessions_are_separate(app, store, make_cached, request_session):
+    echo, cache = make_cached(max_size=4)
+    echo('a')
+    with app.test_request_context():
+        session[SessionHandler.SESSION_ID_FIELD] = str(uuid4())
+        echo('a')
+    assert cache.calls == ['a', 'a']
+
+
+def test_evicts_least_recently_used(store, make_cached, request_session):
+    echo, cache = make_cached(max_size=3)
+    for value in 'abc':
+        echo(value)
+    echo('a')   # a hit refreshes the access time of 'a'
+    echo('d')
+    assert cached_keys(store, cache, request_session) == [str(('c',)), str(('a',)), str(('d',))]
+    echo('b')
+    assert cache.calls == ['a', 'b', 'c', 'd', 'b']
+
+
+def test_recent_hit_keeps_access_time(store, make_cached, request_session):
+    echo, cache = make_cached(max_size=3, recency_interval=10)
+    for value in 'abc':
+        echo(value)
+    echo('a')   # accessed too recently to be refreshed
+    echo('d')
+    assert cached_keys(store, cache, request_session) == [str(('b',)), str(('c',)), str(('d',))]
+
+
+def test_size_bound(store, make_cached, request_session):
+    echo, cache = make_cached(max_size=3)
+    for value in range(10):
+        echo(value)
+    assert cached_keys(store, cache, request_session) == [str((value,)) for value in (7, 8, 9)]
+
+
+def test_size_bound_after_concurrent_stores(store, make_cached, request_session):
+    echo, cache = make_cached(max_size=3)
+    values_key, access_key = cache._session_keys(request_session)
+    # stores of concurrent requests which exceeded the size before evicting
+    for value in range(5):
+        store.hset(values_key, str((value,)), value)
+        store.zadd(access_key, {str((value,)): value - 5})   # accessed before 'a'
+    echo('a')
+    assert cached_keys(store, cache, request_session) == [str((3,)), str((4,)), str(('a',))]
+
+
+def test_keys_expire_with_session(store, make_cached, request_session):
+    echo, cache = make_cached(max_size=3)
+    echo('a')
+    session_duration = SessionKeyExpiry.app_expiry().session_duration
+    for key in cache._session_keys(request_session):
+        assert store.ttl(key) == session_duration
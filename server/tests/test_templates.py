@@ -0,0 +1,16 @@
+"""
+    Tests of the escaping of request values in rendered pages.
+"""
+import re
+
+SEARCH_TERM = '"><script>alert(1)</script>'
+
+
+def test_search_term_is_escaped(client):
+    response = client.post('/', data={'search': SEARCH_TERM, 'privacySelect': SEARCH_TERM})
+    html = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert '<script>alert(1)</script>' not in html
+    attributes = re.search(r'<ul[^>]*id="searchUserList"[^>]*>', html).group(0)
+    assert 'data-search="&#34;&gt;&lt;script&gt;alert(1)&lt;/script&gt;"' in attributes
+    assert 'data-privacy-select="&#34;&gt;&lt;script&gt;alert(1)&lt;/script&gt;"' in attributes
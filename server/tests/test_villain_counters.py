@@ -0,0 +1,84 @@
+"""
+    Tests of the villain counters in the key-value store.
+"""
+from uuid import uuid4
+from flask import session
+import pytest
+from app.models import Villain
+from app.modules.session_manager import SessionHandler, SessionKeyExpiry
+
+MAX_DETECTIONS = 3  # a low detection limit, so tests shapeshift quickly
+
+
+@pytest.fixture
+def villain(app, store, monkeypatch):
+    """Runs the test in a request of a new session, and returns the session's villain"""
+    monkeypatch.setattr(Villain, 'MAX_DETECTIONS', MAX_DETECTIONS)
+    with app.test_request_context():
+        session[SessionHandler.SESSION_ID_FIELD] = str(uuid4())
+        yield Villain.get_session_villain()
+
+
+def counters(store, villain):
+    return store.hgetall(Villain.KV_KEY_TEMPLATE.format(villain.ssid))
+
+
+def test_new_villain_stores_nothing(store, villain):
+    assert villain.detections == 0
+    assert villain.shapeshifts == 0
+    assert villain.dna == Villain.derive_dna(villain.ssid, 0)
+    assert counters(store, villain) == {}
+
+
+def test_detections_are_counted(store, villain):
+    villain.notify_detection()
+    villain.notify_detection()
+    assert villain.detections == 2
+    assert counters(store, villain) == {b'detections': b'2'}
+    assert Villain.get_session_villain().detections == 2
+
+
+def test_concurrent_detections_are_counted(store, villain):
+    # a villain loaded by another request, before this request's detections
+    other = Villain.get_session_villain()
+    villain.notify_detection()
+    other.notify_detection()
+    assert other.detections == 2
+    assert counters(store, villain) == {b'detections': b'2'}
+
+
+def test_shapeshifts_after_max_detections(store, villain):
+    for _ in range(MAX_DETECTIONS):
+        villain.notify_detection()
+    assert villain.shapeshifts == 0
+    villain.notify_detection()
+    assert villain.detections == 0
+    assert villain.shapeshifts == 1
+    assert villain.dna == Villain.derive_dna(villain.ssid, 1)
+    assert counters(store, villain) == {b'detections': b'0', b'shapeshifts': b'1'}
+    assert Villain.get_session_villain().dna == villain.dna
+
+
+def test_shapeshifts_once_at_threshold(store, villain):
+    other = Villain.get_session_villain()
+    for _ in range(MAX_DETECTIONS):
+        villain.notify_detection()
+    villain.notify_detection()
+    # detections of a request which loaded the villain before the shapeshift count from zero
+    other.notify_detection()
+    assert Villain.get_session_villain().shapeshifts == 1
+    assert counters(store, villain) == {b'detections': b'1', b'shapeshifts': b'1'}
+
+
+def test_shapeshifts_over_emergency_limit(store, villain):
+    over_limit = MAX_DETECTIONS + Villain._EMERGENCY_OVER
+    store.hset(Villain.KV_KEY_TEMPLATE.format(villain.ssid), 'detections', over_limit)
+    villain.notify_detection()
+    assert villain.shapeshifts == 1
+    assert villain.detections == 0
+
+
+def test_counters_expire_with_session(store, villain):
+    villain.notify_detection()
+    session_duration = SessionKeyExpiry.app_expiry().session_duration
+    assert store.ttl(Villain.KV_KEY_TEMPLATE.format(villain.ssid)) == session_duration
@@ -1,5 +1,6 @@
 """
     List of 64 selected color names for the avatar module
+    and their RGB values (as defined in CSS)
 """
 
 COLOR_NAMES = [
@@ -68,3 +69,70 @@ COLOR_NAMES = [
     "lightgray",
     "darkslategray"
 ]
+
+COLOR_RGB = {
+    "red": (255, 0, 0),
+    "salmon": (250, 128, 114),
+    "lightsalmon": (255, 160, 122),
+    "darkred": (139, 0, 0),
+    "crimson": (220, 20, 60),
+    "pink": (255, 192, 203),
+    "hotpink": (255, 105, 180),
+    "deeppink": (255, 20, 147),
+    "mediumvioletred": (199, 21, 133),
+    "palevioletred": (219, 112, 147),
+    "coral": (255, 127, 80),
+    "tomato": (255, 99, 71),
+    "orangered": (255, 69, 0),
+    "darkorange": (255, 140, 0),
+    "orange": (255, 165, 0),
+    "gold": (255, 215, 0),
+    "yellow": (255, 255, 0),
+    "darkkhaki": (189, 183, 107),
+    "khaki": (240, 230, 140),
+    "lemonchiffon": (255, 250, 205),
+    "palegoldenrod": (238, 232, 170),
+    "thistle": (216, 191, 216),
+    "fuchsia": (255, 0, 255),
+    "orchid": (218, 112, 214),
+    "violet": (238, 130, 238),
+    "darkviolet": (148, 0, 211),
+    "purple": (128, 0, 128),
+    "rebeccapurple": (102, 51, 153),
+    "indigo": (75, 0, 130),
+    "lavender": (230, 230, 250),
+    "mediumpurple": (147, 112, 219),
+    "chartreuse": (127, 255, 0),
+    "lime": (0, 255, 0),
+    "limegreen": (50, 205, 50),
+    "palegreen": (152, 251, 152),
+    "springgreen": (0, 255, 127),
+    "green": (0, 128, 0),
+    "darkgreen": (0, 100, 0),
+    "seagreen": (46, 139, 87),
+    "olive": (128, 128, 0),
+    "teal": (0, 128, 128),
+    "aqua": (0, 255, 255),
+    "aquamarine": (127, 255, 212),
+    "steelblue": (70, 130, 180),
+    "skyblue": (135, 206, 235),
+    "deepskyblue": (0, 191, 255),
+    "blue": (0, 0, 255),
+    "navy": (0, 0, 128),
+    "midnightblue": (25, 25, 112),
+    "maroon": (128, 0, 0),
+    "brown": (165, 42, 42),
+    "sienna": (160, 82, 45),
+    "saddlebrown": (139, 69, 19),
+    "chocolate": (210, 105, 30),
+    "tan": (210, 180, 140),
+    "bisque": (255, 228, 196),
+    "cornsilk": (255, 248, 220),
+    "white": (255, 255, 255),
+    "beige": (245, 245, 220),
+    "antiquewhite": (250, 235, 215),
+    "gray": (128, 128, 128),
+    "dimgray": (105, 105, 105),
+    "lightgray": (211, 211, 211),
+    "darkslategray": (47, 79, 79),
+}
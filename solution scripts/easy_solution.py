@@ -13,7 +13,7 @@ class EasyAttacker(Attacker):
         empty_cookie (str): the session cookie upon creation,
             should have an empty cache on creation.
     """
-    CACHE_NAME = 'cache_for_part_to_dict'
+    CACHE_NAME = 'cache_for_part_layers'
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)